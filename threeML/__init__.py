@@ -250,8 +250,9 @@ import os
 # Import the LAT data downloader
 from threeML.utils.data_download.Fermi_LAT.download_LAT_data import download_LAT_data
 
-# Import the results loader
+# Import the results loader and the columnar results store
 from threeML.analysis_results import load_analysis_results
+from threeML.io.results_store import AnalysisResultsStore
 
 # Import the plot_style context manager and the function to create new styles
 from .io.plotting.plot_style import plot_style, create_new_plotting_style, get_available_plotting_styles
@@ -1,8 +1,7 @@
 import collections
 import datetime
-import functools
-import inspect
 import math
+import os
 
 import astromodels
 import astropy.units as u
@@ -34,11 +33,16 @@ from threeML.io.rich_display import display
 from threeML.io.table import NumericMatrix
 from threeML.io.uncertainty_formatter import uncertainty_formatter
 from threeML.io.results_table import ResultsTable
+from threeML.io.results_store import AnalysisResultsStore, is_hdf5_file
 from threeML.version import __version__
 from threeML.random_variates import RandomVariates
+from threeML.utils.fitted_objects.propagation import PropagatedFunction
 from threeML.io.calculate_flux import _calculate_point_source_flux
 from threeML.config.config import threeML_config
 
+# Names of files which AnalysisResultsSet.write_to writes in HDF5 format (instead of FITS)
+_hdf5_extensions = ('.h5', '.hdf5', '.hdf')
+
 # These are special characters which cannot be safely saved in the keyword of a FITS file. We substitute
 # them with normal characters when we write the keyword, and we substitute them back when we read it back
 _subs = (('\n', "_NEWLINE_"), ("'", "_QUOTE1_"), ('"', "_QUOTE2_"), ('{', "_PARO_"), ('}', "_PARC_"))
@@ -58,14 +62,82 @@ def _escape_back_yaml_from_fits(yaml_code):
     return yaml_code
 
 
-def load_analysis_results(fits_file):
+# Cache of the factors of the covariance matrices used to generate the samples of MLEResults, so that results with
+# the same covariance matrix do not need to decompose it again. The least recently used factors are removed first
+_covariance_factors_cache = collections.OrderedDict()
+
+_max_covariance_factors_cache_size = 128
+
+
+def _get_covariance_factor(covariance_matrix):
+    """
+    Returns a matrix L such that L L^T is the provided covariance matrix (the Cholesky factor, if it exists)
+    """
+
+    key = (covariance_matrix.shape, covariance_matrix.tobytes())
+
+    if key in _covariance_factors_cache:
+
+        # Mark it as the most recently used
+
+        factor = _covariance_factors_cache.pop(key)
+
+    else:
+
+        try:
+
+            factor = np.linalg.cholesky(covariance_matrix)
+
+        except np.linalg.LinAlgError:
+
+            # Not positive definite (for example, when a variance is zero): use the eigendecomposition, clipping the
+            # negative eigenvalues due to round-off
+
+            eigenvalues, eigenvectors = np.linalg.eigh(covariance_matrix)
+
+            factor = eigenvectors * np.sqrt(np.clip(eigenvalues, 0, None))
+
+        if len(_covariance_factors_cache) >= _max_covariance_factors_cache_size:
+
+            _covariance_factors_cache.popitem(last=False)
+
+    _covariance_factors_cache[key] = factor
+
+    return factor
+
+
+def _multivariate_normal_samples(mean, covariance_matrix, n_samples):
+    """
+    Generates samples from a multivariate normal distribution
+
+    :param mean: the mean (a 1d array with n elements)
+    :param covariance_matrix: the (n, n) covariance matrix
+    :param n_samples: number of samples
+    :return: a (n_samples, n) array
+    """
+
+    factor = _get_covariance_factor(covariance_matrix)
+
+    return mean + np.dot(np.random.standard_normal((n_samples, mean.shape[0])), factor.T)
+
+
+def load_analysis_results(fits_file, lazy=False):
     """
     Load the results of one or more analysis from a FITS file produced by 3ML
 
-    :param fits_file: path to the FITS file containing the results, as output by MLEResults or BayesianResults
-    :return: a new instance of either MLEResults or Bayesian results dending on the type of the input FITS file
+    :param fits_file: path to the FITS file containing the results, as output by MLEResults or BayesianResults, or
+    to an HDF5 file written by AnalysisResultsSet.write_to or AnalysisResultsStore
+    :param lazy: for files containing a set of results, read each result only when it is accessed (default: False).
+    The file must then stay where it is as long as the results are used, and it cannot be a compressed FITS file. See
+    AnalysisResultsSet
+    :return: a new instance of either MLEResults or Bayesian results dending on the type of the input FITS file (or
+    an AnalysisResultsSet for sets of results and HDF5 files)
     """
 
+    if is_hdf5_file(fits_file):
+
+        return _load_results_store(fits_file, lazy)
+
     with fits.open(fits_file) as f:
 
         n_results = map(lambda x: x.name, f).count('ANALYSIS_RESULTS')
@@ -76,33 +148,30 @@ def load_analysis_results(fits_file):
 
         else:
 
-            return _load_set_of_results(f, n_results)
+            return _load_set_of_results(f, n_results, fits_file if lazy else None)
 
 
-def _load_one_results(fits_extension):
-    # Gather analysis type
-    analysis_type = fits_extension.header.get("RESUTYPE")
-
-    # Gather the optimized model
-    serialized_model = _escape_back_yaml_from_fits(fits_extension.header.get("MODEL"))
-    model_dict = my_yaml.load(serialized_model)
+def _read_statistics(header):
+    """
+    Returns the statistic values and the statistical measures stored in the header of an ANALYSIS_RESULTS extension
 
-    optimized_model = ModelParser(model_dict=model_dict).get_model()
+    :param header: the header
+    :return: a tuple of two ordered dictionaries (statistic values, statistical measures)
+    """
 
-    # Gather statistics values
     statistic_values = collections.OrderedDict()
 
     measure_values = collections.OrderedDict()
 
-    for key in fits_extension.header.keys():
+    for key in header.keys():
 
         if key.find("STAT") == 0:
             # Found a keyword with a statistic for a plugin
             # Gather info about it
 
             id = int(key.replace("STAT", ""))
-            value = float(fits_extension.header.get(key))
-            name = fits_extension.header.get("PN%i" % id)
+            value = float(header.get(key))
+            name = header.get("PN%i" % id)
             statistic_values[name] = value
 
         if key.find("MEAS") == 0:
@@ -110,10 +179,26 @@ def _load_one_results(fits_extension):
             # Gather info about it
 
             id = int(key.replace("MEAS", ""))
-            name = fits_extension.header.get(key)
-            value = float(fits_extension.header.get("MV%i" % id))
+            name = header.get(key)
+            value = float(header.get("MV%i" % id))
             measure_values[name] = value
 
+    return statistic_values, measure_values
+
+
+def _load_one_results(fits_extension):
+    # Gather analysis type
+    analysis_type = fits_extension.header.get("RESUTYPE")
+
+    # Gather the optimized model
+    serialized_model = _escape_back_yaml_from_fits(fits_extension.header.get("MODEL"))
+    model_dict = my_yaml.load(serialized_model)
+
+    optimized_model = ModelParser(model_dict=model_dict).get_model()
+
+    # Gather statistics values
+    statistic_values, measure_values = _read_statistics(fits_extension.header)
+
     if analysis_type == "MLE":
 
         # Get covariance matrix
@@ -122,26 +207,36 @@ def _load_one_results(fits_extension):
 
         # Instance and return
 
-        return MLEResults(optimized_model, covariance_matrix, statistic_values, statistical_measures=measure_values)
+        return MLEResults(optimized_model, covariance_matrix, statistic_values, statistical_measures=measure_values,
+                          lazy_samples=True)
 
     elif analysis_type == "Bayesian":
 
-        # Gather samples
-        samples = fits_extension.data.field("SAMPLES")
+        # Gather samples (making a copy, so that they do not depend on the file)
+        samples = np.array(fits_extension.data.field("SAMPLES"))
 
         # Instance and return
 
         return BayesianResults(optimized_model, samples.T, statistic_values, statistical_measures=measure_values)
 
 
-def _load_set_of_results(open_fits_file, n_results):
-    # Gather all results
-    all_results = []
+def _load_set_of_results(open_fits_file, n_results, lazy_fits_file=None):
 
-    for i in range(n_results):
-        all_results.append(_load_one_results(open_fits_file['ANALYSIS_RESULTS', i + 1]))
+    if lazy_fits_file is not None:
 
-    this_set = AnalysisResultsSet(all_results)
+        # Only index the results, they will be read when accessed
+
+        results = _ResultsFromFITS(lazy_fits_file, open_fits_file)
+
+    else:
+
+        # Gather all results
+        results = []
+
+        for i in range(n_results):
+            results.append(_load_one_results(open_fits_file['ANALYSIS_RESULTS', i + 1]))
+
+    this_set = AnalysisResultsSet(results)
 
     # Now gather the SEQUENCE extension and set the characterization frame accordingly
 
@@ -158,11 +253,11 @@ def _load_set_of_results(open_fits_file, n_results):
 
         if column.unit is None:
 
-            this_tuple = (column.name, record[column.name])
+            this_tuple = (column.name, np.array(record[column.name]))
 
         else:
 
-            this_tuple = (column.name, record[column.name] * u.Unit(column.unit))
+            this_tuple = (column.name, np.array(record[column.name]) * u.Unit(column.unit))
 
         data_list.append(this_tuple)
 
@@ -171,6 +266,219 @@ def _load_set_of_results(open_fits_file, n_results):
     return this_set
 
 
+def _load_results_store(filename, lazy):
+
+    store = AnalysisResultsStore(filename)
+
+    results = _ResultsFromStore(store)
+
+    this_set = AnalysisResultsSet(results if lazy else list(results))
+
+    sequence = store.get_sequence()
+
+    if sequence is not None:
+
+        this_set.characterize_sequence(*sequence)
+
+    return this_set
+
+
+def _get_summary_data_frame(rows):
+    """
+    Builds the data frame returned by AnalysisResultsSet.get_summary_data_frame
+
+    :param rows: a list of tuples (values, errors, statistic values, statistical measures), one for each result, where
+    each element is a dictionary (or a pandas Series)
+    :return: a pandas DataFrame
+    """
+
+    frames = [pd.DataFrame([pd.Series(row[i]) for row in rows]) for i in range(4)]
+
+    return pd.concat(frames, axis=1, keys=['value', 'error', 'statistic', 'measure'])
+
+
+class _LazilyReadResults(collections.Sequence):
+
+    # Default maximum number of results kept in memory
+
+    _max_loaded_results = 100
+
+    def __init__(self, max_loaded_results=_max_loaded_results):
+        """
+        Base class for the read-only sequences of results which are read from a file only when they are accessed. The
+        most recently used results are kept in memory.
+
+        :param max_loaded_results: maximum number of results kept in memory
+        """
+
+        self._max_loaded_results = int(max_loaded_results)
+
+        self._loaded_results = collections.OrderedDict()
+
+    def __getitem__(self, item):
+
+        if isinstance(item, slice):
+
+            return [self[i] for i in range(*item.indices(len(self)))]
+
+        if item < 0:
+
+            item += len(self)
+
+        if not 0 <= item < len(self):
+
+            raise IndexError("Index out of range")
+
+        if item in self._loaded_results:
+
+            # Mark it as the most recently used
+
+            results = self._loaded_results.pop(item)
+
+        else:
+
+            results = self._read_results(item)
+
+            if len(self._loaded_results) >= self._max_loaded_results:
+
+                self._loaded_results.popitem(last=False)
+
+        self._loaded_results[item] = results
+
+        return results
+
+    def __len__(self):
+
+        raise NotImplementedError("Must be implemented by the subclasses")
+
+    def _read_results(self, item):
+
+        raise NotImplementedError("Must be implemented by the subclasses")
+
+    def get_summary_data_frame(self):
+
+        raise NotImplementedError("Must be implemented by the subclasses")
+
+
+class _ResultsFromFITS(_LazilyReadResults):
+
+    def __init__(self, fits_file, open_fits_file, **kwargs):
+        """
+        A read-only sequence of the results contained in a FITS file, which are read only when they are accessed. At
+        creation only the position in the file and the statistic values of each result are read (from the headers).
+
+        :param fits_file: the name of the FITS file
+        :param open_fits_file: the file, already open
+        :param kwargs: see _LazilyReadResults
+        """
+
+        super(_ResultsFromFITS, self).__init__(**kwargs)
+
+        self._fits_file = sanitize_filename(fits_file, abspath=True)
+
+        # The positions of the extensions refer to the uncompressed content, so a compressed file (which does not
+        # start with the SIMPLE keyword) cannot be read from them. Reading it again for each result instead would
+        # decompress the whole file every time
+
+        with open(self._fits_file, 'rb') as f:
+
+            if f.read(6) != b'SIMPLE':
+
+                raise ValueError("Compressed FITS files cannot be read lazily. Use lazy=False, or decompress %s "
+                                 "first" % self._fits_file)
+
+        # For each result: beginning and end of the extension in the file, statistic values and statistical measures
+
+        self._index = []
+
+        for hdu in open_fits_file:
+
+            if hdu.name != 'ANALYSIS_RESULTS':
+
+                continue
+
+            file_info = hdu.fileinfo()
+
+            statistic_values, measure_values = _read_statistics(hdu.header)
+
+            self._index.append((file_info['hdrLoc'], file_info['datLoc'] + file_info['datSpan'],
+                                statistic_values, measure_values))
+
+    def __len__(self):
+
+        return len(self._index)
+
+    def _read_results(self, item):
+
+        start, stop = self._index[item][:2]
+
+        # Read only the bytes of this extension
+
+        with open(self._fits_file, 'rb') as f:
+
+            f.seek(start)
+
+            hdu = fits.BinTableHDU.fromstring(f.read(stop - start))
+
+        return _load_one_results(hdu)
+
+    def get_summary_data_frame(self):
+
+        rows = []
+
+        with fits.open(self._fits_file) as f:
+
+            extensions = [hdu for hdu in f if hdu.name == 'ANALYSIS_RESULTS']
+
+            for hdu, (_, _, statistic_values, measure_values) in zip(extensions, self._index):
+
+                names = [str(name).strip() for name in hdu.data.field("NAME")]
+
+                rows.append((dict(zip(names, hdu.data.field("VALUE"))),
+                             dict(zip(names, hdu.data.field("ERROR"))),
+                             statistic_values,
+                             measure_values))
+
+        return _get_summary_data_frame(rows)
+
+
+class _ResultsFromStore(_LazilyReadResults):
+
+    def __init__(self, store, **kwargs):
+        """
+        A read-only sequence of the results contained in an AnalysisResultsStore, which are read only when they are
+        accessed
+
+        :param store: an AnalysisResultsStore instance
+        :param kwargs: see _LazilyReadResults
+        """
+
+        super(_ResultsFromStore, self).__init__(**kwargs)
+
+        self._store = store
+
+    def __len__(self):
+
+        return len(self._store)
+
+    def _read_results(self, item):
+
+        analysis_type, model, errors_info, statistic_values, measure_values = self._store.read(item)
+
+        if analysis_type == "MLE":
+
+            return MLEResults(model, errors_info, statistic_values, statistical_measures=measure_values,
+                              lazy_samples=True)
+
+        else:
+
+            return BayesianResults(model, errors_info, statistic_values, statistical_measures=measure_values)
+
+    def get_summary_data_frame(self):
+
+        return self._store.get_summary_data_frame()
+
+
 class SEQUENCE(FITSExtension):
     """
     Represents the SEQUENCE extension of a FITS file containing a set of results from a set of analysis
@@ -358,18 +666,19 @@ class _AnalysisResults(object):
 
         self._n_free_parameters = len(optimized_model.free_parameters)
 
-        assert samples.shape[1] == self._n_free_parameters, "Number of free parameters (%s) and set of samples (%s) " \
-                                                            "do not agree." % (samples.shape[1],
-                                                                               self._n_free_parameters)
-
         # NOTE: we clone the model so that whatever happens outside or after, this copy of the model will not be
         # changed
 
         self._optimized_model = astromodels.clone_model(optimized_model)
 
-        # Save a transposed version of the samples for easier access
+        # Save a transposed version of the samples for easier access. The samples can be None if the subclass
+        # generates them only when they are first needed (see _generate_samples)
+
+        self._samples_transposed_cache = None
 
-        self._samples_transposed = samples.T
+        if samples is not None:
+
+            self._set_samples(samples)
 
         # Store likelihood values in a pandas Series
 
@@ -389,6 +698,32 @@ class _AnalysisResults(object):
         # Set the analysis type
         self._analysis_type = analysis_type
 
+    def _set_samples(self, samples):
+
+        assert samples.shape[1] == self._n_free_parameters, "Number of free parameters (%s) and set of samples (%s) " \
+                                                            "do not agree." % (samples.shape[1],
+                                                                               self._n_free_parameters)
+
+        self._samples_transposed_cache = samples.T
+
+    def _generate_samples(self):
+        """
+        Generates the samples, for subclasses which do not provide them in the constructor
+
+        :return: a (n_samples, n_free_parameters) array
+        """
+
+        raise NotImplementedError("The samples have not been provided")
+
+    @property
+    def _samples_transposed(self):
+
+        if self._samples_transposed_cache is None:
+
+            self._set_samples(self._generate_samples())
+
+        return self._samples_transposed_cache
+
     @property
     def samples(self):
         """
@@ -461,29 +796,14 @@ class _AnalysisResults(object):
         :param function: function to be wrapped
         :param **kwargs: keyword arguments specifying which random variates should substitute which argument in the
         function (see example above)
-        :return: a new function, wrapping function, which can be used to propagate errors
+        :return: a new function, wrapping function, which can be used to propagate errors. Its evaluate method
+        accepts also arrays (for example of energies), and returns an array of samples for each element
         """
 
-        # Get calling sequence of input function
-        # arguments will be a list of names, like ['a','b']
-        arguments, _, _, _ = inspect.getargspec(function)
-
-        # Get the arguments of function which have not been specified
-        # in the calling sequence (the **kwargs dictionary)
-        # (they will be excluded from the vectorization)
-        to_be_excluded = [item for item in arguments if item not in kwargs.keys()]
+        # The samples are propagated in batches: the function is called with whole arrays of samples whenever it
+        # supports it (see PropagatedFunction)
 
-        # Vectorize the function
-        vectorized = np.vectorize(function, excluded=to_be_excluded)
-
-        # Make a wrapper so we are sure that the arguments are used in the
-        # right order, as they will be taken from the kwargs
-        wrapper = functools.partial(vectorized, **kwargs)
-
-        # Finally make so that the result is always a RandomVariate
-        wrapper2 = lambda *args, **kwargs: RandomVariates(wrapper(*args, **kwargs))
-
-        return wrapper2
+        return PropagatedFunction(function, **kwargs)
 
     @property
     def optimized_model(self):
@@ -1300,18 +1620,21 @@ class MLEResults(_AnalysisResults):
     :type likelihood_values: dict
     :param n_samples: Number of samples to use
     :type n_samples: int
+    :param lazy_samples: if True, the samples are generated only when they are first needed (default: False)
+    :type lazy_samples: bool
     :return: an _AnalysisResults instance
     """
 
-    def __init__(self, optimized_model, covariance_matrix, likelihood_values, n_samples=5000, statistical_measures=None):
-
-        # Generate samples for each parameter accounting for their covariance
+    def __init__(self, optimized_model, covariance_matrix, likelihood_values, n_samples=5000, statistical_measures=None,
+                 lazy_samples=False):
 
         # Force covariance into proper type
         covariance_matrix = np.array(covariance_matrix, float, copy=True)
 
+        free_parameters = optimized_model.free_parameters.values()
+
         # Get the best fit value for each parameter
-        values = map(lambda x:x._get_internal_value(), optimized_model.free_parameters.values())
+        values = np.array(map(lambda x: x._get_internal_value(), free_parameters), float)
 
         # This is the expected shape for the covariance matrix
 
@@ -1325,37 +1648,62 @@ class MLEResults(_AnalysisResults):
 
             assert np.all(np.isfinite(covariance_matrix)), "Covariance matrix contains Nan or inf. Cannot continue."
 
-            # Generate samples from the multivariate normal distribution, i.e., accounting for the covariance of the
-            # parameters
-
-            samples = np.random.multivariate_normal(np.array(values).T, covariance_matrix, n_samples)
+            self._has_covariance = True
 
         else:
 
-            # No error information, just make duplicates of the values
-            samples = np.ones((n_samples, len(values))) * np.array(values)
+            # No error information, the samples will be just duplicates of the values
+
+            self._has_covariance = False
 
             # Make a fake covariance matrix
             covariance_matrix = np.zeros(expected_shape)
 
-        # Now reject the samples outside of the boundaries. If we reject more than 1% we warn the user
-
-        # Gather boundaries
+        # Gather boundaries, which are used to reject the samples
         # NOTE: every None boundary will become nan thanks to the casting to float
-        low_bounds = np.array(map(lambda x: x._get_internal_min_value(), optimized_model.free_parameters.values()), float)
-        hi_bounds = np.array(map(lambda x: x._get_internal_max_value(), optimized_model.free_parameters.values()), float)
+        low_bounds = np.array(map(lambda x: x._get_internal_min_value(), free_parameters), float)
+        hi_bounds = np.array(map(lambda x: x._get_internal_max_value(), free_parameters), float)
 
         # Fix all nans
         low_bounds[np.isnan(low_bounds)] = -np.inf
         hi_bounds[np.isnan(hi_bounds)] = np.inf
 
-        to_be_kept_mask = np.ones(samples.shape[0], bool)
+        self._internal_values = values
+        self._internal_low_bounds = low_bounds
+        self._internal_hi_bounds = hi_bounds
+        self._n_samples = int(n_samples)
+
+        # Store the covariance matrix
+
+        self._covariance_matrix = covariance_matrix
+
+        # Build the class. The samples are generated by _generate_samples, either now or (if lazy_samples is True)
+        # when they are first needed
+
+        super(MLEResults, self).__init__(optimized_model, None, likelihood_values, "MLE", statistical_measures)
+
+        if not lazy_samples:
+
+            self._set_samples(self._generate_samples())
+
+    def _generate_samples(self):
+
+        # Generate samples for each parameter accounting for their covariance
+
+        if self._has_covariance:
 
-        for i, sample in enumerate(samples):
+            # Generate samples from the multivariate normal distribution, i.e., accounting for the covariance of the
+            # parameters
+
+            samples = _multivariate_normal_samples(self._internal_values, self._covariance_matrix, self._n_samples)
+
+        else:
+
+            samples = np.ones((self._n_samples, self._internal_values.shape[0])) * self._internal_values
+
+        # Now reject the samples outside of the boundaries. If we reject more than 1% we warn the user
 
-            if np.any(sample > hi_bounds) or np.any(sample < low_bounds):
-                # Remove this sample
-                to_be_kept_mask[i] = False
+        to_be_kept_mask = ~np.any((samples > self._internal_hi_bounds) | (samples < self._internal_low_bounds), axis=1)
 
         # Compute how many samples we have removed
         n_removed_samples = samples.shape[0] - np.sum(to_be_kept_mask)
@@ -1372,19 +1720,13 @@ class MLEResults(_AnalysisResults):
         samples = samples[to_be_kept_mask, :]
 
         # Now transform in the external space
-        for i, parameter in enumerate(optimized_model.free_parameters.values()):
+        for i, parameter in enumerate(self._free_parameters.values()):
 
             if parameter.has_transformation():
 
                 samples[:, i] = parameter.transformation.backward(samples[:, i])
 
-        # Finally build the class
-
-        super(MLEResults, self).__init__(optimized_model, samples, likelihood_values, "MLE", statistical_measures)
-
-        # Store the covariance matrix
-
-        self._covariance_matrix = covariance_matrix
+        return samples
 
     @property
     def covariance_matrix(self):
@@ -1443,12 +1785,42 @@ class AnalysisResultsSet(collections.Sequence):
     A container for results which behaves like a list (but you cannot add/remove elements).
 
     You can index (analysis_set[0]), iterate (for item in analysis_set) and measure with len()
+
+    The sets read with load_analysis_results contain all the results, already read from the file, unless lazy=True is
+    used. In that case each result is read from the file only when it is accessed, and only the most recently used ones
+    are kept in memory. Use get_summary_data_frame to get the best fit values of all the results without reading them.
     """
 
     def __init__(self, results):
 
         self._results = results
 
+    def get_summary_data_frame(self):
+        """
+        Returns a data frame with one row for each result, containing the best fit values and the errors of the free
+        parameters, the statistic values and the statistical measures. The columns are grouped under 'value', 'error',
+        'statistic' and 'measure' (for example, frame['value'] contains the best fit values).
+
+        For sets read with load_analysis_results this is read directly from the file, without reading the results.
+
+        :return: a pandas DataFrame
+        """
+
+        if isinstance(self._results, _LazilyReadResults):
+
+            return self._results.get_summary_data_frame()
+
+        rows = []
+
+        for results in self._results:
+
+            data_frame = results.get_data_frame(error_type="equal tail")
+
+            rows.append((data_frame['value'], data_frame['error'], results.optimal_statistic_values,
+                         results.statistical_measures))
+
+        return _get_summary_data_frame(rows)
+
     def __getitem__(self, item):
 
         return self._results[item]
@@ -1538,7 +1910,8 @@ class AnalysisResultsSet(collections.Sequence):
 
     def write_to(self, filename, overwrite=False):
         """
-        Write this set of results to a FITS file.
+        Write this set of results to a FITS file or, if the name of the file ends with .h5, .hdf5 or .hdf, to an HDF5
+        file organized by columns (see AnalysisResultsStore), which is faster to read for large sets.
 
         :param filename: name for the output file
         :param overwrite: True or False
@@ -1553,6 +1926,30 @@ class AnalysisResultsSet(collections.Sequence):
 
             self.characterize_sequence("unspecified", frame_tuple)
 
-        fits = AnalysisResultsFITS(*self, sequence_tuple=self._sequence_tuple, sequence_name=self._sequence_name)
+        filename = sanitize_filename(filename)
+
+        if os.path.splitext(filename)[1].lower() in _hdf5_extensions:
+
+            if os.path.exists(filename):
+
+                if overwrite:
+
+                    os.remove(filename)
+
+                else:
+
+                    raise IOError("The file %s already exists!" % filename)
+
+            store = AnalysisResultsStore(filename)
+
+            for results in self:
+
+                store.append(results)
+
+            store.set_sequence(self._sequence_name, self._sequence_tuple)
+
+        else:
+
+            fits = AnalysisResultsFITS(*self, sequence_tuple=self._sequence_tuple, sequence_name=self._sequence_name)
 
-        fits.writeto(sanitize_filename(filename), overwrite=overwrite)
+            fits.writeto(filename, overwrite=overwrite)
@@ -92,6 +92,22 @@ def sample_without_progress(p0, sampler, n_samples, title=None, **kwargs):
     return sampler.run_mcmc(p0, n_samples, **kwargs)
 
 
+class _VectorizedPosterior(object):
+    """
+    Make the ensemble sampler evaluate the posterior for all the walkers with one call. The sampler uses the .map
+    method of its pool to evaluate the posterior on the list of positions of the walkers, so we use this object as
+    pool and compute the posterior for all positions at once.
+    """
+
+    def __init__(self, batch_posterior):
+
+        self._batch_posterior = batch_posterior
+
+    def map(self, function, positions):
+
+        return self._batch_posterior(np.array(positions, dtype=float))
+
+
 class BayesianAnalysis(object):
     def __init__(self, likelihood_model, data_list, **kwargs):
         """
@@ -203,7 +219,7 @@ class BayesianAnalysis(object):
 
         return self._marginal_likelihood
 
-    def sample(self, n_walkers, burn_in, n_samples, quiet=False, seed=None):
+    def sample(self, n_walkers, burn_in, n_samples, quiet=False, seed=None, vectorize=False):
         """
         Sample the posterior with the Goodman & Weare's Affine Invariant Markov chain Monte Carlo
         :param n_walkers:
@@ -211,6 +227,9 @@ class BayesianAnalysis(object):
         :param n_samples:
         :param quiet: if False, do not print results
         :param seed: if provided, it is used to seed the random numbers generator before the MCMC
+        :param vectorize: if True, compute the posterior for all the walkers at once at each step (see
+        get_posterior_batch). This is much faster for plugins supporting it, such as the spectral plugins, which fold
+        the models for all walkers through the response with one matrix product. Not used in parallel computation.
 
         :return: MCMC samples
 
@@ -230,7 +249,13 @@ class BayesianAnalysis(object):
         # same set of parameters
         with use_astromodels_memoization(False):
 
-            if threeML_config['parallel']['use-parallel']:
+            if vectorize and not threeML_config['parallel']['use-parallel']:
+
+                sampler = emcee.EnsembleSampler(n_walkers, n_dim,
+                                                self.get_posterior,
+                                                pool=_VectorizedPosterior(self.get_posterior_batch))
+
+            elif threeML_config['parallel']['use-parallel']:
 
                 c = ParallelClient()
                 view = c[:]
@@ -274,7 +299,7 @@ class BayesianAnalysis(object):
         # Compute the corresponding values of the likelihood
 
         # First we need the prior
-        log_prior = map(lambda x: self._log_prior(x), self._raw_samples)
+        log_prior = self._log_prior_batch(self._raw_samples)
 
         # Now we get the log posterior and we remove the log prior
 
@@ -685,6 +710,33 @@ class BayesianAnalysis(object):
 
         return log_like + log_prior
 
+    def get_posterior_batch(self, trial_values):
+        """
+        Compute the posterior for many points at once
+
+        :param trial_values: 2d array with one set of values for the free parameters per row
+        :return: array of log posterior values, one per row
+        """
+
+        trial_values = np.atleast_2d(trial_values)
+
+        assert len(self._free_parameters) == trial_values.shape[1], ("Something is wrong. Number of free parameters "
+                                                                     "do not match the number of trial values.")
+
+        log_prior = self._log_prior_batch(trial_values)
+
+        log_posterior = np.zeros(trial_values.shape[0]) - np.inf
+
+        # Compute the likelihood only within the allowed region of parameter space
+
+        idx = np.isfinite(log_prior)
+
+        if np.any(idx):
+
+            log_posterior[idx] = self._log_like_batch(trial_values[idx]) + log_prior[idx]
+
+        return log_posterior
+
     def _construct_multinest_posterior(self):
         """
         pymultinest becomes confused with the self pointer. We therefore ceate callbacks
@@ -781,6 +833,77 @@ class BayesianAnalysis(object):
 
         return log_prior
 
+    def _log_prior_batch(self, trial_values):
+        """Compute the sum of log-priors for many points at once (one per row of trial_values)"""
+
+        trial_values = np.atleast_2d(trial_values)
+
+        log_prior = np.zeros(trial_values.shape[0])
+
+        for i, parameter in enumerate(self._free_parameters.values()):
+
+            prior_values = np.array(parameter.prior(trial_values[:, i]), dtype=float, ndmin=1)
+
+            # Outside allowed region of parameter space the prior is zero, and the log is -inf
+
+            with np.errstate(divide='ignore'):
+
+                log_prior += np.log10(prior_values)
+
+        return log_prior
+
+    def _log_like_batch(self, trial_values):
+        """Compute the log-likelihood for many points at once (one per row of trial_values)"""
+
+        parameters = self._free_parameters.values()
+
+        log_like = np.zeros(trial_values.shape[0])
+
+        for dataset in self._data_list.values():
+
+            these_log_likes = None
+
+            if dataset.has_batch_log_like:
+
+                these_log_likes = dataset.get_log_like_batch(parameters, trial_values)
+
+            if these_log_likes is None:
+
+                # Plugin not supporting batch evaluation, evaluate one point at the time
+
+                these_log_likes = np.zeros(trial_values.shape[0])
+
+                for i, these_values in enumerate(trial_values):
+
+                    for parameter, value in zip(parameters, these_values):
+
+                        parameter.value = value
+
+                    try:
+
+                        these_log_likes[i] = dataset.get_log_like()
+
+                    except ModelAssertionViolation:
+
+                        # Fit engine or sampler outside of allowed zone
+
+                        these_log_likes[i] = -np.inf
+
+            log_like += these_log_likes
+
+        idx = ~np.isfinite(log_like)
+
+        if np.any(idx):
+
+            # Issue warning
+
+            custom_warnings.warn("Likelihood value is infinite for parameters %s" % trial_values[idx],
+                                 LikelihoodIsInfinite)
+
+            log_like[idx] = -np.inf
+
+        return log_like
+
     def _log_like(self, trial_values):
         """Compute the log-likelihood"""
 
@@ -2,7 +2,7 @@ import collections
 import numpy as np
 
 from threeML.classicMLE.joint_likelihood_set import JointLikelihoodSet
-from threeML.data_list import DataList
+from threeML.classicMLE.simulation_cache import SimulationCache
 from astromodels import clone_model
 
 
@@ -27,6 +27,9 @@ class GoodnessOfFit(object):
         # Store best model
         self._best_fit_model = clone_model(self._jl_instance.likelihood_model)
 
+        # By default generate new datasets and models every time (see by_mc)
+        self._simulation_cache = SimulationCache(in_place=False)
+
     def get_simulated_data(self, id):
 
         # Make sure we start from the best fit model
@@ -34,28 +37,16 @@ class GoodnessOfFit(object):
 
         # Generate a new data set for each plugin contained in the data list
 
-        new_datas = []
-
-        for dataset in self._jl_instance.data_list.values():
-
-            new_data = dataset.get_simulated_dataset("%s_sim" % dataset.name)
-
-            new_datas.append(new_data)
-
-        new_data_list = DataList(*new_datas)
-
-        return new_data_list
+        return self._simulation_cache.get_simulated_data(self._jl_instance.data_list.values())
 
     def get_model(self, id):
 
         # Make a copy of the best fit model, so that we don't touch the original model during the fit, and we
         # also always restart from the best fit (instead of the last iteration)
 
-        new_model = clone_model(self._best_fit_model)
+        return self._simulation_cache.get_model(self._best_fit_model)
 
-        return new_model
-
-    def by_mc(self, n_iterations=1000, continue_on_failure=False):
+    def by_mc(self, n_iterations=1000, continue_on_failure=False, in_place_simulations=True):
         """
         Compute goodness of fit by generating Monte Carlo datasets and fitting the current model on them. The fraction
         of synthetic datasets which have a value for the likelihood larger or equal to the observed one is a measure
@@ -63,9 +54,13 @@ class GoodnessOfFit(object):
 
         :param n_iterations: number of MC iterations to perform (default: 1000)
         :param continue_of_failure: whether to continue in the case a fit fails (False by default)
+        :param in_place_simulations: if True (default), plugins supporting it re-randomize the same simulated
+        datasets at each iteration and the model is reset to the best fit instead of being cloned, which is much faster
         :return: tuple (goodness of fit, frame with all results, frame with all likelihood values)
         """
 
+        self._simulation_cache = SimulationCache(in_place=in_place_simulations)
+
         # Create the joint likelihood set
         jl_set = JointLikelihoodSet(self.get_simulated_data, self.get_model, n_iterations, iteration_name='simulation')
 
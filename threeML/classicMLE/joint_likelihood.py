@@ -16,6 +16,7 @@ from threeML.io.results_table import ResultsTable
 from threeML.io.table import Table
 from threeML.minimizer import minimization
 from threeML.parallel.parallel_client import ParallelClient
+from threeML.utils.differentiation import get_parameter_derivatives
 from threeML.utils.statistics.stats_tools import aic, bic
 
 
@@ -201,7 +202,7 @@ class JointLikelihood(object):
 
             # Create the minimizer anyway because it will be needed by the following code
 
-            self._minimizer = self._get_minimizer(self.minus_log_like_profile,
+            self._minimizer = self._get_minimizer(self._get_objective_function(),
                                                   self._free_parameters)
 
             # Store the "minimum", which is just the current value
@@ -216,7 +217,7 @@ class JointLikelihood(object):
 
                 # Do global minimization first
 
-                global_minimizer = self._get_minimizer(self.minus_log_like_profile, self._free_parameters)
+                global_minimizer = self._get_minimizer(self._get_objective_function(), self._free_parameters)
 
                 xs, global_log_likelihood_minimum = global_minimizer.minimize(compute_covar=False)
 
@@ -244,14 +245,14 @@ class JointLikelihood(object):
                     print("\nTotal log-likelihood minimum: %.3f\n" % global_log_likelihood_minimum)
 
                 # Now set up secondary minimizer
-                self._minimizer = self._minimizer_type.get_second_minimization_instance(self.minus_log_like_profile,
+                self._minimizer = self._minimizer_type.get_second_minimization_instance(self._get_objective_function(),
                                                                                         self._free_parameters)
 
             else:
 
                 # Only local minimization to be performed
 
-                self._minimizer = self._get_minimizer(self.minus_log_like_profile,
+                self._minimizer = self._get_minimizer(self._get_objective_function(),
                                                       self._free_parameters)
 
             # Perform the fit, but first flush stdout (so if we have verbose=True the messages there will follow
@@ -359,7 +360,7 @@ class JointLikelihood(object):
 
     def get_contours(self, param_1, param_1_minimum, param_1_maximum, param_1_n_steps,
                      param_2=None, param_2_minimum=None, param_2_maximum=None, param_2_n_steps=None,
-                     progress=True, **options):
+                     progress=True, n_processes=None, **options):
         """
         Generate confidence contours for the given parameters by stepping for the given number of steps between
         the given boundaries. Call it specifying only source_1, param_1, param_1_minimum and param_1_maximum to
@@ -368,7 +369,8 @@ class JointLikelihood(object):
 
         NOTE: if using parallel computation, param_1_n_steps must be an integer multiple of the number of running
         engines. If that is not the case, the code will reduce the number of steps to match that requirement, and
-        issue a warning
+        issue a warning. This does not apply to the local process pool used when n_processes is provided, which
+        distributes single points of the grid and gives the same results as the serial computation.
 
         :param param_1: fully qualified name of the first parameter or parameter instance
         :param param_1_minimum: lower bound for the range for the first parameter
@@ -379,6 +381,8 @@ class JointLikelihood(object):
         :param param_2_maximum: upper bound for the range for the second parameter
         :param param_2_n_steps: number of steps for the second parameter
         :param progress: (True or False) whether to display progress or not
+        :param n_processes: if larger than 1, compute the grid using a pool of this many local processes, instead
+                    of the serial computation or the parallel computation with ipyparallel (default: None)
         :param log: by default the steps are taken linearly. With this optional parameter you can provide a tuple of
                     booleans which specify whether the steps are to be taken logarithmically. For example,
                     'log=(True,False)' specify that the steps for the first parameter are to be taken logarithmically,
@@ -451,11 +455,14 @@ class JointLikelihood(object):
 
         # Check whether we are parallelizing or not
 
-        if not threeML_config['parallel']['use-parallel']:
+        use_local_pool = n_processes is not None and n_processes > 1
+
+        if use_local_pool or not threeML_config['parallel']['use-parallel']:
 
             a, b, cc = self.minimizer.contours(param_1, param_1_minimum, param_1_maximum, param_1_n_steps,
                                                param_2, param_2_minimum, param_2_maximum, param_2_n_steps,
-                                               progress, **options)
+                                               progress, n_processes=n_processes if use_local_pool else 1,
+                                               **options)
 
             # Collapse the second dimension of the results if we are doing a 1d contour
 
@@ -534,7 +541,7 @@ class JointLikelihood(object):
 
                 backup_freeParameters = map(lambda x:x.value, self._likelihood_model.free_parameters.values())
 
-                this_minimizer = self._get_minimizer(self.minus_log_like_profile,
+                this_minimizer = self._get_minimizer(self._get_objective_function(),
                                                      self._free_parameters)
 
                 this_p1min = pa[start_index * p1_split_steps]
@@ -780,6 +787,103 @@ class JointLikelihood(object):
 
         return summed_log_likelihood * (-1)
 
+    def minus_log_like_gradient(self, *trial_values):
+        """
+        Return the gradient of minus_log_like_profile for a given set of trial values, with respect to the trial
+        values (i.e., in the internal reference of the parameters). Each plugin provides its own contribution through
+        get_log_like_gradient. For plugins which cannot provide it, it is computed with finite differences.
+
+        :param trial_values: the trial values. Must be in the same number as the free parameters in the model
+        :return: array with the gradient of the minus log likelihood
+        """
+
+        trial_values = np.array(trial_values)
+
+        free_parameters = self._free_parameters.values()
+
+        summed_gradient = np.zeros(len(free_parameters))
+
+        # This is the fastest way to check for any nan (see minus_log_like_profile)
+
+        if not np.isfinite(np.dot(trial_values, trial_values.T)):
+
+            return summed_gradient
+
+        # Assign the new values to the parameters
+
+        for i, parameter in enumerate(free_parameters):
+
+            # Use the internal representation (see the Parameter class)
+
+            parameter._set_internal_value(trial_values[i])
+
+        for dataset in self._data_list.values():
+
+            # The nuisance parameters of the other plugins do not enter the likelihood of this plugin
+
+            other_nuisance_parameters = set()
+
+            for other_dataset in self._data_list.values():
+
+                if other_dataset is not dataset:
+
+                    other_nuisance_parameters.update(map(id, other_dataset.nuisance_parameters.values()))
+
+            indexes = [i for i, parameter in enumerate(free_parameters)
+                       if id(parameter) not in other_nuisance_parameters]
+
+            if len(indexes) == 0:
+
+                continue
+
+            parameters = [free_parameters[i] for i in indexes]
+
+            try:
+
+                this_gradient = dataset.get_log_like_gradient(parameters)
+
+                if this_gradient is None:
+
+                    this_gradient = get_parameter_derivatives(dataset.inner_fit, parameters)
+
+            except ModelAssertionViolation:
+
+                # Forbidden zone of the parameter space (see minus_log_like_profile). There is no meaningful gradient
+
+                custom_warnings.warn("Fitting engine in forbidden space: %s" % (trial_values,),
+                                     custom_exceptions.ForbiddenRegionOfParameterSpace)
+
+                return np.zeros(len(free_parameters))
+
+            summed_gradient[indexes] += this_gradient
+
+        if not np.all(np.isfinite(summed_gradient)):
+
+            custom_warnings.warn("These parameters returned a non-finite gradient of the logLike: %s" % (trial_values,),
+                                 NotANumberInLikelihood)
+
+            return np.zeros(len(free_parameters))
+
+        return summed_gradient * (-1)
+
+    def _get_objective_function(self):
+        """
+        Returns the function to be minimized. If the use of gradients is enabled in the configuration and all the
+        plugins can compute the gradient of their log-likelihood, it is attached to the function so that the
+        minimizers (and the computation of the covariance matrix) use it instead of numerical derivatives.
+
+        :return: the function to be minimized
+        """
+
+        if threeML_config['mle']['use gradient'] and \
+                all(map(lambda dataset: dataset.has_log_like_gradient, self._data_list.values())):
+
+            return minimization.FunctionWithGradient(self.minus_log_like_profile, self.minus_log_like_gradient)
+
+        else:
+
+            return self.minus_log_like_profile
+
     @property
     def fit_trace(self):
         return pd.DataFrame(self._record_calls)
@@ -1,11 +1,13 @@
+import hashlib
 import logging
+import os
 import numpy as np
 import warnings
 
 log = logging.getLogger(__name__)
 
 from threeML.classicMLE.joint_likelihood import JointLikelihood
-from threeML.parallel.parallel_client import ParallelClient
+from threeML.parallel.executors import get_executor, ThreadPoolExecutor
 from threeML.config.config import threeML_config
 from threeML.data_list import DataList
 from threeML.io.progress_bar import progress_bar
@@ -14,6 +16,7 @@ from threeML.minimizer.minimization import _Minimization, LocalMinimization, _mi
 
 from astromodels import Model
 import pandas as pd
+from pandas import HDFStore
 
 
 class JointLikelihoodSet(object):
@@ -198,7 +201,30 @@ class JointLikelihoodSet(object):
 
         return model_results, logl_results
 
-    def go(self, continue_on_failure=True, compute_covariance=False, verbose=False, **options_for_parallel_computation):
+    def go(self, continue_on_failure=True, compute_covariance=False, verbose=False, executor=None, n_workers=None,
+           store=None, store_id=None, **options_for_parallel_computation):
+        """
+        Fit all the iterations and collect the results.
+
+        :param continue_on_failure: whether to continue if a fit fails (default: True)
+        :param compute_covariance: whether to compute the covariance matrix for each fit (default: False)
+        :param verbose: print information while running
+        :param executor: how to distribute the iterations: 'serial', 'processes' (a pool of processes on the local
+        machine) or 'ipyparallel'. By default, use 'ipyparallel' if parallel computation is active (see
+        parallel_computation), otherwise 'serial'. Threads are not supported: the data and model getters (for example
+        those of GoodnessOfFit and LikelihoodRatioTest) change the state of plugins, models and fits shared among the
+        iterations, so iterations running at the same time in one process would corrupt each other
+        :param n_workers: number of processes for the 'processes' executor (default: number of CPUs)
+        :param store: name of a HDF5 file. If provided, the results of each iteration are written to this file as soon
+        as they are available, instead of being kept in memory. If the file already contains some iterations (for
+        example from an interrupted run), those are not recomputed. Note that in this mode the analysis results for the
+        single iterations are not kept, so the .results property is not available
+        :param store_id: an identifier of the data and models (a string, a number or a tuple of them), stored in the
+        file. A file written with a different identifier, number of iterations or number of models raises a
+        RuntimeError instead of being resumed
+        :param options_for_parallel_computation: options for the ipyparallel client
+        :return: a tuple (frame with the parameters, frame with the likelihood values)
+        """
 
         # Generate the data frame which will contain all results
 
@@ -210,33 +236,41 @@ class JointLikelihoodSet(object):
 
         self._compute_covariance = compute_covariance
 
-        # let's iterate, perform the fit and fill the data frame
+        self._all_results = None
 
-        if threeML_config['parallel']['use-parallel']:
+        if executor == 'threads' or isinstance(executor, ThreadPoolExecutor):
 
-            # Parallel computation
+            raise ValueError("The iterations cannot run in threads, because the data and model getters change the "
+                             "state of shared objects. Use 'processes' or 'ipyparallel' instead.")
 
-            client = ParallelClient(**options_for_parallel_computation)
+        executor_options = dict(options_for_parallel_computation)
 
-            results = client.execute_with_progress_bar(self.worker, range(self._n_iterations))
+        if n_workers is not None:
 
+            executor_options['n_workers'] = n_workers
 
-        else:
+        if store is not None:
+
+            return self._go_with_store(store, store_id, executor, executor_options)
+
+        # let's iterate, perform the fit and fill the data frame
 
-            # Serial computation
+        results = [None] * self._n_iterations
 
-            results = []
+        with get_executor(executor, **executor_options) as this_executor:
 
             with progress_bar(self._n_iterations, title='Goodness of fit computation') as p:
 
-                for i in range(self._n_iterations):
+                for i, result in this_executor.imap_unordered(self.worker, range(self._n_iterations)):
 
-                    results.append(self.worker(i))
+                    results[i] = result
 
                     p.increase()
 
-        assert len(results) == self._n_iterations, "Something went wrong, I have %s results " \
-                                                   "for %s intervals" % (len(results), self._n_iterations)
+        n_done = len(filter(lambda x: x is not None, results))
+
+        assert n_done == self._n_iterations, "Something went wrong, I have %s results " \
+                                             "for %s intervals" % (n_done, self._n_iterations)
 
         # Store the results in the data frames
 
@@ -255,6 +289,56 @@ class JointLikelihoodSet(object):
 
         return parameter_frames, like_frames
 
+    def _frames_worker(self, interval):
+
+        # Same as the worker, but drop the analysis results, which can be large, before sending the results back
+
+        frame_with_parameters, frame_with_like, _ = self.worker(interval)
+
+        return frame_with_parameters, frame_with_like
+
+    def _get_fingerprint(self, store_id):
+        """
+        Returns a string identifying this set of fits, so that a store written for a different set is not used to
+        resume this one. The getters are not called, as they might simulate data (and change the random state)
+
+        :param store_id: the identifier of the data and models provided by the user
+        """
+
+        description = repr((self._n_iterations, self._iteration_name, self._n_models, store_id))
+
+        return hashlib.sha1(description.encode('utf-8')).hexdigest()
+
+    def _go_with_store(self, filename, store_id, executor, executor_options):
+
+        store = _IterationsStore(filename)
+
+        store.check_fingerprint(self._get_fingerprint(store_id))
+
+        # Find out which iterations are already in the store (from a previous run)
+
+        done = store.get_completed_iterations()
+
+        to_do = filter(lambda i: i not in done, range(self._n_iterations))
+
+        if len(done) > 0:
+
+            log.info("Found %i completed iterations in %s, computing the remaining %i" % (len(done),
+                                                                                          filename, len(to_do)))
+
+        with get_executor(executor, **executor_options) as this_executor:
+
+            with progress_bar(len(to_do), title='Goodness of fit computation') as p:
+
+                for i, (frame_with_parameters, frame_with_like) in this_executor.imap_unordered(self._frames_worker,
+                                                                                                to_do):
+
+                    store.write(i, frame_with_parameters, frame_with_like)
+
+                    p.increase()
+
+        return store.read(self._n_iterations)
+
     @property
     def results(self):
         """
@@ -264,6 +348,10 @@ class JointLikelihoodSet(object):
         :return:
         """
 
+        if self._all_results is None:
+
+            raise RuntimeError("No results available. You have to run the .go method first, without using a store.")
+
         if len(self._all_results) == 1:
 
             return self._all_results[0]
@@ -288,6 +376,9 @@ class JointLikelihoodSet(object):
         # Check that we have the right amount of file names
         assert len(filenames) == self._n_models
 
+        assert self._all_results is not None, "No results available. You have to run the .go method first, " \
+                                              "without using a store."
+
         # Now write one file for each model
         for i in range(self._n_models):
 
@@ -296,6 +387,162 @@ class JointLikelihoodSet(object):
             this_results.write_to(filenames[i], overwrite=overwrite)
 
 
+class _IterationsStore(object):
+    """
+    Keeps the results of the iterations of a JointLikelihoodSet in a HDF5 file, so that they can be written as soon as
+    they are available and an interrupted run can be resumed. The frames of all the iterations are appended to one
+    table for the parameters and one for the likelihood values, with a column for the number of the iteration.
+    Another table lists the completed iterations, with the number of rows of the two tables after each of them
+    """
+
+    _tables = ['parameters', 'likelihood']
+
+    # Width of the string columns (names of the models, parameters and plugins, units)
+
+    _string_length = 256
+
+    def __init__(self, filename):
+
+        self._filename = os.path.abspath(os.path.expandvars(os.path.expanduser(filename)))
+
+    def _open(self, mode='r'):
+
+        return HDFStore(self._filename, mode=mode, complevel=5, complib='zlib')
+
+    def check_fingerprint(self, fingerprint):
+        """
+        Store the fingerprint of the set of fits in a new file, or check that it is the same as the one already
+        stored, so that iterations of a different set of fits are never mixed with these
+
+        :param fingerprint: the string identifying the set of fits
+        :return: none
+        """
+
+        with self._open('a') as store:
+
+            if '/fingerprint' in store:
+
+                stored_fingerprint = store['fingerprint'].iloc[0]
+
+            elif len(store.keys()) > 0:
+
+                stored_fingerprint = None
+
+            else:
+
+                store.put('fingerprint', pd.Series([fingerprint]))
+
+                return
+
+        if stored_fingerprint != fingerprint:
+
+            raise RuntimeError("The store %s contains the results of a different set of fits (different number of "
+                               "iterations, models or identifier). Use a different file, or remove it to start "
+                               "again." % self._filename)
+
+    def get_completed_iterations(self):
+        """
+        Returns the set of the iterations already in the store. The rows of an iteration whose writing has been
+        interrupted are removed
+
+        :return: a set of iteration numbers
+        """
+
+        with self._open('a') as store:
+
+            if '/completed' not in store:
+
+                completed = pd.DataFrame({'iteration': [], 'parameters': [], 'likelihood': []})
+
+            else:
+
+                completed = store['completed']
+
+            # The rows after those of the last completed iteration belong to an interrupted one
+
+            for table in self._tables:
+
+                n_rows = int(completed[table].values[-1]) if len(completed) > 0 else 0
+
+                if '/' + table in store and store.get_storer(table).nrows > n_rows:
+
+                    store.remove(table, start=n_rows)
+
+        return set(int(iteration) for iteration in completed['iteration'].values)
+
+    def write(self, iteration, frame_with_parameters, frame_with_like):
+
+        with self._open('a') as store:
+
+            n_rows = {}
+
+            for table, frame in zip(self._tables, [frame_with_parameters, frame_with_like]):
+
+                # (a failed fit gives an empty frame)
+
+                if len(frame) > 0:
+
+                    rows = frame.reset_index()
+
+                    rows['iteration'] = iteration
+
+                    store.append(table, rows, min_itemsize={'values': self._string_length}, index=False)
+
+                    if 'index_names' not in store.get_storer(table).attrs:
+
+                        store.get_storer(table).attrs.index_names = list(frame.index.names)
+
+                n_rows[table] = store.get_storer(table).nrows if '/' + table in store else 0
+
+            # This is written last, so that an interrupted iteration is not considered as completed
+
+            store.append('completed', pd.DataFrame({'iteration': [iteration],
+                                                    'parameters': [n_rows['parameters']],
+                                                    'likelihood': [n_rows['likelihood']]}), index=False)
+
+    def read(self, n_iterations):
+        """
+        Read the frames of all the iterations, in the same form as the frames returned by JointLikelihoodSet.go
+
+        :param n_iterations: the number of iterations
+        :return: (frame with the parameters, frame with the likelihood values)
+        """
+
+        frames = []
+
+        with self._open() as store:
+
+            for table in self._tables:
+
+                if '/' + table not in store:
+
+                    frames.append(pd.DataFrame())
+
+                    continue
+
+                rows = store[table]
+
+                index_names = store.get_storer(table).attrs.index_names
+
+                # The iterations have been written in any order. Sort them, keeping the order of the rows within each
+
+                rows = rows.iloc[np.argsort(rows['iteration'].values, kind='mergesort')]
+
+                n_levels = len(index_names)
+
+                index = pd.MultiIndex.from_arrays([rows['iteration'].values] +
+                                                  [rows[column].values for column in rows.columns[:n_levels]],
+                                                  names=[None] + index_names)
+
+                frame = rows[rows.columns[n_levels:]].drop('iteration', axis=1)
+
+                frame.index = index
+
+                frames.append(frame)
+
+        return frames[0], frames[1]
+
+
 class JointLikelihoodSetAnalyzer(object):
     """
     A class to help in offline re-analysis of the results obtained with the JointLikelihoodSet class
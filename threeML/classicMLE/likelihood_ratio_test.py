@@ -3,11 +3,9 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import scipy.stats as stats
 
-from astromodels import clone_model
-
 from threeML.classicMLE.joint_likelihood import JointLikelihood
 from threeML.classicMLE.joint_likelihood_set import JointLikelihoodSet
-from threeML.data_list import DataList
+from threeML.classicMLE.simulation_cache import SimulationCache
 from threeML.exceptions.custom_exceptions import custom_warnings
 from threeML.plugins.OGIPLike import OGIPLike
 from threeML.utils.OGIP.pha import PHAWrite
@@ -52,12 +50,13 @@ class LikelihoodRatioTest(object):
         self._save_pha = False
         self._data_container = []
 
+        # By default generate new datasets and models every time (see by_mc)
+        self._simulation_cache = SimulationCache(in_place=False)
+
     def get_simulated_data(self, id):
 
         # Generate a new data set for each plugin contained in the data list
 
-        new_datas = []
-
         for dataset in self._joint_likelihood_instance0.data_list.values():
 
             # Make sure that the active likelihood model is the null hypothesis
@@ -65,11 +64,7 @@ class LikelihoodRatioTest(object):
             # JointLikelihood instances
             dataset.set_model(self._joint_likelihood_instance0.likelihood_model)
 
-            new_data = dataset.get_simulated_dataset("%s_sim" % dataset.name)
-
-            new_datas.append(new_data)
-
-        new_data_list = DataList(*new_datas)
+        new_data_list = self._simulation_cache.get_simulated_data(self._joint_likelihood_instance0.data_list.values())
 
         if self._save_pha:
 
@@ -82,12 +77,12 @@ class LikelihoodRatioTest(object):
         # Make a copy of the best fit models, so that we don't touch the original models during the fit, and we
         # also always restart from the best fit (instead of the last iteration)
 
-        new_model0 = clone_model(self._joint_likelihood_instance0.likelihood_model)
-        new_model1 = clone_model(self._joint_likelihood_instance1.likelihood_model)
+        new_model0 = self._simulation_cache.get_model(self._joint_likelihood_instance0.likelihood_model, key=0)
+        new_model1 = self._simulation_cache.get_model(self._joint_likelihood_instance1.likelihood_model, key=1)
 
         return new_model0, new_model1
 
-    def by_mc(self, n_iterations=1000, continue_on_failure=False, save_pha=False):
+    def by_mc(self, n_iterations=1000, continue_on_failure=False, save_pha=False, in_place_simulations=True):
         """
         Compute the Likelihood Ratio Test by generating Monte Carlo datasets and fitting the current models on them.
         The fraction of synthetic datasets which have a value for the TS larger or equal to the observed one gives
@@ -98,11 +93,16 @@ class LikelihoodRatioTest(object):
         :param continue_of_failure: whether to continue in the case a fit fails (False by default)
         :param save_pha: Saves pha files for reading into XSPEC as a cross check.
          Currently only supports OGIP data. This can become slow! (False by default)
+        :param in_place_simulations: if True (default), plugins supporting it re-randomize the same simulated
+        datasets at each iteration and the models are reset to the best fit instead of being cloned, which is much
+        faster. This is turned off when save_pha is True, as all the simulated datasets need to be kept
         :return: tuple (null. hyp. probability, TSs, frame with all results, frame with all likelihood values)
         """
 
         self._save_pha = save_pha
 
+        self._simulation_cache = SimulationCache(in_place=in_place_simulations and not save_pha)
+
 
         # Create the joint likelihood set
         jl_set = JointLikelihoodSet(self.get_simulated_data, self.get_models, n_iterations, iteration_name='simulation')
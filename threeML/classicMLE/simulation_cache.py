@@ -0,0 +1,136 @@
+import threading
+
+from astromodels import clone_model
+
+from threeML.data_list import DataList
+
+
+class ParametersState(object):
+
+    def __init__(self, parameters):
+        """
+        Store the current value and the free/fixed state of the provided parameters, so that they can be restored
+        later
+
+        :param parameters: a list of astromodels Parameter instances
+        """
+
+        # Linked parameters get their value from the link, so there is nothing to store for them. We use the internal
+        # value so that the restore is exact even when the parameter has a transformation
+
+        self._state = [(parameter, parameter._get_internal_value(), parameter.free)
+                       for parameter in parameters if not parameter.has_auxiliary_variable()]
+
+    def restore(self):
+
+        for parameter, internal_value, free in self._state:
+
+            parameter.free = free
+            parameter._set_internal_value(internal_value)
+
+
+class SimulationCache(object):
+
+    def __init__(self, in_place=True):
+        """
+        Provides the simulated datasets and the models for the iterations of a Monte Carlo computation (see
+        GoodnessOfFit and LikelihoodRatioTest).
+
+        With in_place=True, the simulated datasets generated in the first iteration are re-randomized in place in the
+        following ones (for plugins supporting it), and the models are cloned only once and then reset to their
+        initial state. This avoids copying plugins and models at each iteration.
+
+        Note that the datasets and models returned in one iteration are reused in the next, so they should not be
+        stored. Each thread keeps its own copies.
+
+        :param in_place: whether to re-use datasets and models (default: True)
+        """
+
+        self._in_place = bool(in_place)
+
+        self._local = threading.local()
+
+    def __getstate__(self):
+
+        # The cached objects are specific to this process, so they are not serialized
+
+        return {'_in_place': self._in_place}
+
+    def __setstate__(self, state):
+
+        self._in_place = state['_in_place']
+
+        self._local = threading.local()
+
+    def get_simulated_data(self, datasets):
+        """
+        Returns a DataList with a simulated dataset for each of the provided plugins, obtained from their current
+        models
+
+        :param datasets: list of plugins
+        :return: a DataList instance
+        """
+
+        cached = getattr(self._local, 'data', None)
+
+        if cached is None:
+
+            new_datas = [dataset.get_simulated_dataset("%s_sim" % dataset.name) for dataset in datasets]
+
+            data_list = DataList(*new_datas)
+
+            if self._in_place and all(dataset.has_in_place_simulation for dataset in datasets):
+
+                # Keep the new datasets, and the initial state of their nuisance parameters (which will
+                # change during the fit)
+
+                nuisance_parameters = [parameter for new_data in new_datas
+                                       for parameter in new_data.nuisance_parameters.values()]
+
+                self._local.data = (data_list, ParametersState(nuisance_parameters))
+
+            return data_list
+
+        else:
+
+            data_list, nuisance_state = cached
+
+            for dataset, simulated_dataset in zip(datasets, data_list.values()):
+
+                dataset.update_simulated_dataset(simulated_dataset)
+
+            nuisance_state.restore()
+
+            return data_list
+
+    def get_model(self, model, key=0):
+        """
+        Returns a copy of the provided model, in the same state as the provided model had when it was first
+        requested with the same key
+
+        :param model: an astromodels Model instance
+        :param key: identifier for the model (when more than one model is needed in each iteration)
+        :return: a Model instance
+        """
+
+        if not hasattr(self._local, 'models'):
+
+            self._local.models = {}
+
+        if not self._in_place or key not in self._local.models:
+
+            new_model = clone_model(model)
+
+            if self._in_place:
+
+                self._local.models[key] = (new_model, ParametersState(new_model.parameters.values()))
+
+            return new_model
+
+        else:
+
+            new_model, model_state = self._local.models[key]
+
+            model_state.restore()
+
+            return new_model
@@ -0,0 +1,286 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from threeML.config.config import threeML_config
+from threeML.exceptions.custom_exceptions import custom_warnings
+from threeML.io.file_utils import sanitize_filename, if_directory_not_existing_then_make
+
+# Change this when the format of the entries (or of what is stored by the readers) changes, so that old entries
+# are not used anymore
+
+_cache_version = 1
+
+_metadata_file_name = 'metadata.json'
+
+
+class DataCache(object):
+
+    def __init__(self, directory, max_size):
+        """
+        A persistent cache of the arrays decoded from data files (event lists, response matrices, background
+        polynomials...), so that reading the same file again does not need to decode it again.
+
+        Each entry is identified by the kind of data, the absolute path, modification time and size of the file it
+        comes from, and the parameters used to read it (time window, response number...), so that an entry is never
+        used after its file has changed. Each entry is a directory containing one .npy file per array, which are
+        memory mapped when read back, and a JSON file with the other (scalar) information.
+
+        When the total size exceeds max_size, the least recently used entries are removed.
+
+        :param directory: the directory containing the cache (created if needed)
+        :param max_size: maximum size of the cache in bytes
+        """
+
+        self._directory = sanitize_filename(directory, abspath=True)
+
+        self._max_size = int(max_size)
+
+    @property
+    def directory(self):
+
+        return self._directory
+
+    @property
+    def max_size(self):
+
+        return self._max_size
+
+    @staticmethod
+    def _get_key(kind, filename, parameters):
+
+        filename = sanitize_filename(filename, abspath=True)
+
+        stat = os.stat(filename)
+
+        identifier = repr((_cache_version, kind, filename, stat.st_mtime, stat.st_size, sorted(parameters.items())))
+
+        return "%s_%s" % (kind, hashlib.sha1(identifier.encode('utf-8')).hexdigest())
+
+    def _get_entry_path(self, kind, filename, parameters):
+
+        try:
+
+            key = self._get_key(kind, filename, parameters)
+
+        except (OSError, TypeError, AttributeError):
+
+            # Not a file on disk (or not a file name at all), cannot be cached
+
+            return None
+
+        return os.path.join(self._directory, key)
+
+    def get(self, kind, filename, **parameters):
+        """
+        Returns the entry for the provided file and parameters, or None if there is none
+
+        :param kind: the kind of data (for example 'gbm_tte')
+        :param filename: the data file the entry comes from
+        :param parameters: the parameters used to read the file
+        :return: a tuple (arrays, metadata) of dictionaries, or None
+        """
+
+        entry_path = self._get_entry_path(kind, filename, parameters)
+
+        if entry_path is None or not os.path.isdir(entry_path):
+
+            return None
+
+        try:
+
+            with open(os.path.join(entry_path, _metadata_file_name)) as f:
+
+                metadata = json.load(f)
+
+            arrays = {}
+
+            for name in metadata['arrays']:
+
+                arrays[name] = self._load_array(os.path.join(entry_path, "%s.npy" % name))
+
+        except (IOError, OSError, ValueError, KeyError):
+
+            # Incomplete or corrupted entry
+
+            shutil.rmtree(entry_path, ignore_errors=True)
+
+            return None
+
+        # Mark the entry as used, for the eviction
+
+        os.utime(os.path.join(entry_path, _metadata_file_name), None)
+
+        return arrays, metadata['metadata']
+
+    @staticmethod
+    def _load_array(path):
+
+        # The arrays are mapped copy-on-write, so that they can be changed in memory without affecting the cache
+
+        try:
+
+            return np.load(path, mmap_mode='c')
+
+        except ValueError:
+
+            # Empty arrays cannot be memory mapped
+
+            return np.load(path)
+
+    def put(self, kind, filename, arrays, metadata=None, **parameters):
+        """
+        Stores an entry for the provided file and parameters. Failures are not fatal: they only issue a warning.
+
+        :param kind: the kind of data (for example 'gbm_tte')
+        :param filename: the data file the entry comes from
+        :param arrays: a dictionary of numerical arrays
+        :param metadata: a dictionary of other information (must be serializable to JSON)
+        :param parameters: the parameters used to read the file
+        :return: none
+        """
+
+        entry_path = self._get_entry_path(kind, filename, parameters)
+
+        if entry_path is None:
+
+            return
+
+        arrays = dict((name, np.asarray(array)) for name, array in arrays.items())
+
+        if sum(array.nbytes for array in arrays.values()) > self._max_size:
+
+            # Would not fit anyway
+
+            return
+
+        try:
+
+            if_directory_not_existing_then_make(self._directory)
+
+            # Write the entry in a temporary directory and move it in place at the end, so that an interrupted write
+            # never leaves a partial entry
+
+            temp_path = tempfile.mkdtemp(prefix='.tmp_', dir=self._directory)
+
+            try:
+
+                for name, array in arrays.items():
+
+                    np.save(os.path.join(temp_path, "%s.npy" % name), array, allow_pickle=False)
+
+                with open(os.path.join(temp_path, _metadata_file_name), 'w') as f:
+
+                    json.dump({'arrays': sorted(arrays.keys()),
+                               'metadata': metadata if metadata is not None else {}}, f)
+
+                if os.path.exists(entry_path):
+
+                    shutil.rmtree(entry_path)
+
+                os.rename(temp_path, entry_path)
+
+            finally:
+
+                shutil.rmtree(temp_path, ignore_errors=True)
+
+        except (IOError, OSError, TypeError, ValueError) as e:
+
+            custom_warnings.warn("Could not write to the data cache in %s: %s" % (self._directory, e))
+
+            return
+
+        self._evict()
+
+    def _get_entries(self):
+        """
+        Returns a list of (last access time, size, path) for all the entries, sorted from the least recently used
+        """
+
+        entries = []
+
+        if not os.path.isdir(self._directory):
+
+            return entries
+
+        for name in os.listdir(self._directory):
+
+            path = os.path.join(self._directory, name)
+
+            if name.startswith('.') or not os.path.isdir(path):
+
+                continue
+
+            try:
+
+                last_access = os.path.getmtime(os.path.join(path, _metadata_file_name))
+
+                size = sum(os.path.getsize(os.path.join(path, file_name)) for file_name in os.listdir(path))
+
+            except OSError:
+
+                continue
+
+            entries.append((last_access, size, path))
+
+        return sorted(entries)
+
+    def _evict(self):
+
+        entries = self._get_entries()
+
+        total_size = sum(size for _, size, _ in entries)
+
+        for _, size, path in entries:
+
+            if total_size <= self._max_size:
+
+                break
+
+            shutil.rmtree(path, ignore_errors=True)
+
+            total_size -= size
+
+    @property
+    def size(self):
+        """
+        The total size of the cache in bytes
+        """
+
+        return sum(size for _, size, _ in self._get_entries())
+
+    def __len__(self):
+
+        return len(self._get_entries())
+
+    def clear(self):
+        """
+        Removes all the entries
+
+        :return: none
+        """
+
+        for _, _, path in self._get_entries():
+
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def get_data_cache():
+    """
+    Returns the data cache configured in the 'data cache' section of the configuration, or None if its use is
+    not activated
+
+    :return: a DataCache instance or None
+    """
+
+    cache_config = threeML_config['data cache']
+
+    if not cache_config['use cache']:
+
+        return None
+
+    return DataCache(cache_config['directory'], cache_config['max size'] * 1024 * 1024)
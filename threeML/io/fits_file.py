@@ -256,3 +256,112 @@ class FITSExtension(object):
         header_tuple = fits_extension.header.items()
 
         return cls(data_tuple,header_tuple)
+
+
+def _get_raw_column(table_hdu, name):
+    """
+    Returns a view of the stored (unscaled) values of a column of a binary table, with the scaling to apply to them.
+    If the file was opened with memmap=True (and it is not compressed), nothing is read from disk until the view is
+    accessed, and then only the accessed rows are read
+
+    :param table_hdu: a binary table HDU
+    :param name: name of the column
+    :return: (view, scale, zero)
+    """
+
+    column = table_hdu.columns[name]
+
+    scale = column.bscale if column.bscale is not None else 1
+
+    zero = column.bzero if column.bzero is not None else 0
+
+    return table_hdu.data.view(np.ndarray)[name], scale, zero
+
+
+def read_column(table_hdu, name, rows=slice(None), dtype=None):
+    """
+    Read some rows of a column of a binary table, without loading the entire column in memory
+
+    :param table_hdu: a binary table HDU
+    :param name: name of the column
+    :param rows: the rows to read (a slice or an array of indices, like those returned by get_rows_in_range)
+    :param dtype: the type of the returned array (default: the native version of the type of the column)
+    :return: an array
+    """
+
+    raw, scale, zero = _get_raw_column(table_hdu, name)
+
+    values = raw[rows]
+
+    if scale != 1 or zero != 0:
+
+        values = values * scale + zero
+
+    if dtype is None:
+
+        dtype = values.dtype.newbyteorder('=')
+
+    return np.array(values, dtype=dtype)
+
+
+def get_rows_in_range(table_hdu, name, minimum=None, maximum=None, chunk_size=1000000):
+    """
+    Find the rows of a binary table where the value of a column is within [minimum, maximum]. The column is read in
+    chunks, so that the memory needed does not depend on the size of the table.
+
+    :param table_hdu: a binary table HDU
+    :param name: name of the column
+    :param minimum: minimum value (default: no minimum)
+    :param maximum: maximum value (default: no maximum)
+    :param chunk_size: number of rows read at once
+    :return: a slice if the column is sorted, otherwise a sorted array of row indices
+    """
+
+    raw, scale, zero = _get_raw_column(table_hdu, name)
+
+    n_rows = raw.shape[0]
+
+    is_sorted = True
+
+    last_value = None
+
+    selected = []
+
+    for start in range(0, n_rows, chunk_size):
+
+        values = raw[start:start + chunk_size] * scale + zero
+
+        if is_sorted:
+
+            is_sorted = (np.all(values[1:] >= values[:-1]) and
+                         (last_value is None or values.shape[0] == 0 or values[0] >= last_value))
+
+        if values.shape[0] > 0:
+
+            last_value = values[-1]
+
+        mask = np.ones(values.shape[0], dtype=bool)
+
+        if minimum is not None:
+
+            mask &= (values >= minimum)
+
+        if maximum is not None:
+
+            mask &= (values <= maximum)
+
+        selected.append(np.flatnonzero(mask) + start)
+
+    rows = np.concatenate(selected) if selected else np.zeros(0, dtype=int)
+
+    if is_sorted:
+
+        # the selected rows are contiguous
+
+        if rows.shape[0] == 0:
+
+            return slice(0, 0)
+
+        return slice(rows[0], rows[-1] + 1)
+
+    return rows
@@ -0,0 +1,566 @@
+import collections
+import hashlib
+import os
+
+import astropy.units as u
+import numpy as np
+import pandas as pd
+from astromodels import clone_model
+from astromodels.core.model_parser import ModelParser
+from astromodels.core.my_yaml import my_yaml
+from pandas import HDFStore
+
+from threeML.io.file_utils import sanitize_filename
+
+# The signature at the beginning of every HDF5 file
+
+_hdf5_signature = b'\x89HDF\r\n\x1a\n'
+
+
+def is_hdf5_file(filename):
+    """
+    Returns True if the provided file is an HDF5 file (like the files written by AnalysisResultsStore)
+
+    :param filename: name of the file
+    :return: True or False
+    """
+
+    try:
+
+        with open(sanitize_filename(filename), 'rb') as f:
+
+            return f.read(len(_hdf5_signature)) == _hdf5_signature
+
+    except IOError:
+
+        return False
+
+
+class AnalysisResultsStore(object):
+
+    def __init__(self, filename, complevel=5, complib='zlib'):
+        """
+        A store for many analysis results (like the results of a time-resolved analysis) in an HDF5 file, organized by
+        columns instead of one FITS extension for each result.
+
+        Results whose models are the same except for the values of the free parameters (same sources, functions,
+        fixed parameters, boundaries, priors, links, units and transformations, same plugins) share one serialization
+        of the model, which is stored only once. For each of these groups, the best fit values and errors of the free
+        parameters, the covariance matrices (for MLE results), the statistic values and the statistical measures are
+        stored in tables with one row for each result, and the samples (for Bayesian results) in one compressed table
+        with one column for each parameter, together with the first and last row of the samples of each result.
+        Results can be appended while an analysis is running, and the values or the samples of some of the parameters
+        can be read for all the results without reading anything else.
+
+        The results are read back with load_analysis_results.
+
+        :param filename: name of the HDF5 file (created if needed)
+        :param complevel: compression level (0-9) for the tables
+        :param complib: compression library (see pandas.HDFStore)
+        """
+
+        self._filename = sanitize_filename(filename, abspath=True)
+
+        self._complevel = int(complevel)
+
+        self._complib = complib
+
+        # Caches of what has been read from the file
+
+        self._index = None
+
+        self._models = {}
+
+    @property
+    def filename(self):
+
+        return self._filename
+
+    def _open(self, mode='r'):
+
+        return HDFStore(self._filename, mode=mode, complevel=self._complevel, complib=self._complib)
+
+    @staticmethod
+    def _get_keys(structure):
+
+        prefix = "structure_%i" % structure
+
+        return dict((name, "%s/%s" % (prefix, name))
+                    for name in ['model', 'values', 'errors', 'statistics', 'measures', 'covariance', 'samples',
+                                 'sample_rows'])
+
+    @staticmethod
+    def _remove_free_values(model_dict):
+
+        # Remove the values of the free parameters from the (nested) dictionary representing a model, leaving
+        # everything else (including priors, links, units and transformations)
+
+        if not isinstance(model_dict, dict):
+
+            return model_dict
+
+        is_free_parameter = model_dict.get('free', False) is True
+
+        return collections.OrderedDict((key, AnalysisResultsStore._remove_free_values(value))
+                                       for key, value in model_dict.items()
+                                       if not (is_free_parameter and key == 'value'))
+
+    @staticmethod
+    def _get_signature(analysis_results, free_parameters):
+
+        # Everything which must be the same for results sharing the serialization of the model and the tables: the
+        # whole model except the values of the free parameters, and the names of the columns of the tables
+
+        model_dict = AnalysisResultsStore._remove_free_values(analysis_results.optimized_model.to_dict_with_types())
+
+        signature = repr((analysis_results.analysis_type,
+                          my_yaml.dump(model_dict),
+                          list(free_parameters.keys()),
+                          list(analysis_results.optimal_statistic_values.index),
+                          list(analysis_results.statistical_measures.index)))
+
+        return hashlib.sha1(signature.encode('utf-8')).hexdigest()
+
+    def _get_structure(self, store, analysis_results, free_parameters):
+        """
+        Returns the number of the group of results with the same structure as the provided results
+        """
+
+        signature = self._get_signature(analysis_results, free_parameters)
+
+        if '/structures' in store:
+
+            signatures = list(store['structures']['signature'])
+
+            if signature in signatures:
+
+                return signatures.index(signature)
+
+        else:
+
+            signatures = []
+
+        store.append('structures', pd.DataFrame({'signature': [signature]}, index=[len(signatures)]),
+                     min_itemsize={'signature': len(signature)})
+
+        return len(signatures)
+
+    @staticmethod
+    def _remove_incomplete_rows(store, keys, row):
+
+        # If the writing of a result has been interrupted, some tables might contain a row for it even if it is not
+        # in the index. Remove them, so that each table contains exactly one row for each result
+
+        for name in ['values', 'errors', 'statistics', 'measures', 'covariance', 'sample_rows']:
+
+            if '/' + keys[name] in store and store.get_storer(keys[name]).nrows > row:
+
+                store.remove(keys[name], start=row)
+
+        if '/' + keys['samples'] in store:
+
+            # The samples of the complete results end where those of the last one do
+
+            if row == 0:
+
+                n_samples = 0
+
+            else:
+
+                n_samples = int(store.select(keys['sample_rows'], start=row - 1, stop=row)['stop'].iloc[0])
+
+            if store.get_storer(keys['samples']).nrows > n_samples:
+
+                store.remove(keys['samples'], start=n_samples)
+
+    def append(self, analysis_results):
+        """
+        Add the provided results at the end of the store
+
+        :param analysis_results: a MLEResults or BayesianResults instance
+        :return: none
+        """
+
+        optimized_model = analysis_results.optimized_model
+
+        free_parameters = optimized_model.free_parameters
+
+        n_parameters = len(free_parameters)
+
+        # Errors are always equal tail, like in the FITS files
+
+        data_frame = analysis_results.get_data_frame(error_type="equal tail")
+
+        statistic_values = analysis_results.optimal_statistic_values
+
+        measure_values = analysis_results.statistical_measures
+
+        with self._open('a') as store:
+
+            structure = self._get_structure(store, analysis_results, free_parameters)
+
+            keys = self._get_keys(structure)
+
+            if '/index' in store:
+
+                index = store['index']
+
+                n_results = len(index)
+
+                row = int(np.sum(index['structure'].values == structure))
+
+            else:
+
+                n_results = 0
+
+                row = 0
+
+            is_new = row == 0
+
+            if '/' + keys['values'] in store and store.get_storer(keys['values']).nrows > row:
+
+                self._remove_incomplete_rows(store, keys, row)
+
+            parameter_columns = ['p%i' % i for i in range(n_parameters)]
+
+            def this_frame(values, prefix):
+
+                return pd.DataFrame([np.array(values, float)], index=[row],
+                                    columns=['%s%i' % (prefix, i) for i in range(len(values))])
+
+            store.append(keys['values'], this_frame(data_frame['value'].values, 'p'), data_columns=True)
+            store.append(keys['errors'], this_frame(data_frame['error'].values, 'p'), data_columns=True)
+
+            if len(statistic_values) > 0:
+
+                store.append(keys['statistics'], this_frame(statistic_values.values, 's'), data_columns=True)
+
+            if len(measure_values) > 0:
+
+                store.append(keys['measures'], this_frame(measure_values.values, 'm'), data_columns=True)
+
+            if analysis_results.analysis_type == "MLE":
+
+                store.append(keys['covariance'], this_frame(np.ravel(analysis_results.covariance_matrix), 'c'))
+
+            else:
+
+                samples = pd.DataFrame(analysis_results.samples.T, columns=parameter_columns)
+
+                # The samples of each result are contiguous, so they are read by row number (without any search)
+
+                first_sample = store.get_storer(keys['samples']).nrows if '/' + keys['samples'] in store else 0
+
+                store.append(keys['samples'], samples)
+
+                store.append(keys['sample_rows'], pd.DataFrame({'start': [first_sample],
+                                                                'stop': [first_sample + samples.shape[0]]},
+                                                               index=[row]))
+
+            if is_new:
+
+                # Store the model only once, and the names of the columns
+
+                store.put(keys['model'], pd.Series([my_yaml.dump(optimized_model.to_dict_with_types())]))
+
+                store.get_storer(keys['values']).attrs.metadata = {
+                    'analysis_type': analysis_results.analysis_type,
+                    'parameters': list(free_parameters.keys()),
+                    'statistics': list(statistic_values.index),
+                    'measures': list(measure_values.index)}
+
+            # The index is written last, so that a result which is not in the index (because the writing has been
+            # interrupted) is ignored, and its rows are removed by the next append
+
+            store.append('index', pd.DataFrame({'structure': [structure], 'row': [row]}, index=[n_results]))
+
+        self._index = None
+
+    def set_sequence(self, name, data_tuple):
+        """
+        Store the description of the sequence of results (see AnalysisResultsSet.characterize_sequence)
+
+        :param name: the name of the sequence
+        :param data_tuple: a tuple of (column name, values) tuples. The values can be astropy quantities
+        :return: none
+        """
+
+        columns = collections.OrderedDict()
+
+        units = {}
+
+        for column_name, values in data_tuple:
+
+            if isinstance(values, u.Quantity):
+
+                units[column_name] = values.unit.to_string()
+
+                values = values.value
+
+            columns[column_name] = np.array(values)
+
+        with self._open('a') as store:
+
+            store.put('sequence', pd.DataFrame(columns))
+
+            store.get_storer('sequence').attrs.metadata = {'name': str(name), 'units': units}
+
+    def get_sequence(self):
+        """
+        Returns the description of the sequence of results, or None if there is none
+
+        :return: a tuple (name, data_tuple) or None
+        """
+
+        with self._open() as store:
+
+            if '/sequence' not in store:
+
+                return None
+
+            frame = store['sequence']
+
+            metadata = store.get_storer('sequence').attrs.metadata
+
+        data_tuple = []
+
+        for column_name in frame.columns:
+
+            values = frame[column_name].values
+
+            if column_name in metadata['units']:
+
+                values = values * u.Unit(metadata['units'][column_name])
+
+            data_tuple.append((column_name, values))
+
+        return metadata['name'], tuple(data_tuple)
+
+    def _get_index(self):
+
+        if self._index is None:
+
+            if not os.path.exists(self._filename):
+
+                return np.zeros((0, 2), int)
+
+            with self._open() as store:
+
+                if '/index' not in store:
+
+                    return np.zeros((0, 2), int)
+
+                index = store['index']
+
+            self._index = np.array(index[['structure', 'row']].values, int)
+
+        return self._index
+
+    def __len__(self):
+
+        return self._get_index().shape[0]
+
+    def _get_model(self, store, structure):
+
+        if structure not in self._models:
+
+            serialized_model = store[self._get_keys(structure)['model']].iloc[0]
+
+            model = ModelParser(model_dict=my_yaml.load(serialized_model)).get_model()
+
+            self._models[structure] = model
+
+        return self._models[structure]
+
+    def read(self, item):
+        """
+        Read the information needed to rebuild one result
+
+        :param item: the number of the result
+        :return: a tuple (analysis type, model, covariance matrix or samples, statistic values, statistical measures).
+        The model is a new instance, with the best fit values of the parameters
+        """
+
+        structure, row = self._get_index()[item]
+
+        keys = self._get_keys(structure)
+
+        def read_row(store, key):
+
+            return store.select(key, start=row, stop=row + 1).values[0]
+
+        with self._open() as store:
+
+            metadata = store.get_storer(keys['values']).attrs.metadata
+
+            model = self._get_model(store, structure)
+
+            values = read_row(store, keys['values'])
+
+            n_parameters = len(metadata['parameters'])
+
+            if metadata['analysis_type'] == "MLE":
+
+                errors_info = np.reshape(read_row(store, keys['covariance']), (n_parameters, n_parameters))
+
+            else:
+
+                errors_info = self._select_samples(store, keys, row, ['p%i' % i for i in range(n_parameters)]).values
+
+            statistic_values = collections.OrderedDict()
+
+            if metadata['statistics']:
+
+                statistic_values.update(zip(metadata['statistics'], read_row(store, keys['statistics'])))
+
+            measure_values = collections.OrderedDict()
+
+            if metadata['measures']:
+
+                measure_values.update(zip(metadata['measures'], read_row(store, keys['measures'])))
+
+        # The model read from the file is shared by all the results with the same structure, so it is not changed
+
+        model = clone_model(model)
+
+        for path, value in zip(metadata['parameters'], values):
+
+            model.parameters[path].value = value
+
+        return metadata['analysis_type'], model, errors_info, statistic_values, measure_values
+
+    @staticmethod
+    def _select_samples(store, keys, row, columns):
+
+        start, stop = store.select(keys['sample_rows'], start=row, stop=row + 1)[['start', 'stop']].values[0]
+
+        return store.select(keys['samples'], start=int(start), stop=int(stop), columns=columns)
+
+    def _read_columns(self, table, parameters=None):
+        """
+        Returns a data frame with one row for each result, and the requested columns of the provided table for all
+        of them
+        """
+
+        index = self._get_index()
+
+        frames = []
+
+        with self._open() as store:
+
+            for structure in np.unique(index[:, 0]):
+
+                keys = self._get_keys(structure)
+
+                if '/' + keys[table] not in store:
+
+                    continue
+
+                metadata = store.get_storer(keys['values']).attrs.metadata
+
+                names = metadata['statistics' if table == 'statistics' else
+                                 'measures' if table == 'measures' else 'parameters']
+
+                prefix = table[0] if table in ['statistics', 'measures'] else 'p'
+
+                columns = collections.OrderedDict(('%s%i' % (prefix, i), name) for i, name in enumerate(names)
+                                                  if parameters is None or name in parameters)
+
+                if not columns:
+
+                    continue
+
+                this_results = np.where(index[:, 0] == structure)[0]
+
+                frame = store.select(keys[table], columns=list(columns.keys())).loc[index[this_results, 1]]
+
+                frame.index = this_results
+
+                frames.append(frame.rename(columns=columns))
+
+        if not frames:
+
+            return pd.DataFrame(index=range(len(index)))
+
+        return pd.concat(frames).reindex(range(len(index)))
+
+    def get_values(self, parameters=None):
+        """
+        Returns the best fit values of the free parameters for all the results
+
+        :param parameters: list of paths of the parameters to read (default: all)
+        :return: a pandas DataFrame with one row for each result and one column for each parameter
+        """
+
+        return self._read_columns('values', parameters)
+
+    def get_errors(self, parameters=None):
+        """
+        Returns the errors (equal tail) of the free parameters for all the results
+
+        :param parameters: list of paths of the parameters to read (default: all)
+        :return: a pandas DataFrame with one row for each result and one column for each parameter
+        """
+
+        return self._read_columns('errors', parameters)
+
+    def get_samples(self, parameters=None, results=None):
+        """
+        Returns the samples of the free parameters of Bayesian results
+
+        :param parameters: list of paths of the parameters to read (default: all)
+        :param results: list of the numbers of the results to read (default: all)
+        :return: a pandas DataFrame with one row for each sample and one column for each parameter, plus a 'result'
+        column with the number of the result
+        """
+
+        index = self._get_index()
+
+        if results is None:
+
+            results = range(len(index))
+
+        frames = []
+
+        with self._open() as store:
+
+            for result in results:
+
+                structure, row = index[result]
+
+                keys = self._get_keys(structure)
+
+                if '/' + keys['samples'] not in store:
+
+                    continue
+
+                metadata = store.get_storer(keys['values']).attrs.metadata
+
+                columns = collections.OrderedDict(('p%i' % i, name) for i, name in enumerate(metadata['parameters'])
+                                                  if parameters is None or name in parameters)
+
+                frame = self._select_samples(store, keys, row, list(columns.keys()))
+
+                frame = frame.rename(columns=columns)
+
+                frame['result'] = result
+
+                frames.append(frame)
+
+        if not frames:
+
+            return pd.DataFrame()
+
+        return pd.concat(frames, ignore_index=True)
+
+    def get_summary_data_frame(self):
+        """
+        Returns the best fit values and errors of the free parameters, the statistic values and the statistical
+        measures of all the results (see AnalysisResultsSet.get_summary_data_frame)
+
+        :return: a pandas DataFrame
+        """
+
+        frames = [self._read_columns(table) for table in ['values', 'errors', 'statistics', 'measures']]
+
+        return pd.concat(frames, axis=1, keys=['value', 'error', 'statistic', 'measure'])
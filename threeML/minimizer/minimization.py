@@ -1,5 +1,8 @@
 import collections
 import math
+import multiprocessing
+import sys
+import traceback
 import numpy as np
 import pandas as pd
 import scipy.optimize
@@ -8,6 +11,15 @@ from threeML.io.progress_bar import progress_bar
 from threeML.exceptions.custom_exceptions import custom_warnings
 from threeML.utils.differentiation import get_hessian, ParameterOnBoundary
 
+try:
+
+    import Queue as queue
+
+except ImportError:
+
+    # py3k
+    import queue
+
 # Set the warnings to be issued always for this module
 
 custom_warnings.simplefilter("always", RuntimeWarning)
@@ -64,6 +76,27 @@ def get_minimizer(minimizer_type):
         raise MinimizerNotAvailable("Minimizer %s is not available on your system" % minimizer_type)
 
 
+class FunctionWithGradient(object):
+
+    def __init__(self, function, gradient):
+        """
+        Attach the gradient to a function to be minimized. Minimizers able to use it (and the computation of the
+        Hessian matrix) will use the provided gradient instead of numerical derivatives of the function.
+
+        :param function: the function to be minimized
+        :param gradient: a function with the same calling sequence of function, returning an array with the
+        derivatives of function with respect to each one of its arguments
+        """
+
+        self._function = function
+
+        self.gradient = gradient
+
+    def __call__(self, *trial_values):
+
+        return self._function(*trial_values)
+
+
 class FunctionWrapper(object):
 
     def __init__(self, function, all_parameters, fixed_parameters):
@@ -90,6 +123,16 @@ class FunctionWrapper(object):
 
         self._all_values = np.zeros(len(self._all_parameters))
 
+        # If the wrapped function provides a gradient, provide one as well (for the free parameters only)
+
+        if getattr(self._function, 'gradient', None) is not None:
+
+            self.gradient = self._gradient
+
+        else:
+
+            self.gradient = None
+
     def set_fixed_values(self, new_fixed_values):
 
         # Note that this will receive the fixed values in internal reference (after the transformations, if any)
@@ -108,6 +151,15 @@ class FunctionWrapper(object):
 
         return self._function(*self._all_values)
 
+    def _gradient(self, *trial_values):
+
+        self._all_values[self._indexes_of_fixed_par] = self._fixed_parameters_values
+        self._all_values[~self._indexes_of_fixed_par] = trial_values
+
+        full_gradient = np.array(self._function.gradient(*self._all_values))
+
+        return full_gradient[~self._indexes_of_fixed_par]
+
 
 class ProfileLikelihood(object):
 
@@ -139,6 +191,14 @@ class ProfileLikelihood(object):
 
         self._n_free_parameters = len(free_parameters)
 
+        self._minimizer_type = type(minimizer_instance)
+
+        self._algorithm_name = minimizer_instance.algorithm_name
+
+        self._setup_optimizer(free_parameters)
+
+    def _setup_optimizer(self, free_parameters):
+
         if self._n_free_parameters > 0:
 
             self._wrapper = FunctionWrapper(self._function,
@@ -148,11 +208,11 @@ class ProfileLikelihood(object):
             # Create a copy of the optimizer with the new parameters (i.e., one or two
             # parameters fixed to their current values)
 
-            self._optimizer = type(minimizer_instance)(self._wrapper, free_parameters, verbosity=0)
+            self._optimizer = self._minimizer_type(self._wrapper, free_parameters, verbosity=0)
 
-            if minimizer_instance.algorithm_name is not None:
+            if self._algorithm_name is not None:
 
-                self._optimizer.set_algorithm(minimizer_instance.algorithm_name)
+                self._optimizer.set_algorithm(self._algorithm_name)
 
         else:
 
@@ -162,6 +222,27 @@ class ProfileLikelihood(object):
             self._wrapper = None
             self._optimizer = None
 
+    def __getstate__(self):
+
+        # The optimizer might not be serializable, so it is re-created when the instance is unpickled (for example,
+        # in the worker processes of _step_grid_in_pool when they are spawned instead of forked)
+
+        state = dict(self.__dict__)
+
+        state['_wrapper'] = None
+        state['_optimizer'] = None
+
+        return state
+
+    def __setstate__(self, state):
+
+        self.__dict__.update(state)
+
+        free_parameters = collections.OrderedDict((name, parameter) for name, parameter in self._all_parameters.items()
+                                                  if name not in self._fixed_parameters)
+
+        self._setup_optimizer(free_parameters)
+
     def _transform_steps(self, parameter_name, steps):
         """
         If the parameter has a transformation, use it for the steps and return the transformed steps
@@ -181,7 +262,20 @@ class ProfileLikelihood(object):
 
             return steps
 
-    def step(self, steps1, steps2=None):
+    def step(self, steps1, steps2=None, n_processes=1):
+        """
+        Compute the profile likelihood on a grid of values for the fixed parameter(s).
+
+        The grid is explored starting from the point closest to the current values of the fixed parameters, and the
+        minimization for each point starts from the best fit of its neighbour closer to that point. Since this does
+        not depend on the order in which the points are computed, the computation can be distributed over a local
+        pool of processes (with n_processes > 1), giving the same results as the serial computation.
+
+        :param steps1: steps for the first fixed parameter
+        :param steps2: steps for the second fixed parameter (if any)
+        :param n_processes: number of local processes to use (default: 1, i.e., serial computation)
+        :return: array of -log(likelihood) values, with shape (len(steps1),) or (len(steps1), len(steps2))
+        """
 
         if steps2 is not None:
 
@@ -207,15 +301,13 @@ class ProfileLikelihood(object):
 
                 # Switch steps
 
-                swap = steps1
-                steps1 = steps2
-                steps2 = swap
-
-                results = self._step2d(steps1, steps2).T
+                results = self._step_grid([steps2, steps1], [param_2_name, param_1_name], n_processes,
+                                          catch_failures=True).T
 
             else:
 
-                results = self._step2d(steps1, steps2)
+                results = self._step_grid([steps1, steps2], [param_1_name, param_2_name], n_processes,
+                                          catch_failures=True)
 
             return results
 
@@ -223,7 +315,11 @@ class ProfileLikelihood(object):
 
             assert len(self._fixed_parameters) == 1, "You cannot step in 1d if you fix 2 parameters"
 
-            return self._step1d(steps1)
+            # The fixed values are given to the function in the internal reference, like in the 2d case
+
+            steps1 = self._transform_steps(self._fixed_parameters[0], steps1)
+
+            return self._step_grid([steps1], [self._fixed_parameters[0]], n_processes, catch_failures=False)
 
     def __call__(self, values):
 
@@ -233,72 +329,267 @@ class ProfileLikelihood(object):
 
         return this_log_like
 
-    def _step1d(self, steps1):
+    def _get_free_parameters_values(self):
+
+        return [parameter._get_internal_value() for parameter in self._optimizer.parameters.values()]
+
+    def _profile_point(self, fixed_values, initial_values, catch_failures):
+        """
+        Profile out the free parameters for the provided values of the fixed parameters, starting the minimization
+        from the provided values of the free parameters
+
+        :param fixed_values: values for the fixed parameters (internal reference)
+        :param initial_values: starting values for the free parameters (internal reference)
+        :param catch_failures: if True, a failed minimization gives nan instead of raising FitFailed
+        :return: (-log(likelihood), best fit values of the free parameters)
+        """
+
+        if self._n_free_parameters == 0:
+
+            # No free parameters, just compute the likelihood
+
+            return self._function(*fixed_values), None
+
+        # Profile out the free parameters
+
+        self._wrapper.set_fixed_values(fixed_values)
+
+        self._optimizer.set_initial_values(initial_values)
+
+        try:
+
+            _, this_log_like = self._optimizer.minimize(compute_covar=False)
+
+        except FitFailed:
+
+            if not catch_failures:
+
+                raise
+
+            # If the user is stepping too far it might be that the fit fails. It is usually not a
+            # problem. The neighbours will start from the same point as this one
+
+            return np.nan, initial_values
+
+        return this_log_like, self._get_free_parameters_values()
+
+    def _step_grid(self, steps, parameter_names, n_processes, catch_failures):
+
+        shape = tuple(len(these_steps) for these_steps in steps)
+
+        n_points = int(np.prod(shape))
+
+        # The exploration starts from the grid point closest to the current values of the fixed parameters (the
+        # steps are in the internal reference)
+
+        root = tuple(int(np.argmin(np.abs(np.asarray(these_steps) - self._all_parameters[name]._get_internal_value())))
+                     for these_steps, name in zip(steps, parameter_names))
+
+        # Each point starts from the best fit of the neighbour one step closer to the root (moving first along the
+        # last axis, then along the first one)
+
+        children = [[] for _ in range(n_points)]
+
+        for flat_index in range(n_points):
+
+            index = np.unravel_index(flat_index, shape)
+
+            parent = list(index)
 
-        log_likes = np.zeros_like(steps1)
+            for axis in reversed(range(len(shape))):
 
-        with progress_bar(len(steps1), title='Profiling likelihood') as p:
+                if index[axis] != root[axis]:
 
-            for i, step in enumerate(steps1):
+                    parent[axis] += 1 if index[axis] < root[axis] else -1
 
-                if self._n_free_parameters > 0:
+                    children[np.ravel_multi_index(parent, shape)].append(flat_index)
 
-                    # Profile out the free parameters
+                    break
+
+        grid_values = [[steps[axis][index_along_axis] for axis, index_along_axis in
+                        enumerate(np.unravel_index(flat_index, shape))] for flat_index in range(n_points)]
+
+        # Save the current state, to restore it at the end
 
-                    self._wrapper.set_fixed_values(step)
+        backup_values = [parameter._get_internal_value() for parameter in self._all_parameters.values()]
 
-                    _, this_log_like = self._optimizer.minimize(compute_covar=False)
+        initial_values = self._get_free_parameters_values() if self._n_free_parameters > 0 else None
+
+        log_likes = np.zeros(n_points)
+
+        try:
+
+            with progress_bar(n_points, title='Profiling likelihood') as p:
+
+                if n_processes > 1 and self._n_free_parameters > 0:
+
+                    self._step_grid_in_pool(n_processes, grid_values, children,
+                                            np.ravel_multi_index(root, shape), initial_values,
+                                            catch_failures, log_likes, p)
 
                 else:
 
-                    # No free parameters, just compute the likelihood
+                    # Same exploration as in the pool, so that the results do not depend on n_processes
 
-                    this_log_like = self._function(step)
+                    to_do = [(np.ravel_multi_index(root, shape), initial_values)]
 
-                log_likes[i] = this_log_like
+                    while len(to_do) > 0:
 
-                p.increase()
+                        flat_index, these_initial_values = to_do.pop()
+
+                        log_likes[flat_index], best_fit_values = self._profile_point(grid_values[flat_index],
+                                                                                     these_initial_values,
+                                                                                     catch_failures)
+
+                        to_do.extend((child, best_fit_values) for child in children[flat_index])
+
+                        p.increase()
+
+        finally:
+
+            for parameter, value in zip(self._all_parameters.values(), backup_values):
+
+                parameter._set_internal_value(value)
+
+        return log_likes.reshape(shape)
+
+    def _step_grid_in_pool(self, n_processes, grid_values, children, root, initial_values, catch_failures,
+                           log_likes, p):
+
+        # The worker processes get a copy of this instance (and of the whole likelihood) through the initializer
+        # of the pool. With the "spawn" start method (the default on Windows and macOS) this means that the
+        # likelihood function must be serializable. Points are submitted as soon as the point they depend on is
+        # done, and each idle process takes the next point in the queue
+
+        pool = multiprocessing.Pool(n_processes, initializer=_initialize_profile_worker, initargs=(self,))
+
+        done = queue.Queue()
 
-        return log_likes
+        # error_callback is not supported by Python 2
 
-    def _step2d(self, steps1, steps2):
+        has_error_callback = sys.version_info[0] >= 3
 
-        log_likes = np.zeros((len(steps1), len(steps2)))
+        # Points submitted to the pool whose result has not been processed yet
 
-        with progress_bar(len(steps1) * len(steps2), title='Profiling likelihood') as p:
+        pending = {}
 
-            for i, step1 in enumerate(steps1):
+        def failed(flat_index, exception):
 
-                for j,step2 in enumerate(steps2):
+            done.put((flat_index, None, None, ('Exception', "%s: %s" % (type(exception).__name__, exception))))
 
-                    if self._n_free_parameters > 0:
+        def submit(flat_index, these_initial_values):
 
-                        # Profile out the free parameters
+            # Errors happening outside of _profile_point_in_worker (for example if the result cannot be pickled)
+            # never reach the callback, so they must be put on the queue as well, otherwise we would wait forever
 
-                        self._wrapper.set_fixed_values([step1, step2])
+            options = {'callback': done.put}
 
-                        try:
+            if has_error_callback:
+
+                options['error_callback'] = lambda exception: failed(flat_index, exception)
+
+            pending[flat_index] = pool.apply_async(_profile_point_in_worker,
+                                                   ((flat_index, grid_values[flat_index], these_initial_values,
+                                                     catch_failures),),
+                                                   **options)
+
+        def get_result():
+
+            if has_error_callback:
+
+                return done.get()
+
+            while True:
+
+                try:
+
+                    return done.get(timeout=1)
+
+                except queue.Empty:
+
+                    # Look for the failed points ourselves
+
+                    for flat_index, result in list(pending.items()):
+
+                        if result.ready() and not result.successful():
+
+                            try:
+
+                                result.get()
+
+                            except Exception as e:
+
+                                failed(flat_index, e)
+
+                            del pending[flat_index]
+
+        try:
 
-                            _, this_log_like = self._optimizer.minimize(compute_covar=False)
+            submit(root, initial_values)
 
-                        except FitFailed:
+            for _ in range(len(grid_values)):
 
-                            # If the user is stepping too far it might be that the fit fails. It is usually not a
-                            # problem
+                flat_index, this_log_like, best_fit_values, error = get_result()
 
-                            this_log_like = np.nan
+                pending.pop(flat_index, None)
+
+                if error is not None:
+
+                    error_type, message = error
+
+                    if error_type == 'FitFailed':
+
+                        raise FitFailed(message)
 
                     else:
 
-                        # No free parameters, just compute the likelihood
+                        raise RuntimeError("Profiling failed in worker process:\n%s" % message)
+
+                log_likes[flat_index] = this_log_like
+
+                for child in children[flat_index]:
+
+                    submit(child, best_fit_values)
+
+                p.increase()
+
+        finally:
+
+            pool.terminate()
+            pool.join()
+
+
+# This is the ProfileLikelihood instance used by each worker process of ProfileLikelihood._step_grid_in_pool. It is
+# set by the initializer of the pool, and it is never set in the main process
+
+_profile_likelihood_in_worker = None
+
+
+def _initialize_profile_worker(profile_likelihood):
+
+    global _profile_likelihood_in_worker
+
+    _profile_likelihood_in_worker = profile_likelihood
+
+
+def _profile_point_in_worker(args):
 
-                        this_log_like = self._function(step1, step2)
+    flat_index, fixed_values, initial_values, catch_failures = args
 
-                    log_likes[i,j] = this_log_like
+    try:
+
+        this_log_like, best_fit_values = _profile_likelihood_in_worker._profile_point(fixed_values, initial_values,
+                                                                                       catch_failures)
+
+    except FitFailed as e:
+
+        return flat_index, None, None, ('FitFailed', str(e))
+
+    except Exception:
 
-                    p.increase()
+        return flat_index, None, None, ('Exception', traceback.format_exc())
 
-        return log_likes
+    return flat_index, this_log_like, best_fit_values, None
 
 
 # This classes are used directly by the user to have better control on the minimizers.
@@ -529,6 +820,15 @@ class Minimizer(object):
 
         return self._function
 
+    @property
+    def gradient(self):
+        """
+        The gradient of the function to be minimized, or None if the function does not provide one (in which case
+        derivatives are computed numerically)
+        """
+
+        return getattr(self._function, 'gradient', None)
+
     @property
     def parameters(self):
 
@@ -718,6 +1018,22 @@ class Minimizer(object):
         # Regenerate the internal parameter dictionary with the new values
         self._internal_parameters = self._update_internal_parameter_dictionary()
 
+    def set_initial_values(self, internal_values):
+        """
+        Set the starting point for the next minimization
+
+        :param internal_values: values for the free parameters, in the internal reference (after the
+        transformations, if any) and in the same order as the parameters dictionary
+        :return: none
+        """
+
+        for parameter, value in zip(self.parameters.values(), internal_values):
+
+            parameter._set_internal_value(value)
+
+        # Regenerate the internal parameter dictionary with the new values
+        self._internal_parameters = self._update_internal_parameter_dictionary()
+
     def _compute_covariance_matrix(self, best_fit_values):
         """
         This function compute the approximate covariance matrix as the inverse of the Hessian matrix,
@@ -727,7 +1043,7 @@ class Minimizer(object):
         The sqrt of the diagonal of the result is an accurate estimate of the errors only if the
         log.likelihood is parabolic in the neighborhood of the minimum.
 
-        Derivatives are computed numerically.
+        Derivatives are computed numerically (from the gradient of the function, if available).
 
         :return: the covariance matrix
         """
@@ -757,7 +1073,7 @@ class Minimizer(object):
 
         try:
 
-            hessian_matrix = get_hessian(self.function, best_fit_values, minima, maxima)
+            hessian_matrix = get_hessian(self.function, best_fit_values, minima, maxima, gradient=self.gradient)
 
         except ParameterOnBoundary:
 
@@ -1039,7 +1355,7 @@ class Minimizer(object):
 
     def contours(self, param_1, param_1_minimum, param_1_maximum, param_1_n_steps,
                          param_2=None, param_2_minimum=None, param_2_maximum=None, param_2_n_steps=None,
-                         progress=True, **options):
+                         progress=True, n_processes=1, **options):
 
             """
             Generate confidence contours for the given parameters by stepping for the given number of steps between
@@ -1056,6 +1372,7 @@ class Minimizer(object):
             :param param_2_maximum: upper bound for the range for the second parameter
             :param param_2_n_steps: number of steps for the second parameter
             :param progress: (True or False) whether to display progress or not
+            :param n_processes: number of local processes to use to compute the grid (default: 1, i.e., serial)
             :param log: by default the steps are taken linearly. With this optional parameter you can provide a tuple of
             booleans which specify whether the steps are to be taken logarithmically. For example,
             'log=(True,False)' specify that the steps for the first parameter are to be taken logarithmically, while they
@@ -1147,11 +1464,11 @@ class Minimizer(object):
 
             if n_dimensions == 1:
 
-                results = pr.step(param_1_steps)
+                results = pr.step(param_1_steps, n_processes=n_processes)
 
             else:
 
-                results = pr.step(param_1_steps, param_2_steps)
+                results = pr.step(param_1_steps, param_2_steps, n_processes=n_processes)
 
             # Return results
 
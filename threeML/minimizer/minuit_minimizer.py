@@ -97,6 +97,12 @@ class MinuitMinimizer(LocalMinimizer):
 
         iminuit_init_parameters['forced_parameters'] = variable_names_for_iminuit
 
+        # If the function provides its gradient, let Minuit use it instead of computing it numerically
+
+        if self.gradient is not None:
+
+            iminuit_init_parameters['grad'] = self.gradient
+
         # # We need to make a function with the parameters as explicit
         # # variables in the calling sequence, so that Minuit will be able
         # # to probe the parameter's names
@@ -169,6 +175,25 @@ class MinuitMinimizer(LocalMinimizer):
 
             self.minuit.values[minuit_name] = par._get_internal_value()
 
+    # Override this because minuit keeps its own copy of the starting point
+    def set_initial_values(self, internal_values):
+        """
+        Set the starting point for the next minimization, resetting also the steps used by Minuit, so that the
+        next minimization does not depend on what was done before
+
+        :param internal_values: values for the free parameters, in the internal reference
+        :return: none
+        """
+
+        super(MinuitMinimizer, self).set_initial_values(internal_values)
+
+        for parameter_path, (value, delta, minimum, maximum) in self._internal_parameters.items():
+
+            minuit_name = self._parameter_name_to_minuit_name(parameter_path)
+
+            self.minuit.values[minuit_name] = value
+            self.minuit.errors[minuit_name] = delta
+
     def _is_fit_ok(self):
         """
         iMinuit provides the method migrad_ok(). However, that method also checks for a valid Hessian matrix, which
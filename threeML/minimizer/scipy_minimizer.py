@@ -97,6 +97,10 @@ class ScipyMinimizer(LocalMinimizer):
 
                 return np.inf
 
+            if self.gradient is not None:
+
+                return np.array(self.gradient(*x), dtype=float)
+
             jacv = get_jacobian(wrapper_2, x, minima, maxima)
 
             return jacv
@@ -0,0 +1,200 @@
+import multiprocessing
+import multiprocessing.pool
+
+import numpy as np
+
+from threeML.config.config import threeML_config
+from threeML.parallel.parallel_client import ParallelClient
+
+try:
+
+    string_types = basestring
+
+except NameError:
+
+    # py3k
+    string_types = str
+
+
+class SerialExecutor(object):
+    """
+    Execute the work in the current process, one item after the other
+    """
+
+    def __init__(self, **options):
+
+        pass
+
+    def imap_unordered(self, worker, items):
+        """
+        Apply the worker to all the items, yielding the tuple (item, result) for each item as soon as it is done
+
+        :param worker: the function to be applied
+        :param items: the items to apply the function to
+        :return: a generator of (item, result) tuples
+        """
+
+        for item in items:
+
+            yield item, worker(item)
+
+    def close(self):
+
+        pass
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+
+        self.close()
+
+
+class ThreadPoolExecutor(SerialExecutor):
+    """
+    Execute the work in a pool of threads in the current process. This is useful only when the worker spends most of
+    its time in code that releases the GIL
+    """
+
+    def __init__(self, n_workers=None, **options):
+
+        if n_workers is None:
+
+            n_workers = multiprocessing.cpu_count()
+
+        self._pool = multiprocessing.pool.ThreadPool(n_workers)
+
+    def imap_unordered(self, worker, items):
+
+        return self._pool.imap_unordered(lambda item: (item, worker(item)), items)
+
+    def close(self):
+
+        self._pool.terminate()
+        self._pool.join()
+
+
+# This is the worker used by each process of the ProcessPoolExecutor. It is set by the initializer of the pool
+
+_worker_in_process = None
+
+
+def _initialize_process(worker):
+
+    global _worker_in_process
+
+    _worker_in_process = worker
+
+    # Forked processes inherit the state of the random number generator of the parent, so they would all draw the
+    # same numbers (for example, simulate the same datasets). Reseed it from the entropy of the OS
+
+    np.random.seed()
+
+
+def _apply_worker_in_process(item):
+
+    return item, _worker_in_process(item)
+
+
+class ProcessPoolExecutor(SerialExecutor):
+    """
+    Execute the work in a pool of processes on the local machine. The worker is given to the processes when the pool
+    is created, so with the "spawn" start method (the default on Windows and macOS) it must be serializable. The numpy
+    random number generator of each process is seeded independently
+    """
+
+    def __init__(self, n_workers=None, **options):
+
+        if n_workers is None:
+
+            n_workers = multiprocessing.cpu_count()
+
+        self._n_workers = int(n_workers)
+
+        self._pool = None
+
+    def imap_unordered(self, worker, items):
+
+        # A new pool is created for each worker
+
+        self.close()
+
+        self._pool = multiprocessing.Pool(self._n_workers, initializer=_initialize_process, initargs=(worker,))
+
+        return self._pool.imap_unordered(_apply_worker_in_process, items)
+
+    def close(self):
+
+        if self._pool is not None:
+
+            self._pool.terminate()
+            self._pool.join()
+
+            self._pool = None
+
+
+def _apply_worker(worker, item):
+
+    return item, worker(item)
+
+
+class IPyParallelExecutor(SerialExecutor):
+    """
+    Execute the work on the engines of an ipyparallel cluster (see parallel_computation)
+    """
+
+    def __init__(self, n_workers=None, **options):
+
+        # The number of engines is decided when starting the cluster, so n_workers is ignored
+
+        self._client = ParallelClient(**options)
+
+    def imap_unordered(self, worker, items):
+
+        items = list(items)
+
+        view = self._client.load_balanced_view()
+
+        # Iterating over the unordered result yields the results as soon as they are available
+
+        return iter(view.map_async(_apply_worker, [worker] * len(items), items, ordered=False))
+
+
+_executors = {'serial': SerialExecutor,
+              'threads': ThreadPoolExecutor,
+              'processes': ProcessPoolExecutor,
+              'ipyparallel': IPyParallelExecutor}
+
+
+def get_executor(executor=None, **options):
+    """
+    Returns an executor instance
+
+    :param executor: one of 'serial', 'threads', 'processes' or 'ipyparallel', or an executor instance (which is
+    returned as it is). If None, use 'ipyparallel' if parallel computation is active (see parallel_computation),
+    otherwise 'serial'
+    :param options: options for the executor, like n_workers for the pools, or the options for the ParallelClient
+    :return: an executor instance
+    """
+
+    if executor is None:
+
+        if threeML_config['parallel']['use-parallel']:
+
+            executor = 'ipyparallel'
+
+        else:
+
+            executor = 'serial'
+
+    if not isinstance(executor, string_types):
+
+        # Already an executor instance
+
+        return executor
+
+    assert executor in _executors, "Executor %s is not known. Available executors: %s" % (executor,
+                                                                                         ",".join(_executors.keys()))
+
+    return _executors[executor](**options)
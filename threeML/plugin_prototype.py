@@ -153,6 +153,74 @@ class PluginPrototype(object):
     tag = property(_get_tag, _set_tag, doc="Gets/sets the tag for this instance, as (independent variable, start, "
                                            "[end])")
 
+    ######################################################################
+    # The following methods can be implemented by plugins able to compute
+    # the gradient of their log-likelihood
+    ######################################################################
+
+    @property
+    def has_log_like_gradient(self):
+        """
+        Whether this plugin implements get_log_like_gradient. If all plugins in an analysis do, the minimizers will
+        use the gradient instead of computing derivatives numerically.
+        """
+
+        return False
+
+    def get_log_like_gradient(self, parameters):
+        """
+        Return the derivatives of the value returned by inner_fit with respect to the provided parameters (in their
+        internal reference, i.e., the one used by the minimizers) with the current values for the parameters.
+
+        :param parameters: list of free parameters (astromodels Parameter instances). These can be parameters of the
+        likelihood model or nuisance parameters of this plugin
+        :return: array with one derivative per parameter, or None if the gradient is not available
+        """
+
+        return None
+
+    @property
+    def has_batch_log_like(self):
+        """
+        Whether this plugin implements get_log_like_batch, which is used to evaluate the posterior for many points at
+        once (see BayesianAnalysis.sample)
+        """
+
+        return False
+
+    def get_log_like_batch(self, parameters, values):
+        """
+        Return the values of get_log_like for many sets of values of the provided parameters at once
+
+        :param parameters: list of free parameters (astromodels Parameter instances). These can be parameters of the
+        likelihood model or nuisance parameters of this plugin
+        :param values: 2d array with one set of values (one per parameter) per row
+        :return: array with one log-likelihood value per row, or None if this is not available
+        """
+
+        return None
+
+    @property
+    def has_in_place_simulation(self):
+        """
+        Whether this plugin implements update_simulated_dataset. If all plugins in an analysis do, the Monte Carlo
+        simulations (see GoodnessOfFit and LikelihoodRatioTest) re-use the same simulated datasets instead of
+        creating new ones at each iteration.
+        """
+
+        return False
+
+    def update_simulated_dataset(self, simulated_dataset):
+        """
+        Re-randomize in place the data of a plugin previously returned by get_simulated_dataset, using the current
+        model.
+
+        :param simulated_dataset: a plugin returned by the get_simulated_dataset method of this plugin
+        :return: none
+        """
+
+        raise NotImplementedError("Plugin %s does not support in-place simulations" % type(self).__name__)
+
     ######################################################################
     # The following methods must be implemented by each plugin
     ######################################################################
@@ -80,6 +80,22 @@ class DispersionSpectrumLike(SpectrumLike):
 
         return self._rsp.convolve()
 
+    def _evaluate_true_fluxes(self):
+        """
+        evaluates the integral of the model over the Monte Carlo energies of the response
+        :return:
+        """
+
+        return self._rsp.get_true_fluxes()
+
+    def _fold_true_fluxes(self, true_fluxes):
+        """
+        folds the true fluxes (or their derivatives) through the response
+        :return:
+        """
+
+        return self._rsp.fold(true_fluxes)
+
     def get_simulated_dataset(self, new_name=None, **kwargs):
         """
         Returns another DispersionSpectrumLike instance where data have been obtained by randomizing the current expectation from the
@@ -7,6 +7,7 @@ import numpy as np
 import pandas as pd
 from astromodels import Model, PointSource
 from astromodels import clone_model
+from astromodels import ModelAssertionViolation
 from astromodels.core.parameter import Parameter
 from astromodels.functions.priors import Uniform_prior
 from astromodels.utils.valid_variable import is_valid_variable_name
@@ -20,6 +21,7 @@ from threeML.io.rich_display import display
 from threeML.plugin_prototype import PluginPrototype
 from threeML.plugins.XYLike import XYLike
 from threeML.utils.binner import Rebinner
+from threeML.utils.differentiation import get_parameter_derivatives
 from threeML.utils.spectrum.binned_spectrum import BinnedSpectrum, ChannelSet
 
 from threeML.utils.string_utils import dash_separated_string_to_tuple
@@ -82,6 +84,10 @@ class SpectrumLike(PluginPrototype):
 
         self._observed_counts = self._observed_spectrum.counts  # type: np.ndarray
 
+        # Precomputed energy grid used to integrate the model over all the channels at once (for speed)
+
+        self._integration_grid = self._build_integration_grid(self._observed_spectrum.bin_stack)
+
         # initialize the background
 
         background_parameters = self._background_setup(background, observation)
@@ -147,6 +153,7 @@ class SpectrumLike(PluginPrototype):
 
                 differential_flux, integral = self._get_diff_flux_and_integral(self._background_plugin.likelihood_model)
 
+                self._background_differential_flux = differential_flux
                 self._background_integral_flux = integral
 
 
@@ -1085,12 +1092,86 @@ class SpectrumLike(PluginPrototype):
 
         # Generate randomized data depending on the different noise models
 
-        # We remove the mask temporarily because we need the various elements for all channels. We will restore it
-        # at the end
+        (randomized_source_counts, randomized_source_count_err,
+         randomized_background_counts, randomized_background_count_err) = self._get_randomized_counts()
 
         original_mask = np.array(self._mask, copy=True)
         original_rebinner = self._rebinner
 
+        # create new source and background spectra
+        # the children of BinnedSpectra must properly override the new_spectrum
+        # member so as to build the appropriate spectrum type. All parameters of the current
+        # spectrum remain the same except for the rate and rate errors
+
+        # the profile likelihood automatically adjust the background spectrum to the
+        # same exposure and scale as the observation
+        # therefore, we must  set the background simulation to have the exposure and scale
+        # of the observation
+
+        new_observation = self._observed_spectrum.clone(new_counts=randomized_source_counts,
+                                                        new_count_errors=randomized_source_count_err,
+                                                        new_scale_factor=1.
+                                                        )
+
+        if self._background_spectrum is not None:
+
+            new_background = self._background_spectrum.clone(new_counts=randomized_background_counts,
+                                                             new_count_errors=randomized_background_count_err,
+                                                             new_exposure=self._observed_spectrum.exposure, # because it was adjusted
+                                                             new_scale_factor=1. # because it was adjusted
+                                                             )
+
+        elif self._background_plugin is not None:
+
+
+            new_background = self._likelihood_evaluator.synthetic_background_plugin
+
+        else:
+
+            new_background = None
+
+        # Now create another instance of BinnedSpectrum with the randomized data we just generated
+        # notice that the _new member is a classmethod
+        # (we use verbose=False to avoid many messages when doing many simulations)
+        new_spectrum_plugin = self._new_plugin(name=new_name,
+                                               observation=new_observation,
+                                               background=new_background,
+                                               verbose=False,
+                                               **kwargs)
+
+        # Apply the same selections as the current data set
+        if original_rebinner is not None:
+
+            # Apply rebinning, which also applies the mask
+            new_spectrum_plugin._apply_rebinner(original_rebinner)
+
+        else:
+
+            # Only apply the mask
+            new_spectrum_plugin._mask = original_mask
+            new_spectrum_plugin._apply_mask_to_original_vectors()
+
+        # We want to store the simulated parameters so that the user
+        # can recall them later
+
+        new_spectrum_plugin._simulation_storage = clone_model(self._like_model)
+
+        # TODO: nuisance parameters
+
+        return new_spectrum_plugin
+
+    def _get_randomized_counts(self):
+        """
+        Randomize the current expectation from the model, as well as the background (depending on the respective
+        noise models), for all channels
+
+        :return: (source counts, source count errors, background counts, background count errors), some of which
+        can be None depending on the noise models
+        """
+
+        # We remove the mask temporarily because we need the various elements for all channels. It is restored
+        # at the end
+
         with self._without_mask_nor_rebinner():
 
             # Get the source model for all channels (that's why we don't use the .folded_model property)
@@ -1106,68 +1187,77 @@ class SpectrumLike(PluginPrototype):
             randomized_background_counts = self._likelihood_evaluator.get_randomized_background_counts()
             randomized_background_count_err = self._likelihood_evaluator.get_randomized_background_errors()
 
+        return (randomized_source_counts, randomized_source_count_err,
+                randomized_background_counts, randomized_background_count_err)
 
-            # create new source and background spectra
-            # the children of BinnedSpectra must properly override the new_spectrum
-            # member so as to build the appropriate spectrum type. All parameters of the current
-            # spectrum remain the same except for the rate and rate errors
+    @property
+    def has_in_place_simulation(self):
 
-            # the profile likelihood automatically adjust the background spectrum to the
-            # same exposure and scale as the observation
-            # therefore, we must  set the background simulation to have the exposure and scale
-            # of the observation
+        # A modeled background is simulated by its own plugin, which we cannot update in place
 
-            new_observation = self._observed_spectrum.clone(new_counts=randomized_source_counts,
-                                                            new_count_errors=randomized_source_count_err,
-                                                            new_scale_factor=1.
-                                                            )
+        return self._background_plugin is None
 
-            if self._background_spectrum is not None:
+    def update_simulated_dataset(self, simulated_dataset):
+        """
+        Re-randomize in place the data of a plugin previously obtained with get_simulated_dataset, by randomizing the
+        current expectation from the model as well as the background. This is much faster than generating a new
+        simulated dataset, as the response, the channels and everything else are kept.
 
-                new_background = self._background_spectrum.clone(new_counts=randomized_background_counts,
-                                                                 new_count_errors=randomized_background_count_err,
-                                                                 new_exposure=self._observed_spectrum.exposure, # because it was adjusted
-                                                                 new_scale_factor=1. # because it was adjusted
-                                                                 )
+        :param simulated_dataset: a plugin returned by the get_simulated_dataset method of this plugin
+        :return: none
+        """
 
-            elif self._background_plugin is not None:
+        assert self._like_model is not None, "You need to set up a model before randomizing"
 
+        assert self.has_in_place_simulation, "Cannot update the simulated dataset in place when the background " \
+                                             "is modeled with a plugin"
 
-                new_background = self._likelihood_evaluator.synthetic_background_plugin
+        simulated_dataset._set_simulated_counts(*self._get_randomized_counts())
 
-            else:
+        # Update the stored simulated parameters as well, without cloning the model again
 
-                new_background = None
+        for parameter_path, parameter in simulated_dataset._simulation_storage.parameters.items():
 
-            # Now create another instance of BinnedSpectrum with the randomized data we just generated
-            # notice that the _new member is a classmethod
-            # (we use verbose=False to avoid many messages when doing many simulations)
-            new_spectrum_plugin = self._new_plugin(name=new_name,
-                                                   observation=new_observation,
-                                                   background=new_background,
-                                                   verbose=False,
-                                                   **kwargs)
+            if not parameter.has_auxiliary_variable():
 
-            # Apply the same selections as the current data set
-            if original_rebinner is not None:
+                parameter._set_internal_value(self._like_model.parameters[parameter_path]._get_internal_value())
 
-                # Apply rebinning, which also applies the mask
-                new_spectrum_plugin._apply_rebinner(original_rebinner)
+    def _set_simulated_counts(self, observed_counts, observed_count_errors, background_counts,
+                              background_count_errors):
 
-            else:
+        # Replace the data with new simulated data (see update_simulated_dataset). The spectra are owned by this
+        # plugin, as they have been created by get_simulated_dataset, so we can change them in place
+
+        self._observed_spectrum._set_counts(observed_counts, observed_count_errors)
+
+        self._observed_counts = self._observed_spectrum.counts
+
+        if self._observed_count_errors is not None:
+
+            self._observed_count_errors = self._observed_spectrum.count_errors
+
+        if self._background_spectrum is not None:
 
-                # Only apply the mask
-                new_spectrum_plugin._mask = original_mask
-                new_spectrum_plugin._apply_mask_to_original_vectors()
+            self._background_spectrum._set_counts(background_counts, background_count_errors)
 
-            # We want to store the simulated parameters so that the user
-            # can recall them later
+            self._background_counts = self._background_spectrum.counts
 
-            new_spectrum_plugin._simulation_storage = clone_model(self._like_model)
+            self._scaled_background_counts = self._get_expected_background_counts_scaled(self._background_spectrum)
 
-            # TODO: nuisance parameters
+            if self._back_count_errors is not None:
+
+                self._back_count_errors = self._background_spectrum.count_errors
+
+        # Re-apply the current selections. This creates new data vectors, so the likelihood evaluator will
+        # rebuild its kernel
+
+        if self._rebinner is not None:
 
-            return new_spectrum_plugin
+            self._apply_rebinner(self._rebinner)
+
+        else:
+
+            self._apply_mask_to_original_vectors()
 
     @classmethod
     def _new_plugin(cls, *args, **kwargs):
@@ -1305,7 +1395,7 @@ class SpectrumLike(PluginPrototype):
         :return:
         """
 
-        # NOTE : this is called only once during construction!
+        # NOTE : this is called only during construction, and when simulated data are replaced in place
 
         # The scale factor is the ratio between the collection area of the source spectrum and the
         # background spectrum. It is used for example for the typical aperture-photometry method used in
@@ -1409,6 +1499,131 @@ class SpectrumLike(PluginPrototype):
 
         return self.get_log_like()
 
+    @property
+    def has_log_like_gradient(self):
+
+        return self._likelihood_evaluator.has_derivative
+
+    def get_log_like_gradient(self, parameters):
+        """
+        Computes the derivatives of the log-likelihood with respect to the provided parameters with the chain rule.
+        The derivatives of the statistic with respect to the model counts are analytic, as is the one with respect
+        to the effective area correction (the model is linear in it). The derivatives of the source spectrum are
+        computed numerically on the true fluxes only (astromodels does not provide analytic derivatives), and then
+        folded all at once (through the response, if any).
+
+        :param parameters: list of free parameters
+        :return: array of derivatives (one per parameter), or None if not available for the current noise models
+        """
+
+        count_derivatives = self._likelihood_evaluator.get_current_derivative()
+
+        if count_derivatives is None:
+
+            return None
+
+        gradient = np.zeros(len(parameters))
+
+        model_parameters_idx = []
+
+        for i, parameter in enumerate(parameters):
+
+            if parameter is self._nuisance_parameter:
+
+                # get_model is linear in the effective area correction
+
+                model_without_correction = self._bin_model_columns(self._evaluate_model()[:, np.newaxis])[:, 0]
+
+                gradient[i] = np.dot(count_derivatives, model_without_correction)
+
+                if parameter.has_transformation():
+
+                    gradient[i] *= get_parameter_derivatives(lambda: parameter.value, [parameter])[0]
+
+            else:
+
+                model_parameters_idx.append(i)
+
+        if len(model_parameters_idx) > 0:
+
+            model_parameters = [parameters[i] for i in model_parameters_idx]
+
+            true_flux_derivatives = get_parameter_derivatives(self._evaluate_true_fluxes, model_parameters)
+
+            # Same as for the true fluxes themselves, bins where the model is not defined do not contribute
+
+            true_flux_derivatives[~np.isfinite(true_flux_derivatives)] = 0
+
+            model_derivatives = self._bin_model_columns(self._fold_true_fluxes(true_flux_derivatives))
+
+            gradient[model_parameters_idx] = np.dot(count_derivatives, model_derivatives) * \
+                                             self._nuisance_parameter.value
+
+        return gradient
+
+    @property
+    def has_batch_log_like(self):
+
+        return self._likelihood_evaluator.has_batch
+
+    def get_log_like_batch(self, parameters, values):
+        """
+        Computes the log-likelihood for many sets of values of the parameters at once. The model is evaluated for
+        each set, then all the models are folded (through the response, if any) and the likelihood is evaluated
+        with one operation. The parameters are left at the last set of values.
+
+        :param parameters: list of free parameters
+        :param values: 2d array with one set of values for the parameters per row
+        :return: array of log-likelihood values (one per row), or None if not available for the current noise models
+        """
+
+        if not self.has_batch_log_like:
+
+            return None
+
+        values = np.atleast_2d(values)
+
+        n_sets = values.shape[0]
+
+        true_fluxes = None
+        corrections = np.zeros(n_sets)
+        valid = np.ones(n_sets, dtype=bool)
+
+        for i, these_values in enumerate(values):
+
+            for parameter, value in zip(parameters, these_values):
+
+                parameter.value = value
+
+            try:
+
+                these_true_fluxes = self._evaluate_true_fluxes()
+
+            except ModelAssertionViolation:
+
+                # Outside of the allowed region of the parameter space
+
+                valid[i] = False
+
+                continue
+
+            if true_fluxes is None:
+
+                true_fluxes = np.zeros((these_true_fluxes.shape[0], n_sets))
+
+            true_fluxes[:, i] = these_true_fluxes
+            corrections[i] = self._nuisance_parameter.value
+
+        log_likes = np.zeros(n_sets) - np.inf
+
+        if true_fluxes is not None:
+
+            model_counts = self._bin_model_columns(self._fold_true_fluxes(true_fluxes[:, valid])) * corrections[valid]
+
+            log_likes[valid] = self._likelihood_evaluator.get_batch_values(model_counts)
+
+        return log_likes
+
     def set_model(self, likelihoodModel):
         """
         Set the model to be used in the joint minimization.
@@ -1434,6 +1649,7 @@ class SpectrumLike(PluginPrototype):
 
         differential_flux, integral = self._get_diff_flux_and_integral(self._like_model)
 
+        self._differential_flux = differential_flux
         self._integral_flux = integral
 
     def _evaluate_model(self):
@@ -1445,7 +1661,7 @@ class SpectrumLike(PluginPrototype):
         :return:
         """
 
-        return np.array([self._integral_flux(emin, emax) for emin, emax in self._observed_spectrum.bin_stack])
+        return self._integrate_over_bins(self._differential_flux)
 
     def get_model(self):
         """
@@ -1465,6 +1681,45 @@ class SpectrumLike(PluginPrototype):
 
         return self._nuisance_parameter.value * model
 
+    def _evaluate_true_fluxes(self):
+        """
+        Evaluates the model before folding, i.e., the quantity which _fold_true_fluxes transforms into the output of
+        _evaluate_model. With no dispersion this is the model integrated over the energy bins.
+
+        :return: array of true fluxes
+        """
+
+        return self._integrate_over_bins(self._differential_flux)
+
+    def _fold_true_fluxes(self, true_fluxes):
+        """
+        Folds the true fluxes into the counts space (this must be linear). With no dispersion there is nothing to do.
+        This can be overloaded to convolve the true fluxes with a response, for example
+
+        :param true_fluxes: array of true fluxes, or 2d array with one set of true fluxes (or derivatives) per column
+        :return: folded array
+        """
+
+        return true_fluxes
+
+    def _bin_model_columns(self, model_columns):
+        """
+        Applies the mask (or the rebinner) and the exposure to a 2d array containing one model (or one derivative of
+        the model) per column, as returned by _evaluate_model. This is what get_model does, besides the effective
+        area correction
+
+        :param model_columns: 2d array with one row per channel
+        :return: 2d array with one row per currently active channel
+        """
+
+        if self._rebinner is not None:
+
+            return self._rebinner.rebin_columns(model_columns * self._observed_spectrum.exposure)
+
+        else:
+
+            return model_columns[self._mask] * self._observed_spectrum.exposure
+
     def _evaluate_background_model(self):
         """
         Since there is no dispersion, we simply evaluate the model by integrating over the energy bins.
@@ -1474,8 +1729,7 @@ class SpectrumLike(PluginPrototype):
         :return:
         """
 
-        return np.array(
-            [self._background_integral_flux(emin, emax) for emin, emax in self._observed_spectrum.bin_stack])
+        return self._integrate_over_bins(self._background_differential_flux)
 
     def get_background_model(self):
         """
@@ -1551,6 +1805,47 @@ class SpectrumLike(PluginPrototype):
 
         return differential_flux, integral
 
+    @staticmethod
+    def _build_integration_grid(bin_stack):
+        """
+        Builds the energy grid needed to integrate a function over all the bins with Simpson's rule
+        in one single call. The grid contains the unique bin edges (adjacent bins share their edges,
+        so they are evaluated only once) followed by the bin mid points.
+
+        :param bin_stack: the (n_bins x 2) array of bin boundaries
+        :return: (energies, lower edge indices, upper edge indices, mid point indices, bin widths)
+        """
+
+        e1, e2 = np.asarray(bin_stack, float).T
+
+        edges, inverse = np.unique(np.concatenate((e1, e2)), return_inverse=True)
+
+        n_bins = e1.shape[0]
+
+        energies = np.concatenate((edges, (e1 + e2) / 2.0))
+
+        lo_idx = inverse[:n_bins]
+        hi_idx = inverse[n_bins:]
+        mid_idx = np.arange(n_bins) + edges.shape[0]
+
+        return energies, lo_idx, hi_idx, mid_idx, e2 - e1
+
+    def _integrate_over_bins(self, differential_flux):
+        """
+        Integrates the differential flux over all the bins of the observed spectrum using Simpson's rule
+        (as the integral function returned by _get_diff_flux_and_integral does), but evaluating the
+        function only once on the whole integration grid
+
+        :param differential_flux: a function of the energy (accepting arrays)
+        :return: array with the integral over each bin
+        """
+
+        energies, lo_idx, hi_idx, mid_idx, widths = self._integration_grid
+
+        fluxes = differential_flux(energies)
+
+        return widths / 6.0 * (fluxes[lo_idx] + 4 * fluxes[mid_idx] + fluxes[hi_idx])
+
     def use_effective_area_correction(self, min_value=0.8, max_value=1.2):
         """
         Activate the use of the effective area correction, which is a multiplicative factor in front of the model which
@@ -11,6 +11,9 @@ from threeML.data_list import DataList
 from threeML.plugin_prototype import PluginPrototype
 from threeML.utils.statistics.likelihood_functions import half_chi2
 from threeML.utils.statistics.likelihood_functions import poisson_log_likelihood_ideal_bkg
+from threeML.utils.statistics.likelihood_functions import half_chi2_derivative
+from threeML.utils.statistics.likelihood_functions import poisson_log_likelihood_derivative
+from threeML.utils.differentiation import get_parameter_derivatives
 from threeML.exceptions.custom_exceptions import custom_warnings
 __instrument_name = "n.a."
 
@@ -342,6 +345,37 @@ class XYLike(PluginPrototype):
 
             return np.sum(chi2_) * (-1)
 
+    @property
+    def has_log_like_gradient(self):
+
+        return True
+
+    def get_log_like_gradient(self, parameters):
+        """
+        Return the derivatives of the log-likelihood with respect to the provided parameters, using the chain rule.
+        The derivatives of the statistic with respect to the expectation are analytic, while the derivatives of the
+        expectation are computed numerically (astromodels does not provide analytic derivatives)
+
+        :param parameters: list of free parameters
+        :return: array of derivatives (one per parameter)
+        """
+
+        if len(parameters) == 0:
+
+            return np.zeros(0)
+
+        expectation = self._get_total_expectation()
+
+        if self._is_poisson:
+
+            expectation_derivatives = poisson_log_likelihood_derivative(self._y, expectation)
+
+        else:
+
+            expectation_derivatives = half_chi2_derivative(self._y, self._yerr, expectation) * (-1)
+
+        return np.dot(expectation_derivatives, get_parameter_derivatives(self._get_total_expectation, parameters))
+
     def get_simulated_dataset(self, new_name=None):
 
         assert self._has_errors, "You cannot simulate a dataset if the original dataset has no errors"
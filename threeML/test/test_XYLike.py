@@ -1,5 +1,6 @@
 from threeML import *
 from threeML.plugins.XYLike import XYLike
+from threeML.utils.differentiation import get_parameter_derivatives
 
 
 def get_signal():
@@ -99,6 +100,26 @@ def test_XYLike_poisson():
     assert np.allclose(res[0]['value'], [0.783748,40.344599 , 71.560055, 4.989727 , 0.330570 ], rtol=0.05)
 
 
+def test_XYLike_log_like_gradient():
+
+    for xy in [XYLike("test", x, np.array(gauss_signal), np.array(gauss_sigma)),
+               XYLike("test", x, np.array(poiss_sig), poisson_data=True)]:
+
+        fitfun = Line() + Gaussian()
+        fitfun.F_2 = 60.0
+        fitfun.mu_2 = 4.5
+
+        model = Model(PointSource('fake', 0.0, 0.0, fitfun))
+
+        xy.set_model(model)
+
+        parameters = model.free_parameters.values()
+
+        numerical_gradient = get_parameter_derivatives(xy.get_log_like, parameters)
+
+        assert np.allclose(xy.get_log_like_gradient(parameters), numerical_gradient, rtol=1e-3, atol=1e-3)
+
+
 def test_XYLike_assign_to_source():
 
     # Get fake data with Gaussian noise
@@ -7,6 +7,8 @@ from threeML.plugins.XYLike import XYLike
 from threeML import Model, DataList, JointLikelihood, PointSource
 from threeML import BayesianAnalysis, Uniform_prior, Log_uniform_prior
 from threeML.analysis_results import MLEResults, load_analysis_results, AnalysisResultsSet
+from threeML.io.results_store import AnalysisResultsStore
+from threeML.utils.fitted_objects.propagation import PropagatedFunction
 from astromodels import Line, Gaussian, Powerlaw
 
 
@@ -105,6 +107,87 @@ def test_analysis_set_input_output(xy_fitted_joint_likelihood):
         _results_are_same(res1, res2)
 
 
+def test_lazy_analysis_set_loading(xy_fitted_joint_likelihood):
+
+    jl, _, _ = xy_fitted_joint_likelihood  # type: JointLikelihood, None, None
+
+    jl.restore_best_fit()
+
+    ar = jl.results  # type: MLEResults
+
+    analysis_set = AnalysisResultsSet([ar] * 5)
+
+    analysis_set.set_x("testing", np.arange(5))
+
+    temp_file = "_lazy_analysis_set_test"
+
+    analysis_set.write_to(temp_file, overwrite=True)
+
+    analysis_set_reloaded = load_analysis_results(temp_file, lazy=True)
+
+    assert len(analysis_set_reloaded) == len(analysis_set)
+
+    # Nothing has been read yet
+
+    assert len(analysis_set_reloaded._results._loaded_results) == 0
+
+    # The summary does not need to read the results
+
+    summary = analysis_set_reloaded.get_summary_data_frame()
+
+    assert len(analysis_set_reloaded._results._loaded_results) == 0
+
+    expected_summary = analysis_set.get_summary_data_frame()
+
+    assert summary.shape == expected_summary.shape
+
+    assert np.allclose(summary['value'].values, expected_summary['value'].values)
+
+    assert np.allclose(summary['statistic'].values, expected_summary['statistic'].values)
+
+    # Only the results which are accessed are read, and they are kept in memory
+
+    res = analysis_set_reloaded[3]
+
+    _results_are_same(ar, res)
+
+    assert analysis_set_reloaded[-2] is res
+
+    assert list(analysis_set_reloaded._results._loaded_results.keys()) == [3]
+
+    # Only the most recently used are kept
+
+    analysis_set_reloaded._results._max_loaded_results = 2
+
+    for res1, res2 in zip(analysis_set, analysis_set_reloaded):
+
+        _results_are_same(res1, res2)
+
+    assert list(analysis_set_reloaded._results._loaded_results.keys()) == [3, 4]
+
+    assert len(analysis_set_reloaded[1:4]) == 3
+
+    os.remove(temp_file)
+
+    # Compressed files cannot be read lazily, only eagerly
+
+    temp_file = "_lazy_analysis_set_test.fits.gz"
+
+    analysis_set.write_to(temp_file, overwrite=True)
+
+    with pytest.raises(ValueError):
+
+        load_analysis_results(temp_file, lazy=True)
+
+    analysis_set_reloaded = load_analysis_results(temp_file)
+
+    for res1, res2 in zip(analysis_set, analysis_set_reloaded):
+
+        _results_are_same(res1, res2)
+
+    os.remove(temp_file)
+
+
 def test_error_propagation(xy_fitted_joint_likelihood):
 
     jl, _, _ = xy_fitted_joint_likelihood  # type: JointLikelihood, None, None
@@ -168,6 +251,212 @@ def test_error_propagation(xy_fitted_joint_likelihood):
     assert abs(hi_b - 140) < 20
 
 
+def test_batched_error_propagation(xy_fitted_joint_likelihood):
+
+    jl, _, _ = xy_fitted_joint_likelihood  # type: JointLikelihood, None, None
+
+    jl.restore_best_fit()
+
+    ar = jl.results  # type: MLEResults
+
+    a = ar.get_variates("fake.spectrum.main.composite.a_1")
+    b = ar.get_variates("fake.spectrum.main.composite.b_1")
+
+    def numpy_function(x, a, b):
+
+        return a * x + b
+
+    def scalar_function(x, a, b):
+
+        # This cannot be evaluated on arrays
+
+        return float(a) * float(x) + float(b)
+
+    xs = np.linspace(0, 10, 20)
+
+    expected = np.asarray(a)[:, np.newaxis] * xs + np.asarray(b)[:, np.newaxis]
+
+    for function in [numpy_function, scalar_function]:
+
+        pp = ar.propagate(function, a=a, b=b)
+
+        # the whole grid at once
+
+        samples = pp.evaluate(xs)
+
+        assert samples.shape == (len(a), len(xs))
+
+        assert np.allclose(samples, expected)
+
+        # one point at a time
+
+        assert np.allclose(pp(xs[3]), expected[:, 3])
+
+    # with a small memory bound the samples are processed in chunks
+
+    pp = PropagatedFunction(numpy_function, max_elements_per_call=len(xs) * 7, a=a, b=b)
+
+    assert np.allclose(pp.evaluate(xs), expected)
+
+
+def test_mle_samples_generation():
+
+    spectrum = Powerlaw()
+    source = PointSource("tst", ra=100, dec=20, spectral_shape=spectrum)
+    model = Model(source)
+
+    spectrum.index = -2.3
+    spectrum.index.bounds = (-2.4, 10)
+    spectrum.K.fix = True
+
+    cov_matrix = np.array([[0.01]])
+
+    np.random.seed(0)
+
+    # The samples are generated only when they are needed
+
+    ar = MLEResults(model, cov_matrix, {}, n_samples=10000, lazy_samples=True)
+
+    assert ar._samples_transposed_cache is None
+
+    samples = ar.samples[0]
+
+    assert ar._samples_transposed_cache is not None
+
+    # The samples outside of the boundaries are rejected
+
+    assert np.all(samples >= -2.4)
+
+    assert 0.8 * 10000 < samples.shape[0] < 0.9 * 10000
+
+    assert np.isclose(np.min(samples), -2.4, atol=0.01)
+
+    # Correlated parameters
+
+    spectrum.index.bounds = (-10, 10)
+    spectrum.K.fix = False
+    spectrum.K.bounds = (None, None)
+
+    values = np.array([spectrum.K._get_internal_value(), spectrum.index.value])
+
+    cov_matrix = np.array([[0.01, 0.006], [0.006, 0.04]])
+
+    ar = MLEResults(model, cov_matrix, {}, n_samples=100000)
+
+    ar_lazy = MLEResults(model, cov_matrix, {}, n_samples=100000, lazy_samples=True)
+
+    for results in [ar, ar_lazy]:
+
+        samples = results.samples
+
+        assert samples.shape == (2, 100000)
+
+        internal_samples = np.array([spectrum.K.transformation.forward(samples[0]), samples[1]]) \
+            if spectrum.K.has_transformation() else samples
+
+        assert np.allclose(np.mean(internal_samples, axis=1), values, atol=0.01)
+
+        assert np.allclose(np.cov(internal_samples), cov_matrix, rtol=0.05, atol=1e-4)
+
+    # A singular covariance matrix can be used as well
+
+    cov_matrix = np.array([[0.01, 0.0], [0.0, 0.0]])
+
+    ar = MLEResults(model, cov_matrix, {}, n_samples=1000)
+
+    assert np.allclose(ar.samples[1], spectrum.index.value)
+
+
+def test_results_store(xy_fitted_joint_likelihood, xy_completed_bayesian_analysis):
+
+    jl, _, _ = xy_fitted_joint_likelihood  # type: JointLikelihood, None, None
+
+    jl.restore_best_fit()
+
+    ar = jl.results  # type: MLEResults
+
+    bs, _ = xy_completed_bayesian_analysis
+
+    rb = bs.results
+
+    analysis_set = AnalysisResultsSet([ar, rb, ar])
+
+    analysis_set.set_bins("testing", [-1, 1, 3], [1, 3, 5], unit='s')
+
+    temp_file = "_analysis_set_test.h5"
+
+    analysis_set.write_to(temp_file, overwrite=True)
+
+    with pytest.raises(IOError):
+
+        analysis_set.write_to(temp_file)
+
+    for lazy in [True, False]:
+
+        analysis_set_reloaded = load_analysis_results(temp_file, lazy=lazy)
+
+        assert len(analysis_set_reloaded) == len(analysis_set)
+
+        for res1, res2 in zip(analysis_set, analysis_set_reloaded):
+
+            _results_are_same(res1, res2, bayes=res1.analysis_type == "Bayesian")
+
+        assert analysis_set_reloaded._sequence_name == "testing"
+
+    # The same model is stored only once for the MLE results
+
+    store = AnalysisResultsStore(temp_file)
+
+    assert len(store) == 3
+
+    assert np.allclose(store.read(2)[2], ar.covariance_matrix)
+
+    # Each read returns its own model
+
+    assert store.read(0)[1] is not store.read(2)[1]
+
+    # Partial reads
+
+    path = "fake.spectrum.main.composite.a_1"
+
+    values = store.get_values([path])
+
+    assert list(values.columns) == [path]
+
+    assert np.allclose(values[path].values, [ar.get_variates(path).value, rb.get_variates(path).value,
+                                             ar.get_variates(path).value])
+
+    samples = store.get_samples([path])
+
+    assert np.all(samples['result'] == 1)
+
+    assert np.allclose(samples[path].values, rb.samples[list(rb.optimized_model.free_parameters.keys()).index(path)])
+
+    summary = analysis_set.get_summary_data_frame()
+
+    assert np.allclose(store.get_summary_data_frame()['value'].values, summary['value'].values)
+
+    # Append while running
+
+    store.append(ar)
+
+    assert len(store) == 4
+
+    assert len(load_analysis_results(temp_file)) == 4
+
+    # A result with a different prior does not share the model of the others
+
+    model = ar.optimized_model
+
+    model.parameters[path].prior = Uniform_prior(lower_bound=-123., upper_bound=456.)
+
+    store.append(MLEResults(model, ar.covariance_matrix, dict(ar.optimal_statistic_values)))
+
+    assert store._get_index()[4][0] != store._get_index()[0][0]
+
+    os.remove(temp_file)
+
+
 def test_bayesian_input_output(xy_completed_bayesian_analysis):
 
     bs, _ = xy_completed_bayesian_analysis
@@ -68,6 +68,37 @@ def test_basic_analysis_contour_2d(fitted_joint_likelihood_bn090217206_nai):
     assert np.allclose(res[1], exp_p2, rtol=0.1)
 
 
+def test_basic_analysis_contour_local_pool(fitted_joint_likelihood_bn090217206_nai):
+
+    jl, fit_results, like_frame = fitted_joint_likelihood_bn090217206_nai
+
+    jl.restore_best_fit()
+
+    powerlaw = jl.likelihood_model.bn090217206.spectrum.main.Powerlaw
+
+    serial = jl.get_contours(powerlaw.index, -1.3, -1.1, 15)
+
+    jl.restore_best_fit()
+
+    pooled = jl.get_contours(powerlaw.index, -1.3, -1.1, 15, n_processes=2)
+
+    assert np.allclose(serial[0], pooled[0])
+
+    # The grid is explored in the same way, so the results must be identical
+
+    assert np.array_equal(serial[2], pooled[2])
+
+    jl.restore_best_fit()
+
+    serial = jl.get_contours(powerlaw.index, -1.25, -1.1, 4, powerlaw.K, 1.8, 3.4, 4)
+
+    jl.restore_best_fit()
+
+    pooled = jl.get_contours(powerlaw.index, -1.25, -1.1, 4, powerlaw.K, 1.8, 3.4, 4, n_processes=2)
+
+    assert np.array_equal(serial[2], pooled[2])
+
+
 def test_basic_bayesian_analysis_results(completed_bn090217206_bayesian_analysis):
 
     bayes, samples = completed_bn090217206_bayesian_analysis
@@ -57,6 +57,33 @@ def test_emcee():
     pass
 
 
+def test_posterior_batch(completed_bn090217206_bayesian_analysis):
+
+    bayes, _ = completed_bn090217206_bayesian_analysis
+
+    trial_values = bayes.raw_samples[:20]
+
+    # Add a point outside of the prior
+    trial_values = np.vstack([trial_values, [100.0, -1.0]])
+
+    expected = np.array([bayes.get_posterior(x) for x in trial_values])
+
+    batch = bayes.get_posterior_batch(trial_values)
+
+    assert np.allclose(batch[:-1], expected[:-1], rtol=1e-8)
+
+    assert batch[-1] == -np.inf and expected[-1] == -np.inf
+
+
+def test_emcee_vectorized(completed_bn090217206_bayesian_analysis):
+
+    bayes, _ = completed_bn090217206_bayesian_analysis
+
+    bayes.sample(n_walkers=20, burn_in=50, n_samples=500, quiet=True, seed=1234, vectorize=True)
+
+    check_results(bayes.results.get_data_frame())
+
+
 def test_multinest(completed_bn090217206_bayesian_analysis):
 
     bayes, _ = completed_bn090217206_bayesian_analysis
@@ -1,11 +1,16 @@
 import os
+import pickle
 
 import numpy as np
 import pytest
 from conftest import get_test_datasets_directory
+from threeML.config.config import threeML_config
 from threeML.io.file_utils import within_directory
 from threeML.utils.time_interval import TimeIntervalSet
-from threeML.utils.time_series.event_list import EventListWithDeadTime, EventList
+from threeML.utils.time_series.event_list import EventListWithDeadTime, EventList, EventListWithLiveTime
+from threeML.utils.time_series.polynomial import batch_polyfit, polyfit, unbinned_polyfit
+from threeML.utils.time_series.time_series import _FitWorker
+from threeML.utils.spectrum.binned_spectrum import BinnedSpectrum
 
 __this_dir__ = os.path.join(os.path.abspath(os.path.dirname(__file__)))
 datasets_dir = get_test_datasets_directory()
@@ -120,3 +125,329 @@ def test_binned_fit():
         evt_list.__repr__()
 
 
+
+
+def test_event_selection():
+
+    np.random.seed(1234)
+
+    # unsorted events, to check that the event list orders them consistently with the dead time
+    # (with one event exactly on the boundary used below)
+
+    arrival_times = np.append(np.random.uniform(0, 100, 2000), 40.0)
+    channels = np.random.randint(0, 4, 2001)
+    dead_time = np.random.uniform(0, 1e-4, 2001)
+
+    evt_list = EventListWithDeadTime(arrival_times=arrival_times,
+                                     measurement=channels,
+                                     n_channels=4,
+                                     start_time=0,
+                                     stop_time=100,
+                                     dead_time=dead_time)
+
+    for start, stop in [(0, 100), (10.5, 20.3), (50., 50.), (30., 20.)]:
+
+        mask = np.logical_and(start <= arrival_times, arrival_times <= stop)
+
+        assert evt_list.counts_over_interval(start, stop) == mask.sum()
+
+        assert np.all(evt_list.count_per_channel_over_interval(start, stop) ==
+                      [np.sum(channels[mask] == channel) for channel in range(4)])
+
+        assert np.isclose(evt_list.exposure_over_interval(start, stop), (stop - start) - dead_time[mask].sum())
+
+    # Touching intervals should not count twice the events on the boundary
+
+    evt_list.set_active_time_intervals("10-40", "40-60")
+
+    mask = np.logical_and(10 <= arrival_times, arrival_times <= 60)
+
+    assert evt_list._counts.sum() == mask.sum()
+
+    assert np.isclose(evt_list._active_dead_time, dead_time[mask].sum())
+
+
+def test_count_cube():
+
+    np.random.seed(1234)
+
+    arrival_times = np.sort(np.random.uniform(0, 100, 2000))
+    channels = np.random.randint(0, 4, 2000)
+
+    evt_list = EventList(arrival_times=arrival_times,
+                         measurement=channels,
+                         n_channels=4,
+                         start_time=0,
+                         stop_time=100)
+
+    selections = evt_list._select_events_in_intervals([5., 40.], [30., 70.5])
+
+    edges = np.arange(0, 100, 1.)
+
+    total_counts, counts = evt_list._get_count_cube(selections, edges)
+
+    mask = np.logical_or(np.logical_and(5 <= arrival_times, arrival_times <= 30),
+                         np.logical_and(40 <= arrival_times, arrival_times <= 70.5))
+
+    assert np.all(total_counts == np.histogram(arrival_times[mask], edges)[0])
+
+    for channel in range(4):
+
+        assert np.all(counts[:, channel] == np.histogram(arrival_times[mask & (channels == channel)], edges)[0])
+
+    # The same request is served from the cache, also after using a different binning
+
+    other_counts = evt_list._get_count_cube(selections, np.arange(0, 100, 2.))[1]
+
+    assert evt_list._get_count_cube(selections, edges)[1] is counts
+    assert evt_list._get_count_cube(selections, np.arange(0, 100, 2.))[1] is other_counts
+
+    # The counts in a single interval come from a cube with one time bin
+
+    interval_counts = evt_list.count_per_channel_over_interval(5., 30.)
+
+    for channel in range(4):
+
+        assert interval_counts[channel] == np.sum((5 <= arrival_times) & (arrival_times <= 30) & (channels == channel))
+
+
+def test_exposure_over_intervals():
+
+    np.random.seed(1234)
+
+    arrival_times = np.sort(np.random.uniform(0, 100, 2000))
+    channels = np.random.randint(0, 4, 2000)
+
+    starts = np.random.uniform(0, 50, 20)
+    stops = starts + np.random.uniform(0, 40, 20)
+
+    evt_list = EventListWithDeadTime(arrival_times=arrival_times,
+                                     measurement=channels,
+                                     n_channels=4,
+                                     start_time=0,
+                                     stop_time=100,
+                                     dead_time=np.random.uniform(0, 1e-4, 2000))
+
+    exposures = evt_list.exposure_over_intervals(starts, stops)
+
+    assert np.allclose(exposures, [evt_list.exposure_over_interval(start, stop) for start, stop in zip(starts, stops)])
+
+    # Live time in 2 s bins, with a live time fraction of 0.9
+
+    edges = np.arange(0, 101, 2.)
+
+    evt_list = EventListWithLiveTime(arrival_times=arrival_times,
+                                     measurement=channels,
+                                     n_channels=4,
+                                     live_time=np.diff(edges) * 0.9,
+                                     live_time_starts=edges[:-1],
+                                     live_time_stops=edges[1:],
+                                     start_time=0,
+                                     stop_time=100)
+
+    assert np.allclose(evt_list.exposure_over_intervals(starts, stops), 0.9 * (stops - starts))
+
+    # inside a single bin
+
+    assert np.isclose(evt_list.exposure_over_interval(10.5, 11.), 0.9 * 0.5)
+
+    # intervals extending outside of the live time bins
+
+    assert np.isclose(evt_list.exposure_over_interval(-10, 110), 90.)
+
+
+def test_parallel_background_fits():
+
+    with within_directory(datasets_dir):
+
+        arrival_times = np.loadtxt('test_event_data.txt')
+
+        np.random.seed(1234)
+
+        evt_list = EventListWithDeadTime(arrival_times=arrival_times,
+                                         measurement=np.random.randint(0, 4, arrival_times.shape[0]),
+                                         n_channels=4,
+                                         start_time=arrival_times[0],
+                                         stop_time=arrival_times[-1],
+                                         dead_time=np.zeros_like(arrival_times))
+
+        results = {}
+
+        old_executor = threeML_config['event list']['fit executor']
+
+        try:
+
+            for executor in ['serial', 'threads', 'processes']:
+
+                threeML_config['event list']['fit executor'] = executor
+
+                for unbinned in [False, True]:
+
+                    evt_list.set_polynomial_fit_interval("1-49", unbinned=unbinned)
+
+                    results[(executor, unbinned)] = [polynomial.coefficients for polynomial in evt_list.polynomials]
+
+        finally:
+
+            threeML_config['event list']['fit executor'] = old_executor
+
+        # The results must not depend on the execution mode
+
+        for executor in ['threads', 'processes']:
+
+            for unbinned in [False, True]:
+
+                assert np.all(np.array(results[(executor, unbinned)]) == np.array(results[('serial', unbinned)]))
+
+    # The worker can be sent to processes that do not inherit anything from the parent (the "spawn" start method)
+
+    x = np.arange(0, 50, 1.)
+    exposure = np.ones_like(x)
+
+    worker = _FitWorker(polyfit, [(x, np.random.poisson(10., x.shape[0]).astype(float), grade, exposure)
+                                  for grade in range(2)])
+
+    copied_worker = pickle.loads(pickle.dumps(worker))
+
+    for i in range(2):
+
+        assert np.all(copied_worker(i)[0].coefficients == worker(i)[0].coefficients)
+
+
+def test_newton_polynomial_fits():
+
+    np.random.seed(1234)
+
+    x = np.arange(-50.5, 200, 1.)
+    exposure = np.ones_like(x) * 0.95
+
+    counts = np.random.poisson((20 + 0.05 * x + 1e-4 * x ** 2)[:, np.newaxis] * exposure[:, np.newaxis] *
+                               np.ones((1, 4))).astype(float)
+
+    # For a constant, the maximum likelihood estimate is the total counts over the total exposure
+
+    results = batch_polyfit(x, counts, 0, exposure)
+
+    for i, (polynomial, log_like) in enumerate(results):
+
+        assert np.isclose(polynomial.coefficients[0], counts[:, i].sum() / exposure.sum())
+
+        assert np.isclose(polynomial.error[0], np.sqrt(counts[:, i].sum()) / exposure.sum())
+
+    # The Newton solver must find a likelihood at least as good as the generic optimizer
+
+    old_solver = threeML_config['event list']['newton solver']
+
+    try:
+
+        for grade in [1, 2]:
+
+            threeML_config['event list']['newton solver'] = True
+
+            polynomial, log_like = polyfit(x, counts[:, 0], grade, exposure)
+
+            threeML_config['event list']['newton solver'] = False
+
+            polynomial_ref, log_like_ref = polyfit(x, counts[:, 0], grade, exposure)
+
+            assert log_like <= log_like_ref + 1e-3
+
+        events = np.sort(np.random.uniform(0, 100, 2000))
+
+        for grade in [0, 1]:
+
+            threeML_config['event list']['newton solver'] = True
+
+            polynomial, log_like = unbinned_polyfit(events, grade, [0.], [100.], 1.0)
+
+            threeML_config['event list']['newton solver'] = False
+
+            polynomial_ref, log_like_ref = unbinned_polyfit(events, grade, [0.], [100.], 1.0)
+
+            assert log_like <= log_like_ref + 1e-3
+
+            assert np.allclose(polynomial.coefficients, polynomial_ref.coefficients, rtol=1e-3, atol=1e-5)
+
+    finally:
+
+        threeML_config['event list']['newton solver'] = old_solver
+
+
+def test_information_dicts_over_intervals():
+
+    np.random.seed(1234)
+
+    arrival_times = np.sort(np.random.uniform(-20, 100, 20000))
+    channels = np.random.randint(0, 4, 20000)
+
+    evt_list = EventListWithDeadTime(arrival_times=arrival_times,
+                                     measurement=channels,
+                                     n_channels=4,
+                                     start_time=-20,
+                                     stop_time=100,
+                                     dead_time=np.random.uniform(0, 1e-4, 20000))
+
+    evt_list.poly_order = 1
+
+    evt_list.set_polynomial_fit_interval('-20--5', '50-100', unbinned=False)
+
+    # overlapping intervals are fine too
+
+    starts = np.array([0., 1.5, 3., 2.])
+    stops = np.array([1.5, 3., 7.25, 5.])
+
+    counts = evt_list.count_per_channel_over_intervals(starts, stops)
+
+    assert np.all(counts == [evt_list.count_per_channel_over_interval(start, stop)
+                             for start, stop in zip(starts, stops)])
+
+    for options in [{}, {'use_poly': True}, {'extract': True}]:
+
+        information_dicts = evt_list.get_information_dicts(starts, stops, **options)
+
+        for information_dict, start, stop in zip(information_dicts, starts, stops):
+
+            evt_list.set_active_time_intervals('%f-%f' % (start, stop))
+
+            expected = evt_list.get_information_dict(**options)
+
+            for key in ['counts', 'counts error', 'exposure', 'tstart', 'telapse']:
+
+                if expected[key] is None:
+
+                    assert information_dict[key] is None
+
+                else:
+
+                    assert np.allclose(information_dict[key], expected[key])
+
+
+def test_binned_spectrum_from_information_dict():
+
+    np.random.seed(1234)
+
+    arrival_times = np.sort(np.random.uniform(0, 100, 2000))
+    channels = np.random.randint(0, 4, 2000)
+
+    evt_list = EventList(arrival_times=arrival_times,
+                         measurement=channels,
+                         n_channels=4,
+                         start_time=0,
+                         stop_time=100,
+                         edges=np.array([10., 20., 50., 100., 300.]))
+
+    evt_list.set_active_time_intervals('10-30')
+
+    spectrum = BinnedSpectrum.from_time_series(evt_list)
+
+    information_dict, = evt_list.get_information_dicts([10.], [30.])
+
+    other_spectrum = BinnedSpectrum.from_information_dict(information_dict, response=None)
+
+    for this_spectrum in [spectrum, other_spectrum]:
+
+        assert np.allclose(this_spectrum.counts, evt_list.count_per_channel_over_interval(10., 30.))
+
+        assert this_spectrum.n_channels == 4
+
+        assert this_spectrum.tstart == 10. and this_spectrum.tstop == 30.
@@ -1,7 +1,7 @@
 import pytest
 from threeML import *
 from threeML.plugins.OGIPLike import OGIPLike
-from threeML.utils.fitted_objects.fitted_point_sources import InvalidUnitError
+from threeML.utils.fitted_objects.fitted_point_sources import InvalidUnitError, IntegralOfFunction
 from threeML.io.calculate_flux import _calculate_point_source_flux
 import astropy.units as u
 import matplotlib.pyplot as plt
@@ -177,6 +177,44 @@ def test_fitted_point_source_flux_calculations(analysis_to_test):
     _calculate_point_source_flux(1, 10, analysis_to_test[-2], **flux_keywords)
 
 
+def test_fixed_grid_flux_integration(analysis_to_test):
+
+    flux_config = threeML_config['point source flux']
+
+    old_method = flux_config['integration method']
+
+    try:
+
+        fluxes = {}
+
+        for method in ['quad', 'gauss-legendre']:
+
+            flux_config['integration method'] = method
+
+            # the same samples must be used for both methods
+
+            np.random.seed(1234)
+
+            fluxes[method] = _calculate_point_source_flux(10, 1000, analysis_to_test[1], use_components=True,
+                                                          components_to_use=['total', 'Powerlaw', 'Blackbody'])[0]
+
+        assert np.allclose(fluxes['gauss-legendre'].values, fluxes['quad'].values, rtol=1e-3)
+
+    finally:
+
+        flux_config['integration method'] = old_method
+
+    # a function which needs more points than the default is integrated correctly anyway
+
+    def narrow_line(x, center):
+
+        return np.exp(-0.5 * ((x - center) / 0.25) ** 2)
+
+    integral = IntegralOfFunction(narrow_line)
+
+    assert np.allclose(integral(1., 100., center=np.array([10., 20.])), 0.25 * np.sqrt(2 * np.pi), rtol=1e-4)
+
+
 def test_units_on_energy_range(analysis_to_test):
 
 
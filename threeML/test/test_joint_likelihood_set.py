@@ -1,5 +1,12 @@
+import os
+import time
+import pytest
+import numpy as np
+import pandas as pd
+
 from threeML import *
 from conftest import data_list_bn090217206_nai6, get_grb_model
+from threeML.parallel.executors import ProcessPoolExecutor
 
 
 # Define two dummy functions to return always the same model and the same
@@ -32,3 +39,86 @@ def test_joint_likelihood_set_parallel():
     print(res)
 
 
+
+
+def test_joint_likelihood_set_store():
+
+    store_file = "__jlset_store.h5"
+
+    if os.path.exists(store_file):
+
+        os.remove(store_file)
+
+    jlset = JointLikelihoodSet(data_getter=get_data, model_getter=get_model, n_iterations=6)
+
+    jlset.go(compute_covariance=False, executor='processes', n_workers=2, store=store_file, store_id='bn090217206')
+
+    # Simulate an interrupted run by forgetting the last iterations, then resume it
+
+    with pd.HDFStore(store_file, mode='a') as store:
+
+        store.remove('completed', start=4)
+
+    jlset = JointLikelihoodSet(data_getter=get_data, model_getter=get_model, n_iterations=6)
+
+    parameter_frames, like_frames = jlset.go(compute_covariance=False, store=store_file, store_id='bn090217206')
+
+    # Compare with the results kept in memory
+
+    jlset = JointLikelihoodSet(data_getter=get_data, model_getter=get_model, n_iterations=6)
+
+    expected_parameter_frames, expected_like_frames = jlset.go(compute_covariance=False)
+
+    assert parameter_frames.index.equals(expected_parameter_frames.index)
+    assert like_frames.index.equals(expected_like_frames.index)
+
+    assert np.allclose(parameter_frames['value'].values, expected_parameter_frames['value'].values)
+    assert np.allclose(like_frames['-log(likelihood)'].values, expected_like_frames['-log(likelihood)'].values)
+
+    # A store written by a different set of fits cannot be used
+
+    jlset = JointLikelihoodSet(data_getter=get_data, model_getter=get_model, n_iterations=4)
+
+    with pytest.raises(RuntimeError):
+
+        jlset.go(compute_covariance=False, store=store_file, store_id='bn090217206')
+
+    jlset = JointLikelihoodSet(data_getter=get_data, model_getter=get_model, n_iterations=6)
+
+    with pytest.raises(RuntimeError):
+
+        jlset.go(compute_covariance=False, store=store_file, store_id='another dataset')
+
+    os.remove(store_file)
+
+
+def test_joint_likelihood_set_rejects_threads():
+
+    jlset = JointLikelihoodSet(data_getter=get_data, model_getter=get_model, n_iterations=2)
+
+    with pytest.raises(ValueError):
+
+        jlset.go(executor='threads')
+
+
+def _draw_random_number(item):
+
+    # Give the other process the time to take some of the items
+
+    time.sleep(0.2)
+
+    return np.random.uniform()
+
+
+def test_process_pool_random_state():
+
+    # The processes must not inherit the same random state (otherwise, for example, they would simulate the same
+    # datasets)
+
+    np.random.seed(1234)
+
+    with ProcessPoolExecutor(n_workers=2) as executor:
+
+        draws = [draw for _, draw in executor.imap_unordered(_draw_random_number, range(4))]
+
+    assert len(set(draws)) == len(draws)
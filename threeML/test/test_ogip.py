@@ -373,6 +373,40 @@ def test_simulating_data_sets():
             assert ds._rebinner is None
 
 
+def test_in_place_simulation():
+    with within_directory(__example_dir):
+
+        ogip = OGIPLike('test_ogip', observation='test.pha{1}')
+
+        ogip.set_active_measurements("10-30", "40-80")
+
+        ab = AnalysisBuilder(ogip)
+        _ = ab.get_jl('normal')
+
+        assert ogip.has_in_place_simulation
+
+        np.random.seed(1234)
+
+        _ = ogip.get_simulated_dataset('sim')
+        expected = ogip.get_simulated_dataset('sim')
+
+        # Generate the same datasets, but the second time updating the first simulated dataset in place
+
+        np.random.seed(1234)
+
+        sim = ogip.get_simulated_dataset('sim')
+        ogip.update_simulated_dataset(sim)
+
+        assert np.all(sim.observed_counts == expected.observed_counts)
+        assert np.all(sim.background_counts == expected.background_counts)
+        assert np.all(sim._mask == ogip._mask)
+
+        sim.set_model(ogip._like_model)
+        expected.set_model(ogip._like_model)
+
+        assert sim.get_log_like() == expected.get_log_like()
+
+
 def test_likelihood_ratio_test():
     with within_directory(__example_dir):
         ogip = OGIPLike('test_ogip', observation='test.pha{1}')
@@ -553,3 +587,47 @@ def test_likelihood_functions():
                                                 expected_model_counts=exp_cnts)
 
     assert test == (-2, 5.0)
+
+
+def test_likelihood_kernels():
+
+    np.random.seed(1234)
+
+    exp_cnts = np.random.uniform(0.5, 20, 100)
+    obs_cnts = np.random.poisson(exp_cnts + 5).astype(float)
+    obs_bkg = np.random.poisson(5, 100).astype(float)
+
+    # some empty bins
+    obs_cnts[:5] = 0
+    obs_bkg[3:8] = 0
+
+    bkg_err = np.sqrt(obs_bkg)
+    ratio = 0.7
+
+    kernel = PoissonIdealBackgroundKernel(obs_cnts, obs_bkg)
+
+    log_like, _ = poisson_log_likelihood_ideal_bkg(obs_cnts, obs_bkg, exp_cnts)
+
+    assert np.isclose(kernel(exp_cnts)[0], np.sum(log_like), rtol=1e-10)
+
+    kernel = PoissonObservedPoissonBackgroundKernel(obs_cnts, obs_bkg, ratio)
+
+    log_like, bkg_model = poisson_observed_poisson_background(obs_cnts, obs_bkg, ratio, exp_cnts)
+
+    kernel_log_like, kernel_bkg_model = kernel(exp_cnts)
+
+    assert np.isclose(kernel_log_like, np.sum(log_like), rtol=1e-10)
+    assert np.allclose(kernel_bkg_model, bkg_model, rtol=1e-10)
+
+    kernel = PoissonObservedGaussianBackgroundKernel(obs_cnts, obs_bkg, bkg_err)
+
+    log_like, bkg_model = poisson_observed_gaussian_background(obs_cnts, obs_bkg, bkg_err, exp_cnts)
+
+    kernel_log_like, kernel_bkg_model = kernel(exp_cnts)
+
+    assert np.isclose(kernel_log_like, np.sum(log_like), rtol=1e-10)
+    assert np.allclose(kernel_bkg_model, bkg_model, rtol=1e-10)
+
+    kernel = HalfChi2Kernel(obs_cnts, bkg_err + 1)
+
+    assert np.isclose(kernel(exp_cnts), np.sum(half_chi2(obs_cnts, bkg_err + 1, exp_cnts)), rtol=1e-10)
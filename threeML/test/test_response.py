@@ -1,8 +1,11 @@
+import astropy.io.fits as pyfits
 import numpy as np
 import os
 import pytest
+import scipy.sparse
 import warnings
 
+from threeML.config.config import threeML_config
 from threeML.io.package_data import get_path_of_data_file
 from threeML.utils.OGIP.response import InstrumentResponseSet, InstrumentResponse, OGIPResponse
 from threeML.utils.time_interval import TimeInterval
@@ -132,6 +135,41 @@ def test_instrument_response_set_function_and_convolve():
     assert np.all(folded_counts == [1.0, 2.0, 3.0])
 
 
+def test_instrument_response_sparse_and_dense_storage():
+
+    matrix, mc_energies, ebounds = get_matrix_elements()
+
+    rsp_sparse = InstrumentResponse(scipy.sparse.csr_matrix(matrix), ebounds, mc_energies)
+
+    assert rsp_sparse.is_sparse
+
+    # Force the dense fallback
+
+    old_density = threeML_config['ogip']['sparse response max density']
+
+    threeML_config['ogip']['sparse response max density'] = 0
+
+    try:
+
+        rsp_dense = InstrumentResponse(matrix, ebounds, mc_energies)
+
+    finally:
+
+        threeML_config['ogip']['sparse response max density'] = old_density
+
+    assert not rsp_dense.is_sparse
+
+    assert np.all(rsp_sparse.matrix == rsp_dense.matrix)
+    assert np.all(rsp_sparse.sparse_matrix.toarray() == rsp_dense.sparse_matrix.toarray())
+
+    integral_function = lambda e1, e2: e2 - e1
+
+    rsp_sparse.set_function(integral_function)
+    rsp_dense.set_function(integral_function)
+
+    assert np.allclose(rsp_sparse.convolve(), rsp_dense.convolve())
+
+
 def test__instrument_response_energy_to_channel():
 
     matrix, mc_energies, ebounds = get_matrix_elements()
@@ -177,6 +215,61 @@ def test_OGIP_response_arf_rsp_accessors():
     assert rsp.rsp_filename == rsp_file
 
 
+def _decompress_matrix_with_loop(data, n_channels, first_channel):
+
+    # Straightforward decompression, row by row and group by group
+
+    rsp = np.zeros((data.shape[0], n_channels))
+
+    for i in range(data.shape[0]):
+
+        f_chan = np.atleast_1d(np.squeeze(data.field("F_CHAN")[i])) - first_channel
+        n_chan = np.atleast_1d(np.squeeze(data.field("N_CHAN")[i]))
+        values = np.ravel(data.field("MATRIX")[i])
+
+        m_start = 0
+
+        for j in range(int(np.squeeze(data.field("N_GRP")[i]))):
+
+            rsp[i, f_chan[j]: f_chan[j] + n_chan[j]] = values[m_start: m_start + n_chan[j]]
+
+            m_start += n_chan[j]
+
+    return rsp.T
+
+
+def test_OGIP_response_matrix_decompression():
+
+    # Fixed-width (rsp), variable-length (rsp2) and large (rmf) matrices
+
+    for file_name in ["ogip_test_gbm_n6.rsp", "ogip_test_gbm_b0.rsp2", "ogip_test_xmm_pn.rmf"]:
+
+        rsp_file = get_path_of_data_file(file_name)
+
+        with warnings.catch_warnings():
+
+            warnings.simplefilter("ignore")
+
+            rsp = OGIPResponse("%s{1}" % rsp_file)
+
+        with pyfits.open(rsp_file) as f:
+
+            try:
+
+                extension = f["MATRIX", 1]
+
+            except KeyError:
+
+                extension = f["SPECRESP MATRIX", 1]
+
+            data = extension.data
+            n_channels = extension.header["DETCHANS"]
+
+            expected = _decompress_matrix_with_loop(data, n_channels, rsp.first_channel)
+
+        assert np.all(rsp.matrix == expected)
+
+
 def test_response_write_to_fits1():
 
     matrix, mc_energies, ebounds = get_matrix_elements()
@@ -400,4 +493,35 @@ def test_response_set_weighting_with_disjoint_intervals():
 
     factor = 1.0 / (w1 + w2 + w3) * (w1 + w2 / 2.0 + w3 / 2.0)
 
-    assert np.allclose(weighted_matrix.matrix, factor * rsp_a.matrix)
\ No newline at end of file
+    assert np.allclose(weighted_matrix.matrix, factor * rsp_a.matrix)
+
+def test_response_set_weighting_cache():
+
+    [rsp_a, rsp_b], exposure_getter, counts_getter = get_matrix_set_elements_with_coverage()
+
+    rsp_set = InstrumentResponseSet([rsp_a, rsp_b], exposure_getter, counts_getter)
+
+    weighted_matrix_1 = rsp_set.weight_by_exposure("5.0 - 25.0")
+    weighted_matrix_2 = rsp_set.weight_by_exposure("5.0 - 25.0")
+
+    # The second call comes from the cache, but it must be an independent instance
+
+    assert weighted_matrix_1 is not weighted_matrix_2
+    assert np.all(weighted_matrix_1.matrix == weighted_matrix_2.matrix)
+
+    weighted_matrix_1.set_function(lambda e1, e2: e2 - e1)
+    weighted_matrix_2.set_function(lambda e1, e2: 2 * (e2 - e1))
+
+    assert np.allclose(2 * weighted_matrix_1.convolve(), weighted_matrix_2.convolve())
+
+    # The weighting switch is part of the key
+
+    weighted_matrix_3 = rsp_set.weight_by_counts("5.0 - 25.0")
+
+    assert np.allclose(weighted_matrix_3.matrix, 0.5625000000000001 * rsp_a.matrix)
+
+    rsp_set.clear_cache()
+
+    weighted_matrix_4 = rsp_set.weight_by_exposure("5.0 - 25.0")
+
+    assert np.allclose(weighted_matrix_4.matrix, 0.625 * rsp_a.matrix)
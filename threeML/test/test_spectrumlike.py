@@ -7,6 +7,7 @@ from threeML.io.package_data import get_path_of_data_file
 from threeML.plugins.DispersionSpectrumLike import DispersionSpectrumLike
 from threeML.plugins.SpectrumLike import SpectrumLike
 from threeML.utils.OGIP.response import OGIPResponse
+from threeML.utils.differentiation import get_parameter_derivatives
 from threeML.exceptions.custom_exceptions import NegativeBackground
 import warnings
 warnings.simplefilter('ignore')
@@ -361,3 +362,128 @@ def test_all_statistics():
 
     spectrum_generator.get_log_like()
 
+
+
+def test_evaluate_model_matches_per_bin_integral():
+
+    energies = np.logspace(1, 3, 51)
+
+    low_edge = energies[:-1]
+    high_edge = energies[1:]
+
+    source_function = Blackbody(K=1E-1, kT=20.)
+
+    spectrum_generator = SpectrumLike.from_function('fake',
+                                                    source_function=source_function,
+                                                    energy_min=low_edge,
+                                                    energy_max=high_edge)
+
+    model = Model(PointSource('fake', 0, 0, spectral_shape=Blackbody(K=1E-1, kT=20.)))
+
+    spectrum_generator.set_model(model)
+
+    # the batched integration must give the same result as integrating bin by bin
+
+    per_bin = np.array([spectrum_generator._integral_flux(emin, emax)
+                        for emin, emax in spectrum_generator.observed_spectrum.bin_stack])
+
+    assert np.allclose(spectrum_generator._evaluate_model(), per_bin, rtol=1e-12)
+
+
+def test_log_like_gradient():
+
+    energies = np.logspace(1, 3, 51)
+
+    low_edge = energies[:-1]
+    high_edge = energies[1:]
+
+    source_function = Blackbody(K=9E-2, kT=20)
+
+    background_function = Powerlaw(K=1, index=-1.5, piv=100.)
+
+    # Poisson with Poisson background (profile likelihood) and Gaussian with no background
+
+    poisson_generator = SpectrumLike.from_function('fake_poisson',
+                                                   source_function=source_function,
+                                                   background_function=background_function,
+                                                   energy_min=low_edge,
+                                                   energy_max=high_edge)
+
+    gaussian_generator = SpectrumLike.from_function('fake_gaussian',
+                                                    source_function=source_function,
+                                                    source_errors=0.5 * source_function(low_edge),
+                                                    energy_min=low_edge,
+                                                    energy_max=high_edge)
+
+    for spectrum_generator in [poisson_generator, gaussian_generator]:
+
+        assert spectrum_generator.has_log_like_gradient
+
+        spectrum_generator.use_effective_area_correction()
+
+        model = Model(PointSource('mysource', 0, 0, spectral_shape=Blackbody(K=1E-1, kT=25.)))
+
+        jl = JointLikelihood(model, DataList(spectrum_generator))
+
+        parameters = model.free_parameters.values()
+
+        gradient = spectrum_generator.get_log_like_gradient(parameters)
+
+        # compare with the numerical derivatives of the whole likelihood
+
+        numerical_gradient = get_parameter_derivatives(spectrum_generator.get_log_like, parameters)
+
+        assert np.allclose(gradient, numerical_gradient, rtol=1e-3, atol=1e-3)
+
+        trial_values = [parameter._get_internal_value() for parameter in parameters]
+
+        assert np.allclose(jl.minus_log_like_gradient(*trial_values), -gradient)
+
+
+def test_gaussian_background_statistic_derivative():
+
+    from threeML.utils.spectrum.spectrum_likelihood import PoissonObservedGaussianBackgroundStatistic
+
+    class FakePlugin(object):
+
+        # Some channels have no background counts but a non-zero error: there the likelihood is a pure Poisson
+
+        current_observed_counts = np.array([10., 0., 5., 3., 20., 1.])
+        current_background_counts = np.array([4., 2., 0., 0., 8., 0.])
+        current_background_count_errors = np.array([2., 1.5, 1., 0.5, 3., 0.])
+
+        model_counts = np.array([5., 1., 3., 4., 10., 2.])
+
+        def get_model(self):
+
+            return self.model_counts
+
+    plugin = FakePlugin()
+
+    statistic = PoissonObservedGaussianBackgroundStatistic(plugin)
+
+    derivative = statistic.get_current_derivative()
+
+    # Compare with the numerical derivative of the statistic with respect to the model counts
+
+    numerical_derivative = np.zeros_like(derivative)
+
+    step = 1e-5
+
+    model_counts = plugin.model_counts.copy()
+
+    for i in range(model_counts.shape[0]):
+
+        plugin.model_counts = model_counts.copy()
+        plugin.model_counts[i] += step
+
+        upper = statistic.get_current_value()[0]
+
+        plugin.model_counts = model_counts.copy()
+        plugin.model_counts[i] -= step
+
+        lower = statistic.get_current_value()[0]
+
+        numerical_derivative[i] = (upper - lower) / (2 * step)
+
+    assert np.allclose(derivative, numerical_derivative, rtol=1e-5, atol=1e-6)
@@ -1,10 +1,16 @@
 import os
 import numpy as np
 import pytest
-from threeML.io.file_utils import within_directory
+from threeML.config.config import threeML_config
+from threeML.io.data_cache import DataCache, get_data_cache
+from threeML.io.file_utils import within_directory, temporary_directory
 from threeML.utils.time_interval import TimeIntervalSet
 from threeML.utils.time_series.event_list import EventListWithDeadTime, EventList
+from threeML.utils.bayesian_blocks import bayesian_blocks, bayesian_blocks_binned, IncrementalBayesianBlocks
+from threeML.utils.binner import TemporalBinner
+from threeML.utils.statistics.stats_tools import Significance
 from threeML.utils.data_builders.time_series_builder import TimeSeriesBuilder
+from threeML.utils.data_builders.fermi.gbm_data import GBMTTEFile
 from threeML.io.file_utils import within_directory
 from threeML.plugins.DispersionSpectrumLike import DispersionSpectrumLike
 from threeML.plugins.OGIPLike import OGIPLike
@@ -231,6 +237,116 @@ def test_read_gbm_tte():
         nai3.write_pha_from_binner('test_from_nai3', overwrite=True)
 
 
+def test_read_gbm_tte_time_window():
+    with within_directory(datasets_directory):
+        data_dir = os.path.join('gbm', 'bn080916009')
+
+        tte_file = os.path.join(data_dir, "glg_tte_n3_bn080916009_v01.fit.gz")
+
+        full = GBMTTEFile(tte_file)
+
+        windowed = GBMTTEFile(tte_file, time_window=(-10, 50), memmap=True)
+
+        relative_times = full.arrival_times - full.trigger_time
+
+        selection = (relative_times >= -10) & (relative_times <= 50)
+
+        assert np.all(windowed.arrival_times == full.arrival_times[selection])
+
+        assert np.all(windowed.energies == full.energies[selection])
+
+        assert np.allclose(windowed.deadtime, full.deadtime[selection])
+
+        # the PHA are stored in the smallest type which can hold all the channels
+
+        assert windowed.energies.dtype == np.uint8
+
+        assert np.isclose(windowed.tstart - windowed.trigger_time, -10)
+        assert np.isclose(windowed.tstop - windowed.trigger_time, 50)
+
+        nai3 = TimeSeriesBuilder.from_gbm_tte('NAI3',
+                                              tte_file,
+                                              rsp_file=os.path.join(data_dir, "glg_cspec_n3_bn080916009_v00.rsp2"),
+                                              poly_order=-1,
+                                              time_window=(-10, 50))
+
+        nai3.set_active_time_interval('0-1')
+
+        assert isinstance(nai3.to_spectrumlike(), DispersionSpectrumLike)
+
+
+def test_data_cache():
+    old_cache_config = dict(threeML_config['data cache'])
+
+    with within_directory(datasets_directory), temporary_directory() as cache_directory:
+        data_dir = os.path.join('gbm', 'bn080916009')
+
+        tte_file = os.path.join(data_dir, "glg_tte_n3_bn080916009_v01.fit.gz")
+        rsp_file = os.path.join(data_dir, "glg_cspec_n3_bn080916009_v00.rsp2")
+
+        threeML_config['data cache']['use cache'] = True
+        threeML_config['data cache']['directory'] = cache_directory
+
+        try:
+
+            cache = get_data_cache()
+
+            polynomials = []
+
+            for i in range(2):
+
+                tte = GBMTTEFile(tte_file, time_window=(-10, 50))
+
+                nai3 = TimeSeriesBuilder.from_gbm_tte('NAI3', tte_file, rsp_file=rsp_file, poly_order=1,
+                                                      time_window=(-10, 50))
+
+                nai3.set_background_interval('-10-0', '20-50', unbinned=False)
+
+                polynomials.append(nai3._time_series.polynomials)
+
+                if i == 0:
+
+                    first_tte = tte
+
+                    n_entries = len(cache)
+
+                    assert n_entries > 0
+
+            # the second time everything comes from the cache
+
+            assert len(cache) == n_entries
+
+            assert np.all(tte.arrival_times == first_tte.arrival_times)
+            assert np.all(tte.energies == first_tte.energies)
+            assert tte.trigger_time == first_tte.trigger_time
+            assert tte.det_name == first_tte.det_name
+
+            for first_poly, poly in zip(*polynomials):
+
+                assert np.allclose(poly.coefficients, first_poly.coefficients)
+                assert np.allclose(poly.covariance_matrix, first_poly.covariance_matrix)
+
+            # a different selection is a different entry
+
+            GBMTTEFile(tte_file, time_window=(-5, 5))
+
+            assert len(cache) == n_entries + 1
+
+            # the least recently used entries are removed when the cache is too big
+
+            small_cache = DataCache(cache_directory, cache.size // 2)
+
+            small_cache._evict()
+
+            assert 0 < len(small_cache) < n_entries + 1
+
+            assert small_cache.size <= small_cache.max_size
+
+        finally:
+
+            threeML_config['data cache'].update(old_cache_config)
+
+
 def test_reading_of_written_pha():
     with within_directory(datasets_directory):
         # check the number of items written
@@ -289,3 +405,77 @@ def test_read_lle():
         assert new_errors == old_errors
 
         assert old_tmin_list == new_tmin_list
+
+
+def test_bayesian_blocks():
+
+    np.random.seed(1234)
+
+    # A constant rate with a bright pulse between 40 and 45
+
+    arrival_times = np.sort(np.concatenate((np.random.uniform(0, 100, 2000), np.random.uniform(40, 45, 500))))
+
+    edges = bayesian_blocks(arrival_times, 0, 100, 1e-3)
+
+    assert edges[0] == 0 and edges[-1] == 100
+
+    assert len(edges) == 4
+
+    assert np.allclose(edges[1:-1], [40, 45], atol=0.2)
+
+    # Adding the events in chunks gives the same result
+
+    incremental = IncrementalBayesianBlocks(1e-3, arrival_times.shape[0])
+
+    for chunk in np.array_split(arrival_times, 5):
+
+        incremental.add_events(chunk)
+
+    assert np.all(incremental.get_edges(0, 100) == edges)
+
+    # Binned data
+
+    bin_edges = np.arange(0, 101, 1.)
+    counts, _ = np.histogram(arrival_times, bin_edges)
+
+    assert np.all(bayesian_blocks_binned(bin_edges, counts, 1e-3) == [0, 40, 45, 100])
+
+
+def test_bin_by_significance():
+
+    np.random.seed(1234)
+
+    # A constant background of 100 counts/s with a bright pulse between 40 and 45
+
+    arrival_times = np.sort(np.concatenate((np.random.uniform(0, 100, 10000), np.random.uniform(40, 45, 2000))))
+
+    background_getter = lambda start, stops: 100. * (np.asarray(stops) - start)
+
+    bins = TemporalBinner.bin_by_significance(arrival_times, background_getter, sigma_level=5, min_counts=10)
+
+    assert len(bins) > 0
+
+    start_times = np.array(bins.start_times)
+    stop_times = np.array(bins.stop_times)
+
+    assert np.all(start_times[1:] == stop_times[:-1])
+
+    # Each bin stops at the first event where the significance is reached
+
+    for interval in bins:
+
+        first = np.searchsorted(arrival_times, interval.start_time)
+        last = np.searchsorted(arrival_times, interval.stop_time)
+
+        counts = np.arange(first + 1, last + 1) - first + 1
+
+        sigma = Significance(counts,
+                             background_getter(interval.start_time, arrival_times[first + 1: last + 1])).li_and_ma()
+
+        exceeding = np.flatnonzero((sigma >= 5) & (counts >= 10))
+
+        assert exceeding[0] == last - first - 1
+
+    # Apart from the first one, which accumulates the events up to the pulse, the bins are all within the pulse
+
+    assert np.all((start_times[1:] > 40) & (stop_times[1:] < 45))
@@ -292,7 +292,11 @@ class PHAWrite(object):
 
             extensions = [EBOUNDS(self._out_rsp[0].ebounds)]
 
-            extensions.extend([SPECRESP_MATRIX(this_rsp.monte_carlo_energies, this_rsp.ebounds, this_rsp.matrix) for this_rsp in self._out_rsp])
+            # sparse responses are written in compressed form
+
+            extensions.extend([SPECRESP_MATRIX(this_rsp.monte_carlo_energies, this_rsp.ebounds,
+                                               this_rsp.sparse_matrix if this_rsp.is_sparse else this_rsp.matrix)
+                               for this_rsp in self._out_rsp])
 
             for i, ext in enumerate(extensions[1:]):
 
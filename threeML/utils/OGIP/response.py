@@ -1,14 +1,18 @@
 import astropy.io.fits as pyfits
 import numpy as np
+import scipy.sparse
 import warnings
 import matplotlib.cm as cm
 from matplotlib.colors import SymLogNorm
 import matplotlib.pyplot as plt
 from operator import itemgetter, attrgetter
 import copy
+import collections
 
 import astropy.units as u
 
+from threeML.config.config import threeML_config
+from threeML.io.data_cache import get_data_cache
 from threeML.io.file_utils import file_existing_and_readable, sanitize_filename
 from threeML.io.fits_file import FITSExtension, FITSFile
 from threeML.utils.time_interval import TimeInterval, TimeIntervalSet
@@ -45,7 +49,9 @@ class InstrumentResponse(object):
 
 
         :param matrix: an n_channels x n_mc_energies response matrix representing both effective area and
-        energy dispersion effects
+        energy dispersion effects. It can be either a dense numpy array or a scipy.sparse matrix. Matrices with a
+        fraction of non-zero elements below the 'sparse response max density' configuration value are stored
+        in sparse (CSR) form, all the others in dense form
         :param ebounds: the energy boundaries of the detector channels (size n_channels + 1)
         :param monte_carlo_energies: the energy boundaries of the monte carlo channels (size n_mc_energies + 1)
         :param coverage_interval: the time interval to which the matrix refers to (if available, None by default)
@@ -54,10 +60,7 @@ class InstrumentResponse(object):
 
         # we simply store all the variables to the class
 
-        self._matrix = np.array(matrix, float)
-
-        # Make sure there are no nans or inf
-        assert np.all(np.isfinite(self._matrix)), "Infinity or nan in matrix"
+        self._matrix = self._prepare_matrix(matrix)
 
         self._ebounds = np.array(ebounds, float)
 
@@ -132,26 +135,101 @@ class InstrumentResponse(object):
 
         return self._coverage_interval
 
+    @staticmethod
+    def _prepare_matrix(matrix):
+        """
+        Converts the input matrix (dense or sparse) to the storage format used internally: a CSR matrix if the
+        fraction of non-zero elements is below the configured threshold, a dense array otherwise
+
+        :param matrix: a dense array or a scipy.sparse matrix
+        :return: a scipy.sparse.csr_matrix or a np.ndarray
+        """
+
+        if scipy.sparse.issparse(matrix):
+
+            matrix = scipy.sparse.csr_matrix(matrix, dtype=float)
+
+            matrix.eliminate_zeros()
+
+            # Make sure there are no nans or inf
+            assert np.all(np.isfinite(matrix.data)), "Infinity or nan in matrix"
+
+            n_non_zero = matrix.nnz
+
+        else:
+
+            matrix = np.array(matrix, float)
+
+            # Make sure there are no nans or inf
+            assert np.all(np.isfinite(matrix)), "Infinity or nan in matrix"
+
+            n_non_zero = np.count_nonzero(matrix)
+
+        density = n_non_zero / float(max(matrix.shape[0] * matrix.shape[1], 1))
+
+        if density < threeML_config['ogip']['sparse response max density']:
+
+            return scipy.sparse.csr_matrix(matrix)
+
+        else:
+
+            return matrix.toarray() if scipy.sparse.issparse(matrix) else matrix
+
+    @property
+    def is_sparse(self):
+        """
+        Whether the matrix is stored (and convolved) in sparse form
+
+        :return: True or False
+        """
+
+        return scipy.sparse.issparse(self._matrix)
+
     @property
     def matrix(self):
         """
-        Return the matrix representing the response
+        Return the matrix representing the response. NOTE: this is always a dense array, which is created on the
+        fly if the matrix is stored in sparse form. Use sparse_matrix to avoid the conversion.
 
         :return matrix: response matrix
         :type matrix: np.ndarray
         """
-        return self._matrix
+
+        if self.is_sparse:
+
+            return self._matrix.toarray()
+
+        else:
+
+            return self._matrix
+
+    @property
+    def sparse_matrix(self):
+        """
+        Return the matrix representing the response in sparse (CSR) form, converting it if it is stored dense
+
+        :return matrix: response matrix
+        :type matrix: scipy.sparse.csr_matrix
+        """
+
+        if self.is_sparse:
+
+            return self._matrix
+
+        else:
+
+            return scipy.sparse.csr_matrix(self._matrix)
 
     def replace_matrix(self, new_matrix):
         """
-        Replace the read matrix with a new one of the same shape
+        Replace the read matrix with a new one of the same shape (dense or sparse)
 
         :return: none
         """
 
         assert new_matrix.shape == self._matrix.shape
 
-        self._matrix = new_matrix
+        self._matrix = self._prepare_matrix(new_matrix)
 
     @property
     def ebounds(self):
@@ -185,6 +263,15 @@ class InstrumentResponse(object):
 
     def convolve(self):
 
+        return self.fold(self.get_true_fluxes())
+
+    def get_true_fluxes(self):
+        """
+        Integrates the function set with set_function over the Monte Carlo energy bins
+
+        :return: the integral of the function over each Monte Carlo energy bin
+        """
+
         true_fluxes = self._integral_function(self._mc_energies[:-1],
                                               self._mc_energies[1:])
 
@@ -197,7 +284,27 @@ class InstrumentResponse(object):
         idx = np.isfinite(true_fluxes)
         true_fluxes[~idx] = 0
 
-        folded_counts = np.dot(true_fluxes, self._matrix.T)
+        return true_fluxes
+
+    def fold(self, true_fluxes):
+        """
+        Folds the provided true fluxes (integrated over the Monte Carlo energy bins) through the response. This is
+        linear, so it can be used also to fold derivatives of the true fluxes. The input can also be a 2d array
+        (one set of true fluxes per column), in which case all columns are folded at once
+
+        :param true_fluxes: array with one element (or one row) per Monte Carlo energy bin
+        :return: the folded counts, with one element (or one row) per channel
+        """
+
+        if self.is_sparse:
+
+            # Only the non-zero elements of the matrix are used
+
+            folded_counts = self._matrix.dot(true_fluxes)
+
+        else:
+
+            folded_counts = np.dot(self._matrix, true_fluxes)
 
         return folded_counts
 
@@ -219,6 +326,8 @@ class InstrumentResponse(object):
 
     def plot_matrix(self):
 
+        matrix = self.matrix
+
         fig, ax = plt.subplots()
 
         idx_mc = 0
@@ -242,15 +351,15 @@ class InstrumentResponse(object):
         #           norm=SymLogNorm(1.0, 1.0, vmin=self._matrix.min(), vmax=self._matrix.max()))
 
         # Find minimum non-zero element
-        vmin = self._matrix[self._matrix > 0].min()
+        vmin = matrix[matrix > 0].min()
 
         cmap = copy.deepcopy(cm.ocean)
 
         cmap.set_under('gray')
 
-        mappable = ax.pcolormesh(self._mc_energies[idx_mc:], self._ebounds[idx_eb:], self._matrix,
+        mappable = ax.pcolormesh(self._mc_energies[idx_mc:], self._ebounds[idx_eb:], matrix,
                                  cmap=cmap,
-                                 norm=SymLogNorm(1.0, 1.0, vmin=vmin, vmax=self._matrix.max()))
+                                 norm=SymLogNorm(1.0, 1.0, vmin=vmin, vmax=matrix.max()))
 
         ax.set_xscale('log')
         ax.set_yscale('log')
@@ -280,7 +389,7 @@ class InstrumentResponse(object):
 
         filename = sanitize_filename(filename, abspath=True)
 
-        fits_file = RSP(self.monte_carlo_energies, self.ebounds, self.matrix, telescope_name, instrument_name)
+        fits_file = RSP(self.monte_carlo_energies, self.ebounds, self._matrix, telescope_name, instrument_name)
 
         fits_file.writeto(filename, clobber=overwrite)
 
@@ -337,46 +446,42 @@ class OGIPResponse(InstrumentResponse):
 
         self._rsp_file = rsp_file
 
-        # Read the response
-        with pyfits.open(rsp_file) as f:
+        # Read the response, or get it from the data cache if it is active
 
-            try:
+        data_cache = get_data_cache()
 
-                # This is usually when the response file contains only the energy dispersion
+        cached = data_cache.get('ogip_response', rsp_file, rsp_number=rsp_number) if data_cache is not None else None
 
-                data = f['MATRIX', rsp_number].data
-                header = f['MATRIX', rsp_number].header
+        if cached is not None:
 
-                if arf_file is None:
-                    warnings.warn("The response is in an extension called MATRIX, which usually means you also "
-                                  "need an ancillary file (ARF) which you didn't provide. You should refer to the "
-                                  "documentation  of the instrument and make sure you don't need an ARF.")
+            arrays, metadata = cached
 
-            except Exception as e:
-                warnings.warn("The default choice for MATRIX extension failed:"+repr(e)+\
-                              "available: "+" ".join([repr(e.header.get('EXTNAME')) for e in f]))
+            matrix = scipy.sparse.csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']),
+                                             shape=tuple(metadata['shape']))
 
-                # Other detectors might use the SPECRESP MATRIX name instead, usually when the response has been
-                # already convoluted with the effective area
+            ebounds = arrays['ebounds']
 
-                # Note that here we are not catching any exception, because
-                # we have to fail if we cannot read the matrix
+            mc_channels = arrays['mc_channels']
 
-                data = f['SPECRESP MATRIX', rsp_number].data
-                header = f['SPECRESP MATRIX', rsp_number].header
+            self._first_channel = metadata['first_channel']
 
-            # These 3 operations must be executed when the file is still open
+            header_start, header_stop = metadata['coverage_interval']
 
-            matrix = self._read_matrix(data, header)
+        else:
 
-            ebounds = self._read_ebounds(f['EBOUNDS'])
+            matrix, ebounds, mc_channels, header_start, header_stop = self._read_rsp_file(rsp_file, rsp_number,
+                                                                                          arf_file)
 
-            mc_channels = self._read_mc_channels(data)
+            if data_cache is not None:
 
-        # Now, if there is information on the coverage interval, let's use it
+                data_cache.put('ogip_response', rsp_file,
+                               {'data': matrix.data, 'indices': matrix.indices, 'indptr': matrix.indptr,
+                                'ebounds': ebounds, 'mc_channels': mc_channels},
+                               {'shape': matrix.shape, 'first_channel': self._first_channel,
+                                'coverage_interval': (header_start, header_stop)},
+                               rsp_number=rsp_number)
 
-        header_start = header.get("TSTART", None)
-        header_stop = header.get("TSTOP", None)
+        # Now, if there is information on the coverage interval, let's use it
 
         if header_start is not None and header_stop is not None:
 
@@ -402,6 +507,51 @@ class OGIPResponse(InstrumentResponse):
 
             self._arf_file = None
 
+    def _read_rsp_file(self, rsp_file, rsp_number, arf_file):
+        """
+        Reads the matrix, the ebounds and the monte carlo energies of the rsp_number-th response in the file
+
+        :return: (matrix, ebounds, mc_channels, tstart, tstop), where tstart and tstop are None if the header does
+        not contain them
+        """
+
+        with pyfits.open(rsp_file) as f:
+
+            try:
+
+                # This is usually when the response file contains only the energy dispersion
+
+                data = f['MATRIX', rsp_number].data
+                header = f['MATRIX', rsp_number].header
+
+                if arf_file is None:
+                    warnings.warn("The response is in an extension called MATRIX, which usually means you also "
+                                  "need an ancillary file (ARF) which you didn't provide. You should refer to the "
+                                  "documentation  of the instrument and make sure you don't need an ARF.")
+
+            except Exception as e:
+                warnings.warn("The default choice for MATRIX extension failed:"+repr(e)+\
+                              "available: "+" ".join([repr(e.header.get('EXTNAME')) for e in f]))
+
+                # Other detectors might use the SPECRESP MATRIX name instead, usually when the response has been
+                # already convoluted with the effective area
+
+                # Note that here we are not catching any exception, because
+                # we have to fail if we cannot read the matrix
+
+                data = f['SPECRESP MATRIX', rsp_number].data
+                header = f['SPECRESP MATRIX', rsp_number].header
+
+            # These 3 operations must be executed when the file is still open
+
+            matrix = self._read_matrix(data, header)
+
+            ebounds = self._read_ebounds(f['EBOUNDS'])
+
+            mc_channels = self._read_mc_channels(data)
+
+        return matrix, ebounds, mc_channels, header.get("TSTART", None), header.get("TSTOP", None)
+
     @staticmethod
     def _are_contiguous(arr1, arr2):
 
@@ -478,48 +628,100 @@ class OGIPResponse(InstrumentResponse):
         # Store the first channel as a property
         self._first_channel = tlmin_fchan
 
-        rsp = np.zeros([data.shape[0], n_channels], float)
+        n_rows = data.shape[0]
 
-        n_grp = data.field("N_GRP")  # type: np.ndarray
+        n_grp = np.array(data.field("N_GRP"), int).reshape(n_rows)  # type: np.ndarray
 
         # The numbering of channels could start at 0, or at some other number (usually 1). Of course the indexing
         # of arrays starts at 0. So let's offset the F_CHAN column to account for that
 
-        f_chan = data.field("F_CHAN") - tlmin_fchan  # type: np.ndarray
-        n_chan = data.field("N_CHAN")  # type: np.ndarray
+        f_chan = self._flatten_groups(data.field("F_CHAN"), n_grp) - tlmin_fchan  # type: np.ndarray
+        n_chan = self._flatten_groups(data.field("N_CHAN"), n_grp)  # type: np.ndarray
+
+        # Now f_chan and n_chan contain one element per group, with the groups of all rows one after the other.
+        # We decompress the matrix in one pass, building the coordinates of every element of every group
+
+        group_row = np.repeat(np.arange(n_rows), n_grp)
+
+        # Index of the first element of each group among all the elements of all groups
+
+        group_start = np.cumsum(n_chan) - n_chan
+
+        # Position of each group within the MATRIX cell of its row (the groups are stored one after the other)
+
+        row_first_group = np.cumsum(n_grp) - n_grp
+
+        row_start = np.zeros(n_rows, int)
+        row_start[n_grp > 0] = group_start[row_first_group[n_grp > 0]]
 
-        # In certain matrices where compression has not been used, n_grp, f_chan and n_chan are not array columns,
-        # but simple scalars. Expand then their dimensions so that we don't need to customize the code below.
-        # However, if the columns are variable-length arrays, then they do have ndmin = 1 but have dtype 'object'.
-        # In that case we don't want to add a dimension, as they are essentially a list of arrays.
+        group_offset = group_start - row_start[group_row]
 
-        if n_grp.ndim == 1 and data.field("N_CHAN").dtype != np.object:
-            n_grp = np.expand_dims(n_grp, 1)
+        # Now expand to one entry per element
 
-        if f_chan.ndim == 1 and data.field("N_CHAN").dtype != np.object:
-            f_chan = np.expand_dims(f_chan, 1)
+        element_group = np.repeat(np.arange(n_chan.shape[0]), n_chan)
 
-        if n_chan.ndim == 1 and data.field("N_CHAN").dtype != np.object:
-            n_chan = np.expand_dims(n_chan, 1)
+        element_index = np.arange(element_group.shape[0]) - group_start[element_group]
+
+        channels = f_chan[element_group] + element_index
+        energies = group_row[element_group]
+        positions = group_offset[element_group] + element_index
 
         matrix = data.field(column_name)
 
-        for i, row in enumerate(data):
+        if matrix.dtype == np.object:
+
+            # Variable-length column: concatenate all the cells and compute where each row begins
+
+            cells = [np.asarray(cell, float).ravel() for cell in matrix]
+
+            cell_lengths = np.array([cell.shape[0] for cell in cells], int)
+
+            flat_matrix = np.concatenate(cells) if n_rows > 0 else np.array([], float)
+
+            values = flat_matrix[(np.cumsum(cell_lengths) - cell_lengths)[energies] + positions]
+
+        else:
 
-            m_start = 0
+            values = np.asarray(matrix, float).reshape(n_rows, -1)[energies, positions]
 
-            for j in range(n_grp[i]):
+        # Building the matrix in coordinate form means that it never needs to be expanded to its full dense shape
+
+        rsp = scipy.sparse.coo_matrix((values, (channels, energies)), shape=(n_channels, n_rows))
+
+        return rsp.tocsr()
+
+    @staticmethod
+    def _flatten_groups(column, n_grp):
+        """
+        Returns the first n_grp[i] elements of each row of a N_GRP-indexed column (F_CHAN or N_CHAN), concatenated
+        in one array. Works for scalar columns (uncompressed matrices), fixed-width vector columns and
+        variable-length columns (which are read as arrays of objects)
+
+        :param column: the column as read from the FITS file
+        :param n_grp: the number of groups in each row
+        :return: array with one element per group
+        """
 
-                # This np.squeeze call is needed because some files (for example from Fermi/GBM) contains a vector
-                # column for n_chan, even though all elements are of size 1
-                this_n_chan = int(np.squeeze(n_chan[i][j]))
-                this_f_chan = int(np.squeeze(f_chan[i][j]))
+        if column.dtype == np.object:
 
-                rsp[i, this_f_chan: this_f_chan + this_n_chan] = matrix[i][m_start:m_start + this_n_chan]
+            # This np.squeeze call is needed because some files (for example from Fermi/GBM) contains a vector
+            # column for n_chan, even though all elements are of size 1
 
-                m_start += this_n_chan
+            groups = [np.atleast_1d(np.squeeze(cell))[:this_n_grp] for cell, this_n_grp in zip(column, n_grp)]
 
-        return rsp.T
+            if len(groups) == 0:
+
+                return np.array([], int)
+
+            return np.concatenate(groups).astype(int)
+
+        else:
+
+            column = np.asarray(column).reshape(column.shape[0], -1)
+
+            selection = np.arange(column.shape[1]) < n_grp[:, np.newaxis]
+
+            return column[selection].astype(int)
 
     @property
     def rsp_filename(self):
@@ -562,7 +764,7 @@ class OGIPResponse(InstrumentResponse):
 
         # Check that arf and rmf have same dimensions
 
-        if arf.shape[0] != self.matrix.shape[1]:
+        if arf.shape[0] != self._matrix.shape[1]:
             raise IOError("The ARF and the RMF file does not have the same number of channels")
 
         # Check that the ENERG_LO and ENERG_HI for the RMF and the ARF
@@ -586,7 +788,13 @@ class OGIPResponse(InstrumentResponse):
 
         # Multiply ARF and RMF
 
-        matrix = self.matrix * arf
+        if self.is_sparse:
+
+            matrix = self._matrix.dot(scipy.sparse.diags(arf.astype(float)))
+
+        else:
+
+            matrix = self._matrix * arf
 
         # Override the matrix with the one multiplied by the arf
         self.replace_matrix(matrix)
@@ -597,6 +805,11 @@ class InstrumentResponseSet(object):
     A set of responses
 
     """
+
+    # Maximum number of weighted responses kept in the cache
+
+    _max_cache_size = 256
+
     def __init__(self, matrix_list, exposure_getter, counts_getter, reference_time=0.0):
         """
 
@@ -675,6 +888,16 @@ class InstrumentResponseSet(object):
 
         self._reference_time = float(reference_time)
 
+        # Index of the (sorted and contiguous) coverage intervals, used to find quickly the matrices overlapping
+        # with an interval of interest
+
+        self._coverage_starts = np.array(self._coverage_intervals.start_times, float)
+        self._coverage_stops = np.array(self._coverage_intervals.stop_times, float)
+
+        # Cache of the weighted responses, keyed by weighting switch and intervals
+
+        self._weighted_responses_cache = collections.OrderedDict()
+
     @property
     def reference_time(self):
 
@@ -777,6 +1000,45 @@ class InstrumentResponseSet(object):
 
         intervals_set = TimeIntervalSet.from_strings(*intervals)
 
+        # Look for this weighting in the cache first
+
+        key = (switch, tuple((interval.start_time, interval.stop_time) for interval in intervals_set))
+
+        if key in self._weighted_responses_cache:
+
+            # Mark it as the most recently used
+
+            matrix_instance = self._weighted_responses_cache.pop(key)
+
+            self._weighted_responses_cache[key] = matrix_instance
+
+        else:
+
+            matrix_instance = self._compute_weighted_matrix(switch, intervals_set)
+
+            self._weighted_responses_cache[key] = matrix_instance
+
+            # Evict the least recently used response if the cache is full
+
+            if len(self._weighted_responses_cache) > self._max_cache_size:
+
+                self._weighted_responses_cache.popitem(last=False)
+
+        # Return a shallow copy, so that the matrix is shared but each caller can set its own function
+
+        return copy.copy(matrix_instance)
+
+    def clear_cache(self):
+        """
+        Remove all the weighted responses from the cache
+
+        :return: none
+        """
+
+        self._weighted_responses_cache.clear()
+
+    def _compute_weighted_matrix(self, switch, intervals_set):
+
         # Compute a set of weights for each interval
         weights = np.zeros(len(self._matrix_list))
 
@@ -787,8 +1049,25 @@ class InstrumentResponseSet(object):
         # Normalize to 1
         weights /= np.sum(weights)
 
-        # Weight matrices
-        matrix = np.dot(np.array(map(attrgetter("matrix"), self._matrix_list)).T, weights.T).T
+        # Weight matrices, using only those with a non-zero weight
+
+        non_zero = np.flatnonzero(weights)
+
+        use_sparse = np.all([self._matrix_list[i].is_sparse for i in non_zero])
+
+        matrix = None
+
+        for i in non_zero:
+
+            this_matrix = self._matrix_list[i].sparse_matrix if use_sparse else self._matrix_list[i].matrix
+
+            if matrix is None:
+
+                matrix = weights[i] * this_matrix
+
+            else:
+
+                matrix = matrix + weights[i] * this_matrix
 
         # Now generate the instance of the response
 
@@ -802,6 +1081,33 @@ class InstrumentResponseSet(object):
 
         return matrix_instance
 
+    def _overlapping_matrices(self, interval_of_interest):
+        """
+        Returns the indices of the matrices whose coverage interval overlaps with the interval of interest (with the
+        same definition used by TimeInterval.overlaps_with)
+
+        :param interval_of_interest: a TimeInterval instance
+        :return: array of indices
+        """
+
+        start = interval_of_interest.start_time
+        stop = interval_of_interest.stop_time
+
+        # The coverage intervals are sorted and contiguous, so the candidates are found with a binary search
+
+        first = np.searchsorted(self._coverage_stops, start, side='left')
+        last = np.searchsorted(self._coverage_starts, stop, side='right')
+
+        starts = self._coverage_starts[first:last]
+        stops = self._coverage_stops[first:last]
+
+        overlaps = ((start == starts) | (stop == stops) |
+                    ((start > starts) & (start < stops)) |
+                    ((stop > starts) & (stop < stops)) |
+                    ((start < starts) & (stop > stops)))
+
+        return np.flatnonzero(overlaps) + first
+
     def _weight_response(self, interval_of_interest, switch):
 
         """
@@ -817,20 +1123,19 @@ class InstrumentResponseSet(object):
         # more than one interval
         #######################
 
-        # Now mark all responses which overlap with the interval of interest
-        # NOTE: this is a mask of the same length as _matrix_list and _coverage_intervals
+        # Now find all responses which overlap with the interval of interest
 
-        matrices_mask = map(lambda c_i: c_i.overlaps_with(interval_of_interest), self._coverage_intervals)
+        overlapping = self._overlapping_matrices(interval_of_interest)
 
         # Check that we have at least one matrix
 
-        if not np.any(matrices_mask):
+        if len(overlapping) == 0:
 
             raise NoMatrixForInterval("Could not find any matrix applicable to %s\n Have intervals:%s" % (interval_of_interest,', '.join([str(interval) for interval in self._coverage_intervals]) ))
 
         # Compute the weights
 
-        weights = np.empty_like(self._matrix_list, float)
+        weights = np.zeros(len(self._matrix_list), float)
 
         # These "effective intervals" are how much of the coverage interval is really used for each matrix
         # NOTE: the length of effective_intervals list *will not be* the same as the weight mask or the matrix_list.
@@ -838,36 +1143,29 @@ class InstrumentResponseSet(object):
 
         effective_intervals = []
 
-        for i, matrix in enumerate(self._matrix_list):
-
-            if matrices_mask[i]:
-
-                # A matrix of interest
-                this_coverage_interval = self._coverage_intervals[i]
-
-                # See how much it overlaps with the interval of interest
-                this_effective_interval = this_coverage_interval.intersect(interval_of_interest)
+        for i in overlapping:
 
-                effective_intervals.append(this_effective_interval)
+            # A matrix of interest
+            this_coverage_interval = self._coverage_intervals[i]
 
-                # Now compute the weight
+            # See how much it overlaps with the interval of interest
+            this_effective_interval = this_coverage_interval.intersect(interval_of_interest)
 
-                if switch == 'counts':
+            effective_intervals.append(this_effective_interval)
 
-                    # Weight according to the number of events
-                    weights[i] = self._counts_getter(this_effective_interval.start_time,
-                                                     this_effective_interval.stop_time)
+            # Now compute the weight
 
-                elif switch == 'exposure':
+            if switch == 'counts':
 
-                    # Weight according to the exposure
-                    weights[i] = self._exposure_getter(this_effective_interval.start_time,
-                                                       this_effective_interval.stop_time)
+                # Weight according to the number of events
+                weights[i] = self._counts_getter(this_effective_interval.start_time,
+                                                 this_effective_interval.stop_time)
 
-            else:
+            elif switch == 'exposure':
 
-                # Uninteresting matrix
-                weights[i] = 0.0
+                # Weight according to the exposure
+                weights[i] = self._exposure_getter(this_effective_interval.start_time,
+                                                   this_effective_interval.stop_time)
 
         # if all weights are zero, there is something clearly wrong with the exposure or the counts computation
         assert np.sum(weights) > 0, "All weights are zero. There must be a bug in the exposure or counts computation"
@@ -953,7 +1251,8 @@ class MATRIX(FITSExtension):
     :param mc_energies_hi: hi bound of MC energies (in keV)
     :param channel_energies_lo: lower bound of channel energies (in keV)
     :param channel_energies_hi: hi bound of channel energies (in keV
-    :param matrix: the redistribution matrix, representing energy dispersion effects
+    :param matrix: the redistribution matrix, representing energy dispersion effects. If it is a scipy.sparse matrix,
+    only the band between the first and the last non-zero channel of each MC energy is written
     """
 
 
@@ -984,14 +1283,24 @@ class MATRIX(FITSExtension):
 
         ones = np.ones(n_mc_channels, np.int16)
 
-        # We need to format the matrix as a list of n_mc_channels rows of n_channels length
+        if scipy.sparse.issparse(matrix):
+
+            f_chan, n_chan, band = self._compress_matrix(matrix)
+
+        else:
+
+            # We need to format the matrix as a list of n_mc_channels rows of n_channels length
+
+            f_chan = ones
+            n_chan = np.ones(n_mc_channels, np.int16) * n_channels
+            band = matrix.T
 
         data_tuple = (('ENERG_LO', mc_energies[:-1] * u.keV),
                       ('ENERG_HI', mc_energies[1:] * u.keV),
                       ('N_GRP', ones),
-                      ('F_CHAN', ones),
-                      ('N_CHAN', np.ones(n_mc_channels, np.int16) * n_channels),
-                      ('MATRIX', matrix.T)
+                      ('F_CHAN', f_chan),
+                      ('N_CHAN', n_chan),
+                      ('MATRIX', band)
                       )
 
         super(MATRIX, self).__init__(data_tuple, self._HEADER_KEYWORDS)
@@ -999,6 +1308,45 @@ class MATRIX(FITSExtension):
         # Update DETCHANS
         self.hdu.header.set("DETCHANS", n_channels)
 
+    @staticmethod
+    def _compress_matrix(matrix):
+        """
+        Compress a sparse matrix in the OGIP format using one group per MC energy, going from the first to the last
+        non-zero channel. The MATRIX column has the width of the largest group, and shorter groups are padded with
+        zeros (which are ignored by readers, as they use N_CHAN)
+
+        :param matrix: a n_channels x n_mc_channels scipy.sparse matrix
+        :return: (f_chan, n_chan, band) where f_chan starts at 1 and band is a n_mc_channels x max(n_chan) array
+        """
+
+        # One row per MC energy, with sorted channel indices
+
+        rows = scipy.sparse.csr_matrix(matrix.T)
+        rows.sort_indices()
+
+        n_mc_channels = rows.shape[0]
+
+        n_elements = np.diff(rows.indptr)
+        not_empty = n_elements > 0
+
+        first = np.zeros(n_mc_channels, int)
+        last = np.zeros(n_mc_channels, int)
+
+        first[not_empty] = rows.indices[rows.indptr[:-1][not_empty]]
+        last[not_empty] = rows.indices[rows.indptr[1:][not_empty] - 1]
+
+        # Empty rows are written as a single channel containing zero
+
+        n_chan = last - first + 1
+
+        band = np.zeros((n_mc_channels, n_chan.max()), float)
+
+        row_idx = np.repeat(np.arange(n_mc_channels), n_elements)
+
+        band[row_idx, rows.indices - first[row_idx]] = rows.data
+
+        return (first + 1).astype(np.int32), n_chan.astype(np.int32), band
+
 
 class SPECRESP_MATRIX(MATRIX):
     """
@@ -1042,8 +1390,8 @@ class RMF(FITSFile):
         matrix_ext = MATRIX(mc_energies, ebounds, matrix)
 
         # Set telescope and instrument name
-        matrix.hdu.header.set("TELESCOP", telescope_name)
-        matrix.hdu.header.set("INSTRUME", instrument_name)
+        matrix_ext.hdu.header.set("TELESCOP", telescope_name)
+        matrix_ext.hdu.header.set("INSTRUME", instrument_name)
 
         # Create FITS file
         super(RMF, self).__init__(fits_extensions=[ebounds_ext, matrix_ext])
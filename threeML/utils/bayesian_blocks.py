@@ -6,137 +6,315 @@ import sys
 import numexpr
 import numpy as np
 
-from threeML.io.progress_bar import progress_bar
-
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("bayesian_blocks")
 
-__all__ = ['bayesian_blocks', 'bayesian_blocks_not_unique']
+__all__ = ['bayesian_blocks', 'bayesian_blocks_not_unique', 'bayesian_blocks_binned', 'IncrementalBayesianBlocks']
 
 
-def bayesian_blocks_not_unique(tt, ttstart, ttstop, p0):
-    # Verify that the input array is one-dimensional
-    tt = np.asarray(tt, dtype=float)
+# Maximum number of cells between two checks of the candidates to prune in _optimal_blocks
 
-    assert tt.ndim == 1
+_max_pruning_interval = 64
 
-    # Now create the array of unique times
 
-    unique_t = np.unique(tt)
+def _optimal_blocks(edges, counts, priors, best=None, last=None, candidates=None):
+    """
+    Dynamic program of Scargle et al. 2012, with the candidate pruning of Killick et al. 2012 (PELT).
+
+    For the cell R, the best partition of the cells 0..R is found by looking for the best start i of the last block,
+    maximizing best[i - 1] + fitness(cells i..R) - prior[R], where the fitness of a block is N_k * log(N_k / T_k). Since
+    splitting a block never decreases the total fitness, a start i for which best[i - 1] + fitness(i..R) < best[R]
+    can never be the best start for the following cells either. Such candidates can be pruned, which preserves the
+    optimum. Keeping them does not change the result either, so the pruning is applied only when it pays off.
+
+    Indexing the arrays with a list of candidates is several times slower per element than slicing them, so the
+    candidates are all the cells from the oldest one still needed to R (only the oldest candidates are pruned), and
+    they are switched to an explicit list only when that would leave fewer than a quarter of them. When a check finds
+    nothing to prune, the next one is done after twice as many cells. The speed-up with respect to the quadratic
+    algorithm grows with the number of blocks (about 3x for a light curve with tens of blocks and 3e4 events). With
+    only a few long blocks little can be pruned, the algorithm stays quadratic and it runs at about the speed of the
+    unpruned one.
+
+    A previous run on the first cells can be continued by providing its outputs, as long as these cells did not
+    change.
+
+    :param edges: the edges of the cells (N + 1 elements)
+    :param counts: the number of events in each cell (N elements)
+    :param priors: the prior on the number of blocks, for each cell (N elements)
+    :param best: fitness of the best partition for the cells already processed
+    :param last: start of the last block of the best partition for the cells already processed
+    :param candidates: the candidate starts after the cells already processed
+    :return: (best, last, candidates)
+    """
 
-    t = tt
-    tstart = ttstart
-    tstop = ttstop
+    n_cells = counts.shape[0]
 
-    # Create initial cell edges (Voronoi tessellation) using the unique time stamps
+    if best is None:
 
-    edges = np.concatenate([[tstart],
-                            0.5 * (unique_t[1:] + unique_t[:-1]),
-                            [tstop]])
+        best = np.zeros(0, dtype=float)
+        last = np.zeros(0, dtype=int)
+        candidates = np.zeros(0, dtype=int)
 
-    # The last block length is 0 by definition
-    block_length = tstop - edges
+    n_done = best.shape[0]
 
-    if np.sum((block_length <= 0)) > 1:
-        raise RuntimeError("Events appears to be out of order! Check for order, or duplicated events.")
+    best = np.concatenate((best, np.zeros(n_cells - n_done, dtype=float)))
+    last = np.concatenate((last, np.zeros(n_cells - n_done, dtype=int)))
 
-    N = unique_t.shape[0]
+    # Cumulative counts, so that the number of events in the cells i..R is cumulative_counts[R + 1] - cumulative_counts[i]
 
-    # arrays to store the best configuration
-    best = np.zeros(N, dtype=float)
-    last = np.zeros(N, dtype=int)
+    cumulative_counts = np.concatenate(([0.0], np.cumsum(counts, dtype=float)))
 
-    # Pre-computed priors (for speed)
-    # eq. 21 from Scargle 2012
+    # Fitness of the best partition before each candidate (0 for a block starting in the first cell)
 
-    priors = 4 - np.log(73.53 * p0 * np.power(np.arange(1, N + 1), -0.478))
+    best_before = np.concatenate(([0.0], best))
 
-    # Count how many events are in each Voronoi cell
-
-    x, _ = np.histogram(t, edges)
+    # Set numexpr precision to low (more than enough for us), which is
+    # faster than high
+    oldaccuracy = numexpr.set_vml_accuracy_mode('low')
+    numexpr.set_num_threads(1)
+    numexpr.set_vml_num_threads(1)
 
     # Speed tricks: resolve once for all the functions which will be used
     # in the loop
-    cumsum = np.cumsum
-    log = np.log
-    argmax = np.argmax
     numexpr_evaluate = numexpr.evaluate
-    arange = np.arange
+    numexpr_re_evaluate = numexpr.re_evaluate
 
-    # Decide the step for reporting progress
-    incr = max(int(float(N) / 100.0 * 10), 1)
+    # Empty blocks have zero fitness. They can only exist if some cells are empty (binned data)
 
-    logger.debug("Finding blocks...")
+    if np.all(counts > 0):
 
-    # This is where the computation happens. Following Scargle et al. 2012.
-    # This loop has been optimized for speed:
-    # * the expression for the fitness function has been rewritten to
-    #  avoid multiple log computations, and to avoid power computations
-    # * the use of scipy.weave and numexpr has been evaluated. The latter
-    #  gives a big gain (~40%) if used for the fitness function. No other
-    #  gain is obtained by using it anywhere else
+        fitness_expression = '''N_k * log(N_k / T_k)'''
 
-    # Set numexpr precision to low (more than enough for us), which is
-    # faster than high
-    oldaccuracy = numexpr.set_vml_accuracy_mode('low')
-    numexpr.set_num_threads(1)
-    numexpr.set_vml_num_threads(1)
+    else:
+
+        fitness_expression = '''where(N_k > 0, N_k * log(N_k / T_k), 0.0)'''
+
+    # The candidates are either all the cells from "first" to R (and then the arrays are sliced), or the cells in
+    # candidates_buffer[:n_candidates] (and then the arrays are indexed, which is several times slower per element)
+
+    candidates_buffer = np.zeros(candidates.shape[0] + n_cells - n_done, dtype=int)
+
+    n_candidates = candidates.shape[0]
+
+    candidates_buffer[:n_candidates] = candidates
+
+    first = candidates[0] if n_candidates > 0 else n_done
+
+    indexed = (n_candidates > 0 and candidates[-1] - first + 1 != n_candidates)
+
+    pruning_interval = 1
+    next_pruning = n_done
+
+    for R in range(n_done, n_cells):
+
+        # Any block can start in this cell
+
+        if indexed:
+
+            candidates_buffer[n_candidates] = R
+
+            n_candidates += 1
+
+            candidates = candidates_buffer[:n_candidates]
+
+            if 2 * n_candidates > R - candidates[0] + 1:
+
+                # Indexing the candidates now costs more than using all the cells from the first one (which
+                # includes some candidates already pruned, but does not change the result)
+
+                indexed = False
+
+                first = candidates[0]
+
+        # N_k and T_k for the blocks starting at each candidate and ending at R
+
+        if indexed:
+
+            N_k = cumulative_counts[R + 1] - cumulative_counts[candidates]
+            T_k = edges[R + 1] - edges[candidates]
+
+        else:
+
+            N_k = cumulative_counts[R + 1] - cumulative_counts[first:R + 1]
+            T_k = edges[R + 1] - edges[first:R + 1]
+
+        # Evaluate fitness function. This is the slowest part, which
+        # numexpr speeds up. The first time we need to "compile" the expression in numexpr,
+        # all the other times we can reuse it
+
+        if R == n_done:
+
+            A_R = numexpr_evaluate(fitness_expression, optimization='aggressive', local_dict={'N_k': N_k, 'T_k': T_k})
+
+        else:
+
+            A_R = numexpr_re_evaluate(local_dict={'N_k': N_k, 'T_k': T_k})
+
+        if indexed:
+
+            A_R += best_before[candidates]
+
+        else:
+
+            A_R += best_before[first:R + 1]
+
+        i_max = A_R.argmax()
 
-    with progress_bar(N) as progress:
+        last[R] = candidates[i_max] if indexed else first + i_max
+        best[R] = A_R[i_max] - priors[R]
 
-        for R in range(N):
-            br = block_length[R + 1]
-            T_k = block_length[:R + 1] - br
+        best_before[R + 1] = best[R]
 
-            # N_k: number of elements in each block
-            # This expression has been simplified for the case of
-            # unbinned events (i.e., one element in each block)
-            # It was:
-            N_k = cumsum(x[:R + 1][::-1])[::-1]
-            # Now it is:
-            # N_k = arange(R + 1, 0, -1)
+        # Prune the candidates which cannot be the start of the last block anymore. When there was nothing to prune,
+        # the next check is done after twice as many cells (a candidate that can be pruned now can still be pruned
+        # later)
 
-            # Evaluate fitness function
-            # This is the slowest part, which I'm speeding up by using
-            # numexpr. It provides a ~40% gain in execution speed.
+        if R < next_pruning:
 
-            fit_vec = numexpr_evaluate('''N_k * log(N_k/ T_k) ''',
-                                       optimization='aggressive',
-                                       local_dict={'N_k': N_k, 'T_k': T_k})
+            continue
 
-            p = priors[R]
+        keep = A_R >= best[R]
 
-            A_R = fit_vec - p
+        n_keep = np.count_nonzero(keep)
+
+        if indexed:
+
+            if n_keep < n_candidates:
+
+                candidates_buffer[:n_keep] = candidates[keep]
+
+                n_candidates = n_keep
+
+                pruning_interval = 1
+
+            else:
+
+                pruning_interval = min(2 * pruning_interval, _max_pruning_interval)
+
+        elif 4 * n_keep < keep.shape[0]:
+
+            # Few enough candidates are left to be worth indexing them
+
+            indexed = True
+
+            n_candidates = n_keep
+
+            candidates_buffer[:n_keep] = first + np.flatnonzero(keep)
+
+            pruning_interval = 1
+
+        else:
 
-            A_R[1:] += best[:R]
+            # Only the oldest candidates are pruned, so that the others stay contiguous
 
-            i_max = argmax(A_R)
+            n_oldest = keep.argmax()
 
-            last[R] = i_max
-            best[R] = A_R[i_max]
+            if n_oldest > 0:
 
-            progress.increase()
+                first += n_oldest
+
+                pruning_interval = 1
+
+            else:
+
+                pruning_interval = min(2 * pruning_interval, _max_pruning_interval)
+
+        next_pruning = R + pruning_interval
+
+    if indexed:
+
+        candidates = candidates_buffer[:n_candidates].copy()
+
+    else:
+
+        candidates = np.arange(first, n_cells)
 
     numexpr.set_vml_accuracy_mode(oldaccuracy)
 
-    logger.debug("Done\n")
+    return best, last, candidates
 
-    # Now find blocks
-    change_points = np.zeros(N, dtype=int)
-    i_cp = N
+
+def _get_change_points(last):
+    """
+    Peel off the blocks from the result of _optimal_blocks (see the algorithm in Scargle et al.)
+
+    :param last: the start of the last block of the best partition for each cell
+    :return: the indexes of the edges of the blocks
+    """
+
+    N = last.shape[0]
+
+    change_points = np.zeros(N + 1, dtype=int)
+    i_cp = N + 1
     ind = N
+
     while True:
+
         i_cp -= 1
+
         change_points[i_cp] = ind
 
         if ind == 0:
+
             break
 
         ind = last[ind - 1]
 
-    change_points = change_points[i_cp:]
+    return change_points[i_cp:]
+
+
+def _get_prior(p0, N):
 
-    finalEdges = edges[change_points]
+    # eq. 21 from Scargle 2012
+
+    return 4 - np.log(73.53 * p0 * np.power(N, -0.478))
+
+
+def bayesian_blocks_not_unique(tt, ttstart, ttstop, p0):
+    # Verify that the input array is one-dimensional
+    tt = np.asarray(tt, dtype=float)
+
+    assert tt.ndim == 1
+
+    # Now create the array of unique times
+
+    unique_t = np.unique(tt)
+
+    t = tt
+    tstart = ttstart
+    tstop = ttstop
+
+    # Create initial cell edges (Voronoi tessellation) using the unique time stamps
+
+    edges = np.concatenate([[tstart],
+                            0.5 * (unique_t[1:] + unique_t[:-1]),
+                            [tstop]])
+
+    # The last block length is 0 by definition
+    block_length = tstop - edges
+
+    if np.sum((block_length <= 0)) > 1:
+        raise RuntimeError("Events appears to be out of order! Check for order, or duplicated events.")
+
+    N = unique_t.shape[0]
+
+    # Pre-computed priors (for speed)
+
+    priors = _get_prior(p0, np.arange(1, N + 1))
+
+    # Count how many events are in each Voronoi cell
+
+    x, _ = np.histogram(t, edges)
+
+    logger.debug("Finding blocks...")
+
+    best, last, _ = _optimal_blocks(edges, x, priors)
+
+    logger.debug("Done\n")
+
+    # Now find blocks
+
+    finalEdges = edges[_get_change_points(last)]
 
     return np.asarray(finalEdges)
 
@@ -205,118 +383,179 @@ def bayesian_blocks(tt, ttstart, ttstop, p0, bkg_integral_distribution=None):
 
     N = t.shape[0]
 
-    # arrays to store the best configuration
-    best = np.zeros(N, dtype=float)
-    last = np.zeros(N, dtype=int)
-
     # eq. 21 from Scargle 2012
-    prior = 4 - np.log(73.53 * p0 * (N**-0.478))
+    prior = _get_prior(p0, N)
 
     logger.debug("Finding blocks...")
 
-    # This is where the computation happens. Following Scargle et al. 2012.
-    # This loop has been optimized for speed:
-    # * the expression for the fitness function has been rewritten to
-    #  avoid multiple log computations, and to avoid power computations
-    # * the use of scipy.weave and numexpr has been evaluated. The latter
-    #  gives a big gain (~40%) if used for the fitness function. No other
-    #  gain is obtained by using it anywhere else
+    # Unbinned events, i.e., one event in each cell
 
-    # Set numexpr precision to low (more than enough for us), which is
-    # faster than high
-    oldaccuracy = numexpr.set_vml_accuracy_mode('low')
-    numexpr.set_num_threads(1)
-    numexpr.set_vml_num_threads(1)
+    best, last, _ = _optimal_blocks(edges, np.ones(N), np.zeros(N) + prior)
 
-    # Speed tricks: resolve once for all the functions which will be used
-    # in the loop
-    numexpr_evaluate = numexpr.evaluate
-    numexpr_re_evaluate = numexpr.re_evaluate
+    logger.debug("Done\n")
 
-    # Pre-compute this
+    # Now peel off and find the blocks (see the algorithm in Scargle et al.)
 
-    aranges = np.arange(N+1, 0, -1)
+    change_points = _get_change_points(last)
 
-    for R in range(N):
-        br = block_length[R + 1]
-        T_k = block_length[:R + 1] - br  # this looks like it is not used, but it actually is,
-                                         # inside the numexpr expression
+    edg = edges[change_points]
 
-        # N_k: number of elements in each block
-        # This expression has been simplified for the case of
-        # unbinned events (i.e., one element in each block)
-        # It was:
-        #N_k = cumsum(x[:R + 1][::-1])[::-1]
-        # Now it is:
-        N_k = aranges[N - R:]
-        # where aranges has been pre-computed
+    # Transform the found edges back into the original time system
 
-        # Evaluate fitness function
-        # This is the slowest part, which I'm speeding up by using
-        # numexpr. It provides a ~40% gain in execution speed.
+    if (bkg_integral_distribution is not None):
 
-        # The first time we need to "compile" the expression in numexpr,
-        # all the other times we can reuse it
+        final_edges = map(lambda x: lookup_table[x], edg)
 
-        if R == 0:
+    else:
 
-            fit_vec = numexpr_evaluate('''N_k * log(N_k/ T_k) ''',
-                                       optimization='aggressive', local_dict={'N_k': N_k, 'T_k': T_k})
+        final_edges = edg
 
-        else:
+    # Now fix the first and last edge so that they are tstart and tstop
+    final_edges[0] = ttstart
+    final_edges[-1] = ttstop
 
-            fit_vec = numexpr_re_evaluate(local_dict={'N_k': N_k, 'T_k': T_k})
+    return np.asarray(final_edges)
 
-        A_R = fit_vec - prior  # type: np.ndarray
 
-        A_R[1:] += best[:R]
+def bayesian_blocks_binned(edges, counts, p0):
+    """
+    Divide binned data in blocks of perceptibly constant count rate. The edges of the blocks are a subset of the
+    edges of the bins.
 
-        i_max = A_R.argmax()
+    :param edges: the edges of the bins (one more than the counts)
+    :param counts: the number of events in each bin
+    :param p0: the false positive probability. This is used to decide the penalization on the likelihood, so this
+    parameter affects the number of blocks
+    :return: the np.array containing the edges of the blocks
+    """
 
-        last[R] = i_max
-        best[R] = A_R[i_max]
+    edges = np.asarray(edges, dtype=float)
+    counts = np.asarray(counts, dtype=float)
 
-    numexpr.set_vml_accuracy_mode(oldaccuracy)
+    assert edges.ndim == 1 and edges.shape[0] == counts.shape[0] + 1, "There must be one more edge than counts"
 
-    logger.debug("Done\n")
+    if np.any(np.diff(edges) <= 0):
 
-    # Now peel off and find the blocks (see the algorithm in Scargle et al.)
-    change_points = np.zeros(N, dtype=int)
-    i_cp = N
-    ind = N
+        raise RuntimeError("The edges of the bins must be increasing")
 
-    while True:
+    N = counts.shape[0]
 
-        i_cp -= 1
+    priors = np.zeros(N) + _get_prior(p0, N)
 
-        change_points[i_cp] = ind
+    best, last, _ = _optimal_blocks(edges, counts, priors)
 
-        if ind == 0:
+    return edges[_get_change_points(last)]
 
-            break
 
-        ind = last[ind - 1]
+class IncrementalBayesianBlocks(object):
 
-    change_points = change_points[i_cp:]
+    def __init__(self, p0, n_events_for_prior):
+        """
+        Bayesian Blocks on a series of events which grows with time. New events can be appended with add_events, and
+        the segmentation is extended without processing again the events already seen.
 
-    edg = edges[change_points]
+        The prior on the number of blocks depends on the number of events (eq. 21 of Scargle 2012), which is not
+        known in advance, so it is computed once from n_events_for_prior. The result is the same as running
+        bayesian_blocks with that number of events on all the events at once.
 
-    # Transform the found edges back into the original time system
+        :param p0: the false positive probability
+        :param n_events_for_prior: the (expected) number of events used to compute the prior
+        """
 
-    if (bkg_integral_distribution is not None):
+        self._prior = _get_prior(p0, n_events_for_prior)
 
-        final_edges = map(lambda x: lookup_table[x], edg)
+        self._times = np.zeros(0, dtype=float)
 
-    else:
+        # State of the dynamic program, for all the cells except the last one (whose edge changes when new events
+        # are added)
 
-        final_edges = edg
+        self._best = None
+        self._last = None
+        self._candidates = None
 
-    # Now fix the first and last edge so that they are tstart and tstop
-    final_edges[0] = ttstart
-    final_edges[-1] = ttstop
+    @property
+    def n_events(self):
 
-    return np.asarray(final_edges)
+        return self._times.shape[0]
+
+    def add_events(self, new_times):
+        """
+        Append new events, which must be time ordered and after the events already added
+
+        :param new_times: arrival times of the new events
+        :return: none
+        """
+
+        new_times = np.asarray(new_times, dtype=float)
+
+        assert new_times.ndim == 1
+
+        if new_times.shape[0] == 0:
+
+            return
+
+        times = np.concatenate((self._times, new_times))
+
+        if np.any(np.diff(times) <= 0):
+
+            raise RuntimeError("Events appears to be out of order! Check for order, or duplicated events.")
+
+        self._times = times
+
+        if self.n_events < 2:
+
+            return
+
+        # Process all the cells but the last one, whose right edge will change when new events are added
+
+        edges = self._get_cell_edges()
+
+        N = self.n_events - 1
+
+        self._best, self._last, self._candidates = _optimal_blocks(edges[:N + 1], np.ones(N),
+                                                                   np.zeros(N) + self._prior,
+                                                                   self._best, self._last, self._candidates)
+
+    def _get_cell_edges(self):
+
+        # Voronoi tessellation
+
+        return np.concatenate([[self._times[0]],
+                               0.5 * (self._times[1:] + self._times[:-1]),
+                               [self._times[-1]]])
+
+    def get_edges(self, tstart=None, tstop=None):
+        """
+        Return the edges of the blocks for all the events added so far
+
+        :param tstart: the start of the first block (default: the first event)
+        :param tstop: the stop of the last block (default: the last event)
+        :return: the np.array containing the edges of the blocks
+        """
+
+        assert self.n_events > 0, "No events have been added"
+
+        edges = self._get_cell_edges()
+
+        N = self.n_events
+
+        if N > 1:
+
+            # Complete the dynamic program with the last cell
+
+            _, last, _ = _optimal_blocks(edges, np.ones(N), np.zeros(N) + self._prior,
+                                         self._best.copy(), self._last.copy(), self._candidates.copy())
+
+        else:
+
+            last = np.zeros(1, dtype=int)
+
+        final_edges = edges[_get_change_points(last)]
+
+        final_edges[0] = self._times[0] if tstart is None else tstart
+        final_edges[-1] = self._times[-1] if tstop is None else tstop
 
+        return final_edges
 
 # To be run with a profiler
 if __name__ == "__main__":
@@ -173,6 +173,26 @@ class Rebinner(object):
 
         return rebinned_vectors
 
+    def rebin_columns(self, matrix):
+        """
+        Rebin each column of a 2d array (original number of bins x n) by summing the rows belonging to each new bin.
+        This is equivalent to calling rebin on each column, but everything is done at once
+
+        :param matrix: 2d array with one row per original (not-rebinned) bin
+        :return: 2d array with one row per new bin
+        """
+
+        matrix = np.asarray(matrix)
+
+        assert matrix.shape[0] == len(self._mask), "The matrix to rebin must have the same number of rows as the " \
+                                                   "number of elements of the original (not-rebinned) vector"
+
+        cumulative = np.zeros((matrix.shape[0] + 1,) + matrix.shape[1:])
+
+        np.cumsum(matrix, axis=0, out=cumulative[1:])
+
+        return cumulative[self._stops] - cumulative[self._starts]
+
     def rebin_errors(self, *vectors):
         """
         Rebin errors by summing the squares
@@ -265,209 +285,91 @@ class TemporalBinner(TimeIntervalSet):
         method. If a background error function is given then it is assumed that the error distribution
         is gaussian. Otherwise, the error distribution is assumed to be Poisson.
 
-        :param background_getter: function of a start and stop time that returns background counts
-        :param background_error_getter: function of a start and stop time that returns background count errors
+        Each bin starts at the stop of the previous one, and stops at the first event for which the counts
+        accumulated since the start of the bin (including both the first and the last event) reach the requested
+        significance. The candidate stops are tested in blocks of growing size, so that the background functions
+        are called with arrays of stop times, and the binning runs in a time roughly linear in the number of events.
+
+        :param arrival_times: the sorted arrival times of the events
+        :param background_getter: function of a start time and an array of stop times that returns the
+        background counts in each interval
+        :param background_error_getter: function of a start time and an array of stop times that returns the
+        background count errors in each interval
         :param sigma_level: the sigma level of the intervals
         :param min_counts: the minimum counts per bin
 
         :return:
         """
 
+        arrival_times = np.asarray(arrival_times)
 
-
-        if tstart is None:
-
-            tstart = arrival_times.min()
-
-        else:
-
-            tstart = float(tstart)
-
-        if tstop is None:
-
-            tstop = arrival_times.max()
-
-        else:
-
-            tstop = float(tstop)
+        n_events = arrival_times.shape[0]
 
         starts = []
 
         stops = []
 
-        # Switching to a fast search
-        # Idea inspired by Damien Begue
-
-        # these factors change the time steps
-        # in the fast search. should experiment
-        if sigma_level > 25:
-
-            increase_factor = 0.5
-            decrease_factor = 0.5
-
-        else:
-
-            increase_factor = 0.25
-            decrease_factor = 0.25
-
-        current_start = arrival_times[0]
-
-        # first we need to see if the interval provided has enough counts
-
-        _, counts = TemporalBinner._select_events(arrival_times,current_start, arrival_times[-1])
-
-        # if it does not, the flag for the big loop never gets set
-        end_all_search = not TemporalBinner._check_exceeds_sigma_interval(current_start,
-                                                                arrival_times[-1],
-                                                                counts,
-                                                                sigma_level,
-                                                                background_getter,
-                                                                background_error_getter)
-
-        # We will start the search at the mid point of the whole interval
-
-        mid_point = 0.5 * (arrival_times[-1] + current_start)
-
-        current_stop = mid_point
-
-        # initialize the fast search flag
-
-        end_fast_search = False
-
-        # resolve once for functions used in the loop
-        searchsorted = np.searchsorted
-
-        # this is the main loop
-        # as long as we have not reached the end of the interval
-        # the loop will run
-        with progress_bar(arrival_times.shape[0]) as pbar:
-            while (not end_all_search):
-
-                # start of the fast search
-                # we reset the flag for the interval
-                # having been decreased in the last pass
-                decreased_interval = False
+        # index of the event which starts the current bin
 
-                while (not end_fast_search):
+        start_idx = 0
 
-                    # we calculate the sigma of the current region
-                    _, counts = TemporalBinner._select_events(arrival_times,current_start, current_stop)
+        # number of candidate stops to test in the first block of each search. We start from the
+        # minimum number of counts, and then use the size of the last bin found as a guess for the next one
 
-                    sigma_exceeded = TemporalBinner._check_exceeds_sigma_interval(current_start,
-                                                                        current_stop,
-                                                                        counts,
-                                                                        sigma_level,
-                                                                        background_getter,
-                                                                        background_error_getter)
+        block_size = max(int(min_counts), 16)
 
-                    time_step = abs(current_stop - current_start)
+        with progress_bar(n_events) as pbar:
 
-                    # if we do not exceed the sigma
-                    # we need to increase the time interval
-                    if not sigma_exceeded:
+            while start_idx < n_events - 1:
 
-                        # however, if in the last pass we had to decrease
-                        # the interval, it means we have found where we
-                        # we need to start the slow search
-                        if decreased_interval:
+                current_start = arrival_times[start_idx]
 
-                            # mark where we are in the list
-                            start_idx = searchsorted(arrival_times, current_stop)
+                # the first candidate stop must contain at least min_counts events (the start event included)
 
-                            # end the fast search
-                            end_fast_search = True
+                first_candidate = max(start_idx + 1, start_idx + int(min_counts) - 1)
 
-                        # otherwise we increase the interval
-                        else:
+                stop_idx = None
 
-                            # unless, we would increase it too far
-                            if (current_stop + time_step * increase_factor) >= arrival_times[-1]:
+                this_block_size = block_size
 
-                                # mark where we are in the interval
-                                start_idx = searchsorted(arrival_times, current_stop)
+                while first_candidate < n_events:
 
-                                # then we also want to go ahead and get out of the fast search
-                                end_fast_search = True
+                    candidates = np.arange(first_candidate, min(first_candidate + this_block_size, n_events))
 
-                            else:
+                    sigma = TemporalBinner._get_significances(current_start,
+                                                              arrival_times[candidates],
+                                                              candidates - start_idx + 1,
+                                                              background_getter,
+                                                              background_error_getter)
 
-                                # increase the interval
-                                current_stop += time_step * increase_factor
+                    exceeding = np.flatnonzero(sigma >= sigma_level)
 
-                    # if we did exceede the sigma level we will need to step
-                    # back in time to find where it was NOT exceeded
-                    else:
+                    if exceeding.shape[0] > 0:
 
-                        # decrease the interval
-                        current_stop -= time_step * decrease_factor
+                        stop_idx = candidates[exceeding[0]]
 
-                        # inform the loop that we have been back stepping
-                        decreased_interval = True
+                        break
 
-                # Now we are ready for the slow forward search
-                # where we count up all the photons
+                    first_candidate = candidates[-1] + 1
 
-                # we have already counted up the photons to this point
-                total_counts = counts
+                    this_block_size *= 2
 
-                # start searching from where the fast search ended
-                pbar.increase(counts)
-
-                for time in arrival_times[start_idx:]:
-
-                    total_counts += 1
-                    pbar.increase()
-                    if total_counts < min_counts:
-
-                        continue
-
-                    else:
-
-                        # first use the background function to know the number of background counts
-                        bkg = background_getter(current_start, time)
-
-                        sig = Significance(total_counts, bkg)
-
-                        if background_error_getter is not None:
-
-                            bkg_error = background_error_getter(current_start, time)
-
-                            sigma = sig.li_and_ma_equivalent_for_gaussian_background(bkg_error)[0]
-
-
-                        else:
-
-                            sigma = sig.li_and_ma()[0]
-
-                            # now test if we have enough sigma
-
-                        if sigma >= sigma_level:
-
-                            # if we succeeded we want to mark the time bins
-                            stops.append(time)
-
-                            starts.append(current_start)
-
-                            # set up the next fast search
-                            # by looking past this interval
-                            current_start = time
-
-                            current_stop = 0.5 * (arrival_times[-1] + time)
+                # if we never exceeded the sigma level by the
+                # end of the events, we never will
 
-                            end_fast_search = False
+                if stop_idx is None:
 
-                            # get out of the for loop
-                            break
+                    break
 
-                # if we never exceeded the sigma level by the
-                # end of the search, we never will
-                if end_fast_search:
+                starts.append(current_start)
 
-                    # so lets kill the main search
-                    end_all_search = True
+                stops.append(arrival_times[stop_idx])
 
+                pbar.increase(stop_idx - start_idx)
 
+                block_size = max(2 * (stop_idx - start_idx), 16)
 
+                start_idx = stop_idx
 
         if not starts:
 
@@ -554,62 +456,37 @@ class TemporalBinner(TimeIntervalSet):
         return cls.from_starts_and_stops(starts, stops)
 
     @staticmethod
-    def _check_exceeds_sigma_interval(start, stop, counts, sigma_level, background_getter,
-                                      background_error_getter=None):
+    def _get_significances(start, stops, counts, background_getter, background_error_getter=None):
 
         """
 
-        see if an interval exceeds a given sigma level
+        compute the significance of the counts in the intervals between start and each of the stops
 
 
-        :param start:
-        :param stop:
-        :param counts:
-        :param sigma_level:
+        :param start: the start of the intervals
+        :param stops: array of stops of the intervals
+        :param counts: array of counts in each interval
         :param background_getter:
         :param background_error_getter:
-        :return:
+        :return: array of significances (nan for the intervals where it is not defined)
         """
 
-        bkg = background_getter(start, stop)
+        bkg = background_getter(start, stops)
 
         sig = Significance(counts, bkg)
 
-        if background_error_getter is not None:
-
-            bkg_error = background_error_getter(start, stop)
-
-            sigma = sig.li_and_ma_equivalent_for_gaussian_background(bkg_error)[0]
-
-
-        else:
-
-            sigma = sig.li_and_ma()[0]
+        # intervals of zero length have zero background, for which the significance is not defined
 
-        # now test if we have enough sigma
+        with np.errstate(divide='ignore', invalid='ignore'):
 
-        if sigma >= sigma_level:
+            if background_error_getter is not None:
 
-            return True
+                bkg_error = background_error_getter(start, stops)
 
-        else:
-
-            return False
-
-    @staticmethod
-    def _select_events(arrival_times, start, stop ):
-        """
-        get the events and total counts over an interval
+                sigma = sig.li_and_ma_equivalent_for_gaussian_background(bkg_error)
 
-        :param start:
-        :param stop:
-        :param events:
-        :return:
-        """
-
-        lt_idx = start <= arrival_times
-        gt_idx = arrival_times <= stop
+            else:
 
-        idx = np.logical_and(lt_idx, gt_idx)
+                sigma = sig.li_and_ma()
 
-        return idx, arrival_times[idx].shape[0]
+        return sigma
@@ -7,53 +7,68 @@ import re
 import requests
 import warnings
 
+from threeML.io.data_cache import get_data_cache
+from threeML.io.fits_file import read_column, get_rows_in_range
 from threeML.utils.fermi_relative_mission_time import compute_fermi_relative_mission_times
 from threeML.utils.spectrum.pha_spectrum import PHASpectrumSet
 
 
 class GBMTTEFile(object):
-    def __init__(self, ttefile):
+    def __init__(self, ttefile, trigger_time=None, time_window=None, memmap=True):
         """
 
         A simple class for opening and easily accessing Fermi GBM
         TTE Files.
 
+        With memmap=True the file is memory mapped, so that only the events within the time window are read from
+        disk (this has no effect on compressed files, which are always read entirely). If the data cache is active
+        (see the 'data cache' section of the configuration), the decoded events are kept on disk and read from
+        there the next time the same file is opened with the same parameters.
+
         :param ttefile: The filename of the TTE file to be stored
+        :param trigger_time: trigger time in MET (default: the one in the file)
+        :param time_window: (start, stop) relative to the trigger time. If given, only the events within this window
+        are loaded
+        :param memmap: whether to memory map the file (default: True)
 
         """
 
-        tte = fits.open(ttefile)
+        data_cache = get_data_cache()
 
-        self._events = tte['EVENTS'].data['TIME']
-        self._pha = tte['EVENTS'].data['PHA']
+        cache_parameters = {'trigger_time': trigger_time, 'time_window': time_window}
 
-        # the GBM TTE data are not always sorted in TIME.
-        # we will now do this for you. We should at some
-        # point check with NASA if this is on purpose.
+        cached = data_cache.get('gbm_tte', ttefile, **cache_parameters) if data_cache is not None else None
 
+        if cached is not None:
 
-        # but first we must check that there are NO duplicated events
-        # and then warn the user
+            arrays, metadata = cached
 
-        if not len(self._events) == len(np.unique(self._events)):
+            self._events = arrays['events']
+            self._pha = arrays['pha']
 
+            for name in self._cached_attributes:
 
-            warnings.warn('The TTE file %s contains duplicate time tags and is thus invalid. Contact the FSSC ' % ttefile)
+                setattr(self, name, metadata[name])
 
-        
-        
-        # sorting in time
-        sort_idx = self._events.argsort()
+        else:
 
+            self._read_file(ttefile, trigger_time, time_window, memmap)
+
+            if data_cache is not None:
+
+                data_cache.put('gbm_tte', ttefile, {'events': self._events, 'pha': self._pha},
+                               dict((name, getattr(self, name)) for name in self._cached_attributes),
+                               **cache_parameters)
+
+    # The attributes (besides the events) stored in the data cache
+
+    _cached_attributes = ('_trigger_time', '_start_events', '_stop_events', '_n_channels', '_utc_start', '_utc_stop',
+                          '_det_name', '_telescope')
+
+    def _read_file(self, ttefile, trigger_time, time_window, memmap):
+
+        tte = fits.open(ttefile, memmap=memmap)
 
-        if not np.alltrue(self._events[sort_idx] == self._events):
-        
-            # now sort both time and energy
-            warnings.warn('The TTE file %s was not sorted in time but contains no duplicate events. We will sort the times, but use caution with this file. Contact the FSSC.')
-            self._events = self._events[sort_idx]
-            self._pha = self._pha[sort_idx]
-        
-        
         try:
             self._trigger_time = tte['PRIMARY'].header['TRIGTIME']
 
@@ -68,16 +83,63 @@ class GBMTTEFile(object):
         self._start_events = tte['PRIMARY'].header['TSTART']
         self._stop_events = tte['PRIMARY'].header['TSTOP']
 
-        self._utc_start = tte['PRIMARY'].header['DATE-OBS']
-        self._utc_stop = tte['PRIMARY'].header['DATE-END']
+        if trigger_time is not None:
+
+            self.trigger_time = trigger_time
 
         self._n_channels = tte['EBOUNDS'].header['NAXIS2']
 
+        # read only the events within the time window, and store the PHA with the smallest type able to hold
+        # all the channels (plus the overflow channel)
+
+        events_hdu = tte['EVENTS']
+
+        if time_window is None:
+
+            rows = slice(None)
+
+        else:
+
+            start, stop = time_window
+
+            rows = get_rows_in_range(events_hdu, 'TIME', self._trigger_time + start, self._trigger_time + stop)
+
+            self._start_events = max(self._start_events, self._trigger_time + start)
+            self._stop_events = min(self._stop_events, self._trigger_time + stop)
+
+        self._events = read_column(events_hdu, 'TIME', rows)
+        self._pha = read_column(events_hdu, 'PHA', rows, dtype=np.min_scalar_type(self._n_channels))
+
+        # the GBM TTE data are not always sorted in TIME.
+        # we will now do this for you. We should at some
+        # point check with NASA if this is on purpose.
+
+        if not np.all(self._events[1:] >= self._events[:-1]):
+
+            # now sort both time and energy
+            warnings.warn('The TTE file %s was not sorted in time. We will sort the times, but use caution with this file. Contact the FSSC.' % ttefile)
+
+            sort_idx = self._events.argsort(kind='mergesort')
+
+            self._events = self._events[sort_idx]
+            self._pha = self._pha[sort_idx]
+
+        # now that the events are sorted, duplicated events are next to each other.
+        # we must check that there are NO duplicated events
+        # and then warn the user
+
+        if np.any(self._events[1:] == self._events[:-1]):
+
+            warnings.warn('The TTE file %s contains duplicate time tags and is thus invalid. Contact the FSSC ' % ttefile)
+
+        self._utc_start = tte['PRIMARY'].header['DATE-OBS']
+        self._utc_stop = tte['PRIMARY'].header['DATE-END']
+
         self._det_name = "%s_%s" % (tte['PRIMARY'].header['INSTRUME'], tte['PRIMARY'].header['DETNAM'])
 
         self._telescope = tte['PRIMARY'].header['TELESCOP']
 
-        self._calculate_deadtime()
+        tte.close()
 
     @property
     def trigger_time(self):
@@ -132,7 +194,10 @@ class GBMTTEFile(object):
 
     @property
     def deadtime(self):
-        return self._deadtime
+        """
+        The dead time of each event. It is computed when requested, and it is not kept in memory
+        """
+        return self._calculate_deadtime()
 
     def _calculate_deadtime(self):
         """
@@ -141,15 +206,14 @@ class GBMTTEFile(object):
         The array can be summed over to obtain the total dead time
 
         """
-        self._deadtime = np.zeros_like(self._events)
+
         overflow_mask = self._pha == self._n_channels  # specific to gbm! should work for CTTE
 
         # From Meegan et al. (2009)
-        # Dead time for overflow (note, overflow sometimes changes)
-        self._deadtime[overflow_mask] = 10.E-6  # s
+        # Dead time for overflow (note, overflow sometimes changes): 10 us
+        # Normal dead time: 2 us
 
-        # Normal dead time
-        self._deadtime[~overflow_mask] = 2.E-6  # s
+        return np.where(overflow_mask, 10.E-6, 2.E-6)  # s
 
     def _compute_mission_times(self):
 
@@ -5,20 +5,27 @@ import astropy.io.fits as fits
 import numpy as np
 import pandas as pd
 
+from threeML.io.fits_file import read_column, get_rows_in_range
 from threeML.utils.fermi_relative_mission_time import compute_fermi_relative_mission_times
 
 
 class LLEFile(object):
-    def __init__(self, lle_file, ft2_file, rsp_file):
+    def __init__(self, lle_file, ft2_file, rsp_file, trigger_time=None, time_window=None, memmap=True):
         """
         Class to read the LLE and FT2 files
 
         Inspired heavily by G. Vianello
 
-
+        With memmap=True the LLE file is memory mapped, so that only the events within the time window are read
+        from disk.
 
         :param lle_file:
         :param ft2_file:
+        :param rsp_file:
+        :param trigger_time: trigger time in MET (default: the one in the file)
+        :param time_window: (start, stop) relative to the trigger time. If given, only the events within this window
+        are loaded
+        :param memmap: whether to memory map the LLE file (default: True)
         """
 
         with fits.open(rsp_file) as rsp_:
@@ -29,12 +36,7 @@ class LLEFile(object):
             self._emax = data.E_MAX
             self._channels = data.CHANNEL
 
-        with fits.open(lle_file) as ft1_:
-
-            data = ft1_['EVENTS'].data
-
-            self._events = data.TIME  # - trigger_time
-            self._energy = data.ENERGY * 1E3  # keV
+        with fits.open(lle_file, memmap=memmap) as ft1_:
 
             self._tstart = ft1_['PRIMARY'].header['TSTART']
             self._tstop = ft1_['PRIMARY'].header['TSTOP']
@@ -42,8 +44,8 @@ class LLEFile(object):
             self._utc_stop = ft1_['PRIMARY'].header['DATE-END']
             self._instrument = ft1_['PRIMARY'].header['INSTRUME']
             self._telescope = ft1_['PRIMARY'].header['TELESCOP'] + "_LLE"
-            self._gti_start = ft1_['GTI'].data['START']
-            self._gti_stop = ft1_['GTI'].data['STOP']
+            self._gti_start = np.array(ft1_['GTI'].data['START'])
+            self._gti_stop = np.array(ft1_['GTI'].data['STOP'])
 
             try:
                 self._trigger_time = ft1_['EVENTS'].header['TRIGTIME']
@@ -57,14 +59,43 @@ class LLEFile(object):
 
                 self._trigger_time = 0
 
+            if trigger_time is not None:
+
+                self.trigger_time = trigger_time
+
+            # read only the events within the time window
+
+            events_hdu = ft1_['EVENTS']
+
+            if time_window is None:
+
+                rows = slice(None)
+
+            else:
+
+                start, stop = time_window
+
+                rows = get_rows_in_range(events_hdu, 'TIME', self._trigger_time + start, self._trigger_time + stop)
+
+                self._tstart = max(self._tstart, self._trigger_time + start)
+                self._tstop = min(self._tstop, self._trigger_time + stop)
+
+            self._events = read_column(events_hdu, 'TIME', rows)  # - trigger_time
+            energy = read_column(events_hdu, 'ENERGY', rows) * 1E3  # keV
+
         # bin the energies into PHA channels
         # and filter out over/underflow
-        self._bin_energies_into_pha()
+        self._bin_energies_into_pha(energy)
 
         # filter events outside of GTIs
 
         self._apply_gti_to_events()
 
+        # keep only the selected events
+
+        self._events = self._events[self._filter_idx]
+        self._pha = self._pha[self._filter_idx]
+
         with fits.open(ft2_file) as ft2_:
 
             ft2_tstart = ft2_['SC_DATA'].data.field("START")  # - trigger_time
@@ -185,17 +216,18 @@ class LLEFile(object):
 
 
 
-    def _bin_energies_into_pha(self):
+    def _bin_energies_into_pha(self, energy):
         """
 
-        bins the LLE data into PHA channels
+        bins the LLE data into PHA channels, stored with the smallest type able to hold all of them
 
+        :param energy: the energy of the events in keV
         :return:
         """
 
         edges = np.append(self._emin, self._emax[-1])
 
-        self._pha = np.digitize(self._energy, edges)
+        self._pha = np.digitize(energy, edges).astype(np.min_scalar_type(edges.shape[0]))
 
 
         # There are some events outside of the energy bounds. We will dump those
@@ -236,7 +268,7 @@ class LLEFile(object):
         The GTI/energy filtered arrival times in MET
         :return:
         """
-        return self._events[self._filter_idx]
+        return self._events
 
     @property
     def energies(self):
@@ -244,7 +276,7 @@ class LLEFile(object):
         The GTI/energy filtered pha energies
         :return:
         """
-        return self._pha[self._filter_idx]
+        return self._pha
 
     @property
     def n_channels(self):
@@ -613,14 +613,6 @@ class TimeSeriesBuilder(object):
 
             assert self._time_series.bins is not None, 'This time series does not have any bins!'
 
-            # save the original interval if there is one
-            old_interval = copy.copy(self._active_interval)
-            old_verbose = copy.copy(self._verbose)
-
-            # we will keep it quiet to keep from being annoying
-
-            self._verbose = False
-
             list_of_speclikes = []
 
             # get the bins from the time series
@@ -638,51 +630,42 @@ class TimeSeriesBuilder(object):
 
                 these_bins = these_bins.containing_interval(start, stop, inner=False)
 
+            # extract the spectra of all the intervals at once. This does not change the active interval
 
+            observed_spectra, background_spectra = self._get_spectra_from_bins(these_bins,
+                                                                               extract_measured_background)
 
-           # loop through the intervals and create spec likes
+            if not self._time_series.poly_fit_exists:
+                custom_warnings.warn(
+                    'No bakckground selection has been made. These plugins will contain no background!')
+
+           # loop through the intervals and create spec likes. We keep them quiet to keep from being annoying
 
             with progress_bar(len(these_bins), title='Creating plugins') as p:
 
                 for i, interval in enumerate(these_bins):
 
-
-                    self.set_active_time_interval(interval.to_string())
-
-                    assert isinstance(self._observed_spectrum, BinnedSpectrum), 'You are attempting to create a SpectrumLike plugin from the wrong data type'
-
-                    if extract_measured_background:
-
-                        this_background_spectrum = self._measured_background_spectrum
-
-                    else:
-
-                        this_background_spectrum = self._background_spectrum
-
-
-                    if this_background_spectrum is None:
-                        custom_warnings.warn(
-                            'No bakckground selection has been made. This plugin will contain no background!')
+                    assert isinstance(observed_spectra[i], BinnedSpectrum), 'You are attempting to create a SpectrumLike plugin from the wrong data type'
 
                     try:
 
                         if self._response is None:
 
                             sl = SpectrumLike(name="%s%s%d" % (self._name, interval_name, i),
-                                              observation=self._observed_spectrum,
-                                              background=this_background_spectrum,
-                                              verbose=self._verbose,
-                                              tstart=self._tstart,
-                                              tstop=self._tstop)
+                                              observation=observed_spectra[i],
+                                              background=background_spectra[i],
+                                              verbose=False,
+                                              tstart=interval.start_time,
+                                              tstop=interval.stop_time)
 
                         else:
 
                             sl = DispersionSpectrumLike(name="%s%s%d" % (self._name, interval_name, i),
-                                                        observation=self._observed_spectrum,
-                                                        background=this_background_spectrum,
-                                                        verbose=self._verbose,
-                                                        tstart=self._tstart,
-                                                        tstop=self._tstop)
+                                                        observation=observed_spectra[i],
+                                                        background=background_spectra[i],
+                                                        verbose=False,
+                                                        tstart=interval.start_time,
+                                                        tstop=interval.stop_time)
 
                         list_of_speclikes.append(sl)
 
@@ -692,24 +675,63 @@ class TimeSeriesBuilder(object):
 
                     p.increase()
 
-            # restore the old interval
+            return list_of_speclikes
 
-            if old_interval is not None:
+    def _get_spectra_from_bins(self, bins, extract_measured_background=False):
+        """
+        Extract the observed and background spectra of each of the provided bins, as set_active_time_interval
+        would do for each of them. The counts, exposures and background integrals of all the bins are computed at
+        once by the time series, and the active time interval is not changed.
 
-               self.set_active_time_interval(*old_interval)
+        :param bins: a TimeIntervalSet
+        :param extract_measured_background: Use the selected background rather than a polynomial fit to the background
+        :return: (list of observed spectra, list of background spectra). The background spectra are None if there
+        is no background fit
+        """
+
+        starts = np.array(bins.start_times, dtype=float)
+        stops = np.array(bins.stop_times, dtype=float)
+
+        # get the response of each bin
+
+        if self._rsp_is_weighted:
+
+            responses = [self._weighted_rsp.weight_by_counts(interval.to_string()) for interval in bins]
+
+        else:
+
+            responses = [self._response] * len(bins)
+
+        observed_info = self._time_series.get_information_dicts(starts, stops)
+
+        observed_spectra = [self._container_type.from_information_dict(info, response=response, use_poly=False)
+                            for info, response in zip(observed_info, responses)]
+
+        if self._time_series.poly_fit_exists:
+
+            if extract_measured_background:
+
+                background_info = self._time_series.get_information_dicts(starts, stops, extract=True)
 
             else:
 
-               self._active_interval = None
+                background_info = self._time_series.get_information_dicts(starts, stops, use_poly=True)
 
-            self._verbose = old_verbose
+            background_spectra = [self._container_type.from_information_dict(info,
+                                                                              response=response,
+                                                                              use_poly=not extract_measured_background)
+                                  for info, response in zip(background_info, responses)]
 
-            return list_of_speclikes
+        else:
+
+            background_spectra = [None] * len(bins)
+
+        return observed_spectra, background_spectra
 
     @classmethod
     def from_gbm_tte(cls, name, tte_file, rsp_file, restore_background=None,
                      trigger_time=None,
-                     poly_order=-1, unbinned=True, verbose=True):
+                     poly_order=-1, unbinned=True, verbose=True, time_window=None, memmap=True):
         """
            A plugin to natively bin, view, and handle Fermi GBM TTE data.
            A TTE event file are required as well as the associated response
@@ -731,6 +753,9 @@ class TimeSeriesBuilder(object):
            :param poly_order: 0-4 or -1 for auto
            :param unbinned: unbinned likelihood fit (bool)
            :param verbose: verbose (bool)
+           :param time_window: (start, stop) relative to the trigger time. If given, only the events within this
+           window are loaded
+           :param memmap: memory map the TTE file, so that only the needed events are read from disk (bool)
 
 
 
@@ -738,14 +763,9 @@ class TimeSeriesBuilder(object):
 
         # self._default_unbinned = unbinned
 
-        # Load the relevant information from the TTE file
-
-        gbm_tte_file = GBMTTEFile(tte_file)
-
-        # Set a trigger time if one has not been set
+        # Load the relevant information from the TTE file, setting a trigger time if one has been given
 
-        if trigger_time is not None:
-            gbm_tte_file.trigger_time = trigger_time
+        gbm_tte_file = GBMTTEFile(tte_file, trigger_time=trigger_time, time_window=time_window, memmap=memmap)
 
         # Create the the event list
 
@@ -761,6 +781,10 @@ class TimeSeriesBuilder(object):
                                            verbose=verbose,
                                                                                       )
 
+        # so that the background fits can be kept in the data cache
+
+        event_list.set_data_cache_source(tte_file, trigger_time=trigger_time, time_window=time_window)
+
         if isinstance(rsp_file, str) or isinstance(rsp_file, unicode):
 
             # we need to see if this is an RSP2
@@ -868,6 +892,10 @@ class TimeSeriesBuilder(object):
                                           instrument=cdata.det_name,
                                           verbose=verbose)
 
+        # so that the background fits can be kept in the data cache
+
+        event_list.set_data_cache_source(cspec_or_ctime_file, trigger_time=trigger_time)
+
         # we need to see if this is an RSP2
 
 
@@ -927,7 +955,7 @@ class TimeSeriesBuilder(object):
 
     @classmethod
     def from_lat_lle(cls, name, lle_file, ft2_file, rsp_file, restore_background=None,
-                     trigger_time=None, poly_order=-1, unbinned=False, verbose=True):
+                     trigger_time=None, poly_order=-1, unbinned=False, verbose=True, time_window=None, memmap=True):
 
         """
                A plugin to natively bin, view, and handle Fermi LAT LLE data.
@@ -951,14 +979,15 @@ class TimeSeriesBuilder(object):
                :param poly_order: 0-4 or -1 for auto
                :param unbinned: unbinned likelihood fit (bool)
                :param verbose: verbose (bool)
+               :param time_window: (start, stop) relative to the trigger time. If given, only the events within
+               this window are loaded
+               :param memmap: memory map the LLE file, so that only the needed events are read from disk (bool)
 
 
                """
 
-        lat_lle_file = LLEFile(lle_file, ft2_file, rsp_file)
-
-        if trigger_time is not None:
-            lat_lle_file.trigger_time = trigger_time
+        lat_lle_file = LLEFile(lle_file, ft2_file, rsp_file, trigger_time=trigger_time, time_window=time_window,
+                               memmap=memmap)
 
         # Mark channels less than 50 MeV as bad
 
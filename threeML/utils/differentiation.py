@@ -122,7 +122,23 @@ def get_jacobian(function, point, minima, maxima):
     return jacobian_vector[0]
 
 
-def get_hessian(function, point, minima, maxima):
+def get_hessian(function, point, minima, maxima, gradient=None):
+    """
+    Compute the Hessian matrix of the function at the provided point. If the gradient of the function is provided,
+    the Hessian is computed as the Jacobian of the gradient, which needs O(N) evaluations of the gradient instead of
+    the O(N^2) evaluations of the function needed otherwise
+
+    :param function: the function
+    :param point: the point where to compute the Hessian
+    :param minima: minimum values for the coordinates
+    :param maxima: maximum values for the coordinates
+    :param gradient: (optional) a function with the same calling sequence of function returning its gradient
+    :return: the Hessian matrix
+    """
+
+    if gradient is not None:
+
+        return _get_hessian_from_gradient(function, gradient, point, minima, maxima)
 
     wrapper, scaled_deltas, scaled_point, orders_of_magnitude, n_dim = _get_wrapper(function, point, minima, maxima)
 
@@ -141,4 +157,96 @@ def get_hessian(function, point, minima, maxima):
 
             hessian_matrix[i,j] /= orders_of_magnitude[i] * orders_of_magnitude[j]
 
-    return hessian_matrix
\ No newline at end of file
+    return hessian_matrix
+
+def _get_hessian_from_gradient(function, gradient, point, minima, maxima):
+
+    # We use the same scaling and deltas used for the Hessian of the function, but we differentiate the gradient
+
+    _, scaled_deltas, scaled_point, orders_of_magnitude, n_dim = _get_wrapper(function, point, minima, maxima)
+
+    def gradient_wrapper(x):
+
+        scaled_back_x = x * orders_of_magnitude  # type: np.ndarray
+
+        try:
+
+            result = np.array(gradient(*scaled_back_x), dtype=float)
+
+        except SettingOutOfBounds:
+
+            raise CannotComputeHessian("Cannot compute Hessian, parameters out of bounds at %s" % scaled_back_x)
+
+        else:
+
+            # Gradient with respect to the scaled coordinates
+
+            return result * orders_of_magnitude
+
+    hessian_matrix = np.array(nd.Jacobian(gradient_wrapper, scaled_deltas, method='central')(scaled_point))
+
+    hessian_matrix = hessian_matrix.reshape((n_dim, n_dim))
+
+    # Now correct back the Hessian for the scales
+
+    hessian_matrix /= np.outer(orders_of_magnitude, orders_of_magnitude)
+
+    # The Jacobian of the gradient is symmetric only up to numerical noise
+
+    return 0.5 * (hessian_matrix + hessian_matrix.T)
+
+
+def get_parameter_derivatives(function, parameters, relative_step=1e-5):
+    """
+    Compute with central finite differences the derivatives of a function, which takes no arguments and depends on the
+    current values of the provided parameters (for example the flux of a source in the likelihood model), with respect
+    to the internal value of each parameter (i.e., in the same reference used by the minimizers). The parameters
+    are restored to their original values at the end.
+
+    If a step would bring a parameter beyond its boundaries, a one-sided difference is used instead.
+
+    :param function: a function with no arguments returning a number or an array
+    :param parameters: list of astromodels Parameter instances
+    :param relative_step: step for the finite differences, relative to the value of the parameter (default: 1e-5)
+    :return: array with the shape of the output of function plus one last axis with one element per parameter
+    """
+
+    derivatives = []
+
+    for parameter in parameters:
+
+        value = parameter._get_internal_value()
+
+        step = relative_step * max(abs(value), 1.0)
+
+        low_value = value - step
+        high_value = value + step
+
+        min_value = parameter._get_internal_min_value()
+        max_value = parameter._get_internal_max_value()
+
+        if min_value is not None and low_value < min_value:
+
+            low_value = value
+
+        if max_value is not None and high_value > max_value:
+
+            high_value = value
+
+        try:
+
+            parameter._set_internal_value(high_value)
+
+            high_result = np.array(function(), dtype=float)
+
+            parameter._set_internal_value(low_value)
+
+            low_result = np.array(function(), dtype=float)
+
+        finally:
+
+            parameter._set_internal_value(value)
+
+        derivatives.append((high_result - low_result) / (high_value - low_value))
+
+    return np.stack(derivatives, axis=-1)
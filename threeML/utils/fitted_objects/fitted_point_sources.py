@@ -6,6 +6,8 @@ import scipy.integrate as integrate
 import collections
 
 
+from threeML.config.config import threeML_config
+from threeML.exceptions.custom_exceptions import custom_warnings
 from threeML.utils.fitted_objects.fitted_source_handler import GenericFittedSourceHandler
 
 
@@ -148,6 +150,171 @@ class DifferentialFluxConversion(FluxConversion):
                                                          flux_model)
 
 
+# Nodes and weights of the Gauss-Legendre quadrature, for each number of points
+
+_gauss_legendre_cache = {}
+
+
+class IntegralOfFunction(object):
+
+    # Maximum number of times the number of points of the fixed grid is doubled when the accuracy check fails
+
+    _max_refinements = 3
+
+    def __init__(self, integrand):
+        """
+        Computes the integral of a function between e1 and e2, for arrays of parameters (for example, all the samples
+        of a posterior at once). The method is chosen in the 'point source flux' section of the configuration:
+
+        - 'gauss-legendre': Gauss-Legendre quadrature on a fixed grid, uniform in log(energy) (or in energy if the
+          lower bound is not positive), which evaluates the function once for all the parameters. Optionally, the
+          result of the first call is checked against scipy.integrate.quad on the first and last set of parameters.
+          If the check fails, the number of points is doubled (up to 3 times), and if it still fails quad is used
+        - 'quad': scipy.integrate.quad, once for each set of parameters
+
+        :param integrand: a function f(x, **parameters)
+        """
+
+        self._integrand = integrand
+
+        self._n_points = None
+
+        self._use_quad = False
+
+        self._checked = False
+
+    def __call__(self, e1, e2, **param_specification):
+
+        config = threeML_config['point source flux']
+
+        if config['integration method'] == 'quad' or self._use_quad:
+
+            return self._quad_integral(e1, e2, param_specification)
+
+        assert config['integration method'] == 'gauss-legendre', "Integration method must be 'gauss-legendre' or " \
+                                                                  "'quad'"
+
+        if self._n_points is None:
+
+            self._n_points = int(config['integration points'])
+
+        result = self._fixed_grid_integral(e1, e2, param_specification, self._n_points)
+
+        if self._checked or not config['check accuracy']:
+
+            return result
+
+        for i in range(self._max_refinements + 1):
+
+            if self._is_accurate(result, e1, e2, param_specification, config['check tolerance']):
+
+                self._checked = True
+
+                return result
+
+            if i < self._max_refinements:
+
+                self._n_points *= 2
+
+                result = self._fixed_grid_integral(e1, e2, param_specification, self._n_points)
+
+        custom_warnings.warn("The integral of the flux on a fixed grid of %i points does not reach the required "
+                             "accuracy. Using scipy.integrate.quad instead (slower)." % self._n_points)
+
+        self._use_quad = True
+
+        return self._quad_integral(e1, e2, param_specification)
+
+    @staticmethod
+    def _get_nodes_and_weights(n_points):
+
+        if n_points not in _gauss_legendre_cache:
+
+            _gauss_legendre_cache[n_points] = np.polynomial.legendre.leggauss(n_points)
+
+        return _gauss_legendre_cache[n_points]
+
+    def _fixed_grid_integral(self, e1, e2, param_specification, n_points):
+
+        nodes, weights = self._get_nodes_and_weights(n_points)
+
+        e1 = np.asarray(e1, float)[..., np.newaxis]
+        e2 = np.asarray(e2, float)[..., np.newaxis]
+
+        # The parameters get an extra dimension as well, which will be the one of the points of the grid
+
+        parameters = dict((name, np.asarray(value)[..., np.newaxis])
+                          for name, value in param_specification.items())
+
+        if np.all(e1 > 0):
+
+            # Uniform grid in log(energy), so that steep spectra are well sampled: dE = E dlog(E)
+
+            half_width = (np.log(e2) - np.log(e1)) / 2.0
+
+            energies = np.exp(np.log(e1) + half_width * (nodes + 1))
+
+            jacobian = energies * half_width
+
+        else:
+
+            half_width = (e2 - e1) / 2.0
+
+            energies = e1 + half_width * (nodes + 1)
+
+            jacobian = half_width
+
+        values = self._integrand(energies, **parameters)
+
+        return np.sum(values * jacobian * weights, axis=-1)
+
+    def _quad_integral(self, e1, e2, param_specification):
+
+        names = param_specification.keys()
+
+        broadcasted = np.broadcast_arrays(np.asarray(e1, float), np.asarray(e2, float),
+                                          *[np.asarray(param_specification[name]) for name in names])
+
+        result = np.zeros(broadcasted[0].shape)
+
+        for index in np.ndindex(result.shape):
+
+            this_parameters = dict((name, values[index]) for name, values in zip(names, broadcasted[2:]))
+
+            result[index] = integrate.quad(lambda x: self._integrand(x, **this_parameters),
+                                           broadcasted[0][index], broadcasted[1][index])[0]
+
+        return result
+
+    def _is_accurate(self, result, e1, e2, param_specification, tolerance):
+        """
+        Compare the result with the one from scipy.integrate.quad for the first and the last elements
+        """
+
+        names = param_specification.keys()
+
+        broadcasted = np.broadcast_arrays(result, np.asarray(e1, float), np.asarray(e2, float),
+                                          *[np.asarray(param_specification[name]) for name in names])
+
+        if broadcasted[0].size == 0:
+
+            return True
+
+        for flat_index in {0, broadcasted[0].size - 1}:
+
+            index = np.unravel_index(flat_index, broadcasted[0].shape)
+
+            this_parameters = dict((name, values[index]) for name, values in zip(names, broadcasted[3:]))
+
+            expected = self._quad_integral(broadcasted[1][index], broadcasted[2][index], this_parameters)
+
+            if not np.isclose(broadcasted[0][index], expected, rtol=tolerance, atol=0):
+
+                return False
+
+        return True
+
+
 class IntegralFluxConversion(FluxConversion):
 
     def __init__(self, flux_unit, energy_unit, flux_model,test_model):
@@ -170,18 +337,18 @@ class IntegralFluxConversion(FluxConversion):
                                      "nufnu_flux": lambda x: x ** 3 * test_model(x)}
 
 
-         def photon_integrand(x,param_specification):
+         def photon_integrand(x, **param_specification):
              return flux_model(x, **param_specification)
 
-         def energy_integrand(x,param_specification):
+         def energy_integrand(x, **param_specification):
              return x * flux_model(x, **param_specification)
 
-         def nufnu_integrand(x, param_specification):
+         def nufnu_integrand(x, **param_specification):
              return x * x * flux_model(x, **param_specification)
 
-         self._model_builder = {"photon_flux": lambda e1, e2, **param_specification: integrate.quad(photon_integrand, e1, e2,args=(param_specification))[0],
-                               "energy_flux": lambda e1, e2, **param_specification: integrate.quad(energy_integrand, e1, e2,args=(param_specification))[0],
-                               "nufnu_flux": lambda e1, e2, **param_specification: integrate.quad(nufnu_integrand, e1, e2,args=(param_specification))[0]}
+         self._model_builder = {"photon_flux": IntegralOfFunction(photon_integrand),
+                                "energy_flux": IntegralOfFunction(energy_integrand),
+                                "nufnu_flux": IntegralOfFunction(nufnu_integrand)}
 
 
          super(IntegralFluxConversion, self).__init__(flux_unit,
@@ -1,10 +1,9 @@
 __author__ = "grburgess"
 
-import itertools
 import functools
 import numpy as np
 
-from threeML.io.progress_bar import progress_bar
+from threeML.random_variates import RandomVariates
 from astromodels import use_astromodels_memoization
 
 
@@ -137,20 +136,16 @@ class GenericFittedSourceHandler(object):
         # if there are independent variables
         if self._independent_variable_range:
 
-            variates = []
+            # evaluate the function over all the combinations of the independent variables at once (in the same
+            # order as itertools.product), for all the samples
 
-            # scroll through the independent variables
-            n_iterations = np.product(self._out_shape)
+            grid = np.meshgrid(*self._independent_variable_range, indexing='ij')
 
-            with progress_bar(n_iterations, title="Propagating errors") as p:
+            with use_astromodels_memoization(False):
 
-                with use_astromodels_memoization(False):
-
-                    for variables in itertools.product(*self._independent_variable_range):
-                        variates.append(self._propagated_function(*variables))
-
-                        p.increase()
+                samples = self._propagated_function.evaluate(*[variable.ravel() for variable in grid])
 
+            variates = [RandomVariates(samples[:, i]) for i in range(samples.shape[1])]
 
         # otherwise just evaluate
         else:
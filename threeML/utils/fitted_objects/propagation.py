@@ -0,0 +1,183 @@
+import numpy as np
+
+from threeML.random_variates import RandomVariates
+
+# Maximum number of output elements computed in one call of the function. The samples are processed in chunks so
+# that this is not exceeded, to bound the memory used
+
+_max_elements_per_call = 1000000
+
+
+class PropagatedFunction(object):
+
+    def __init__(self, function, max_elements_per_call=_max_elements_per_call, **arguments):
+        """
+        A wrapper around a function which propagates the uncertainties of some of its arguments (see
+        _AnalysisResults.propagate). The arguments whose value is an array of samples (like a RandomVariates instance)
+        are propagated, the others are kept fixed.
+
+        The function is called once with the arrays of samples (or with chunks of them, to bound the memory), broadcast
+        against the other arguments. This works for functions written with numpy operations, like the astromodels
+        functions. For functions which cannot work on arrays of parameters, the function is called once for each
+        sample, and as a last resort once for each sample and each value of the other arguments.
+
+        :param function: the function to be wrapped
+        :param max_elements_per_call: maximum number of output elements computed in each call of the function
+        :param arguments: the arguments to be propagated (samples) or kept fixed
+        """
+
+        self._function = function
+
+        self._max_elements_per_call = int(max_elements_per_call)
+
+        self._fixed_arguments = {}
+
+        self._sampled_arguments = {}
+
+        for name, value in arguments.items():
+
+            if np.ndim(value) > 0:
+
+                self._sampled_arguments[name] = np.asarray(value)
+
+            else:
+
+                self._fixed_arguments[name] = value
+
+        if self._sampled_arguments:
+
+            self._n_samples = np.broadcast_arrays(*self._sampled_arguments.values())[0].shape[0]
+
+        else:
+
+            self._n_samples = 1
+
+        # Whether the function can be called with arrays of samples, or with arrays for the other arguments. These
+        # are found out during the first call
+
+        self._can_broadcast_samples = True
+
+        self._can_broadcast_arguments = True
+
+    @property
+    def n_samples(self):
+
+        return self._n_samples
+
+    def __call__(self, *args, **kwargs):
+        """
+        Evaluate the function for all the samples, for scalar values of the other arguments
+
+        :return: a RandomVariates instance
+        """
+
+        return RandomVariates(self.evaluate(*args, **kwargs))
+
+    def evaluate(self, *args, **kwargs):
+        """
+        Evaluate the function for all the samples. The positional arguments can be arrays (of the same shape, or
+        broadcastable to the same shape), for example an array of energies.
+
+        :return: an array with shape (n_samples,) + (shape of the positional arguments)
+        """
+
+        args = [np.asarray(arg) for arg in args]
+
+        out_shape = np.broadcast_arrays(*args)[0].shape if args else ()
+
+        if self._can_broadcast_samples:
+
+            try:
+
+                return self._evaluate_broadcasting_samples(args, kwargs, out_shape)
+
+            except Exception:
+
+                self._can_broadcast_samples = False
+
+        if self._can_broadcast_arguments:
+
+            try:
+
+                return self._evaluate_per_sample(args, kwargs, out_shape)
+
+            except Exception:
+
+                self._can_broadcast_arguments = False
+
+        return self._evaluate_per_element(args, kwargs, out_shape)
+
+    def _call(self, args, kwargs, samples):
+
+        all_kwargs = dict(self._fixed_arguments)
+        all_kwargs.update(samples)
+        all_kwargs.update(kwargs)
+
+        return self._function(*args, **all_kwargs)
+
+    def _get_samples(self, index, extra_dimensions=0):
+        """
+        Returns the value of the sampled arguments for the given index (or slice) of the samples, with extra
+        dimensions to broadcast them against the other arguments
+        """
+
+        samples = {}
+
+        for name, values in self._sampled_arguments.items():
+
+            this_values = np.broadcast_to(values, (self._n_samples,))[index]
+
+            samples[name] = np.reshape(this_values, np.shape(this_values) + (1,) * extra_dimensions)
+
+        return samples
+
+    def _evaluate_broadcasting_samples(self, args, kwargs, out_shape):
+
+        n_elements = max(int(np.prod(out_shape)), 1)
+
+        chunk_size = max(self._max_elements_per_call // n_elements, 1)
+
+        results = np.zeros((self._n_samples,) + out_shape)
+
+        for start in range(0, self._n_samples, chunk_size):
+
+            this_slice = slice(start, min(start + chunk_size, self._n_samples))
+
+            this_result = self._call(args, kwargs, self._get_samples(this_slice, len(out_shape)))
+
+            results[this_slice] = np.broadcast_to(this_result, (this_slice.stop - start,) + out_shape)
+
+        # Make sure that the function really treated the arrays element by element, by comparing with the result
+        # for the first and the last sample alone
+
+        for i in {0, self._n_samples - 1}:
+
+            expected = np.broadcast_to(self._call(args, kwargs, self._get_samples(i)), out_shape)
+
+            if not np.allclose(results[i], expected, rtol=1e-7, atol=0, equal_nan=True):
+
+                raise ValueError("The function does not give the same result for arrays of samples")
+
+        return results
+
+    def _evaluate_per_sample(self, args, kwargs, out_shape):
+
+        results = np.zeros((self._n_samples,) + out_shape)
+
+        for i in range(self._n_samples):
+
+            results[i] = np.broadcast_to(self._call(args, kwargs, self._get_samples(i)), out_shape)
+
+        return results
+
+    def _evaluate_per_element(self, args, kwargs, out_shape):
+
+        # Vectorize over the samples and the positional arguments, passing the keywords given in the call as they are
+
+        vectorized = np.vectorize(self._function, excluded=set(kwargs.keys()), otypes=[float])
+
+        all_kwargs = dict(self._fixed_arguments)
+        all_kwargs.update(self._get_samples(slice(None), len(out_shape)))
+        all_kwargs.update(kwargs)
+
+        return np.broadcast_to(vectorized(*args, **all_kwargs), (self._n_samples,) + out_shape).copy()
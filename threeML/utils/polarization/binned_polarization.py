@@ -106,6 +106,18 @@ class BinnedModulationCurve(BinnedSpectrum):
 
         pha_information = time_series.get_information_dict(use_poly, extract)
 
+        return cls.from_information_dict(pha_information, response, use_poly)
+
+    @classmethod
+    def from_information_dict(cls, pha_information, response=None, use_poly=False):
+        """
+
+        :param pha_information: a dictionary from TimeSeries.get_information_dict(s)
+        :param response:
+        :param use_poly:
+        :return:
+        """
+
         is_poisson = True
 
         if use_poly:
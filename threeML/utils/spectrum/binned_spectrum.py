@@ -249,6 +249,27 @@ class BinnedSpectrum(Histogram):
                                              sys_errors=sys_errors,
                                              is_poisson=is_poisson)
 
+    def _set_counts(self, counts, count_errors=None):
+        """
+        Replace the counts (and the count errors, if any) of this spectrum in place. This is used to re-randomize
+        simulated spectra without creating new ones (see SpectrumLike.update_simulated_dataset). Everything else
+        (channels, exposure, quality...) is kept.
+
+        :param counts: new counts
+        :param count_errors: new count errors (None for Poisson spectra)
+        :return: none
+        """
+
+        assert len(counts) == len(self), "The new counts must have the same number of channels as the spectrum"
+
+        if count_errors is not None:
+
+            assert not self._is_poisson, "Read count errors but spectrum marked Poisson"
+
+            self._errors = np.array(count_errors) / self._exposure
+
+        self._contents = np.array(counts) / self._exposure
+
     @property
     def n_channel(self):
 
@@ -524,17 +545,33 @@ class BinnedSpectrum(Histogram):
         return pd.DataFrame(out_dict)
     
     @classmethod
-    def from_time_series(cls, time_series, use_poly=False, from_model=False, **kwargs):
+    def from_time_series(cls, time_series, use_poly=False, extract=False, **kwargs):
         """
 
         :param time_series:
         :param use_poly:
+        :param extract:
         :return:
         """
-        raise NotImplementedError('This is still under construction')
 
+        assert not (use_poly and extract), 'cannot extract background counts and use the poly'
+
+        pha_information = time_series.get_information_dict(use_poly, extract)
+
+        return cls.from_information_dict(pha_information, use_poly)
+
+    @classmethod
+    def from_information_dict(cls, pha_information, use_poly=False, **kwargs):
+        """
+
+        :param pha_information: a dictionary from TimeSeries.get_information_dict(s). The time series must have been
+        created with the edges of the channels
+        :param use_poly:
+        :param kwargs: ignored (for example the response, which this spectrum does not have)
+        :return:
+        """
 
-        pha_information = time_series.get_information_dict(use_poly)
+        assert pha_information['edges'] is not None, 'the time series has no channel edges to build the spectrum'
 
         is_poisson = True
 
@@ -544,14 +581,13 @@ class BinnedSpectrum(Histogram):
         return cls(instrument=pha_information['instrument'],
                    mission=pha_information['telescope'],
                    tstart=pha_information['tstart'],
-                   telapse=pha_information['telapse'],
-                   #channel=pha_information['channel'],
+                   tstop=pha_information['tstart'] + pha_information['telapse'],
                    counts=pha_information['counts'],
                    count_errors=pha_information['counts error'],
                    quality=pha_information['quality'],
-                   grouping=pha_information['grouping'],
                    exposure=pha_information['exposure'],
-                   backscale=1.,
+                   ebounds=pha_information['edges'],
+                   scale_factor=1.,
                    is_poisson=is_poisson)
 
     def __add__(self,other):
@@ -680,6 +716,18 @@ class BinnedSpectrumWithDispersion(BinnedSpectrum):
 
         pha_information = time_series.get_information_dict(use_poly, extract)
 
+        return cls.from_information_dict(pha_information, response, use_poly)
+
+    @classmethod
+    def from_information_dict(cls, pha_information, response=None, use_poly=False):
+        """
+
+        :param pha_information: a dictionary from TimeSeries.get_information_dict(s)
+        :param response:
+        :param use_poly:
+        :return:
+        """
+
         is_poisson = True
 
         if use_poly:
@@ -3,10 +3,12 @@ import copy
 import numpy as np
 
 from threeML.exceptions.custom_exceptions import custom_warnings
-from threeML.utils.statistics.likelihood_functions import half_chi2
-from threeML.utils.statistics.likelihood_functions import poisson_log_likelihood_ideal_bkg
-from threeML.utils.statistics.likelihood_functions import poisson_observed_gaussian_background
-from threeML.utils.statistics.likelihood_functions import poisson_observed_poisson_background
+from threeML.utils.statistics.likelihood_functions import half_chi2_derivative
+from threeML.utils.statistics.likelihood_functions import poisson_log_likelihood_derivative
+from threeML.utils.statistics.likelihood_functions import HalfChi2Kernel
+from threeML.utils.statistics.likelihood_functions import PoissonIdealBackgroundKernel
+from threeML.utils.statistics.likelihood_functions import PoissonObservedGaussianBackgroundKernel
+from threeML.utils.statistics.likelihood_functions import PoissonObservedPoissonBackgroundKernel
 
 
 # These classes provide likelihood evaluation to SpectrumLike and children
@@ -16,6 +18,14 @@ _known_noise_models = {}
 
 class BinnedStatistic(object):
 
+    # Whether get_current_derivative is implemented
+
+    has_derivative = False
+
+    # Whether get_batch_values is implemented
+
+    has_batch = False
+
     def __init__(self, spectrum_plugin):
         """
         
@@ -26,11 +36,70 @@ class BinnedStatistic(object):
 
         self._spectrum_plugin = spectrum_plugin
 
+        self._kernel = None
+        self._kernel_data = None
+
+    def _get_kernel_data(self):
+        """
+        Returns the data (as a tuple) from which the likelihood kernel of this statistic is built
+
+        :return: tuple
+        """
+
+        return ()
+
+    def _build_kernel(self, *data):
+        """
+        Builds the likelihood kernel (see likelihood_functions) for the provided data
+
+        :return: the kernel
+        """
+
+        return None
+
+    def _get_kernel(self):
+        """
+        Returns the likelihood kernel for the current data of the plugin. The kernel (which pre-computes all the terms
+        depending only on the data) is re-built only when the data change, for example when the mask or the rebinning
+        are changed (in which case the plugin replaces its current data vectors).
+
+        :return: the kernel
+        """
+
+        data = self._get_kernel_data()
 
+        if self._kernel_data is None or len(data) != len(self._kernel_data) or \
+                any(new is not old for new, old in zip(data, self._kernel_data)):
+
+            self._kernel = self._build_kernel(*data)
+            self._kernel_data = data
+
+        return self._kernel
 
     def get_current_value(self):
         RuntimeError('must be implemented in subclass')
 
+    def get_current_derivative(self):
+        """
+        Returns the derivative of the log-likelihood with respect to the source model counts (as returned by
+        get_model of the plugin) in each channel, or None if it is not available for this statistic
+
+        :return: derivative vector or None
+        """
+
+        return None
+
+    def get_batch_values(self, model_counts):
+        """
+        Returns the log-likelihood for many source models at once, or None if this is not available for this
+        statistic
+
+        :param model_counts: 2d array with one source model (as returned by get_model of the plugin) per column
+        :return: array of log-likelihood values (one per column) or None
+        """
+
+        return None
+
     def get_randomized_source_counts(self, source_model_counts):
         return None
 
@@ -45,14 +114,36 @@ class BinnedStatistic(object):
 
 
 class GaussianObservedStatistic(BinnedStatistic):
+
+    has_derivative = True
+
+    has_batch = True
+
+    def _get_kernel_data(self):
+
+        return (self._spectrum_plugin.current_observed_counts,
+                self._spectrum_plugin.current_observed_count_errors)
+
+    def _build_kernel(self, observed_counts, observed_count_errors):
+
+        return HalfChi2Kernel(observed_counts, observed_count_errors)
+
     def get_current_value(self):
-        chi2_ = half_chi2(self._spectrum_plugin.current_observed_counts,
-                          self._spectrum_plugin.current_observed_count_errors,
-                          self._spectrum_plugin.get_model())
+        chi2_ = self._get_kernel()(self._spectrum_plugin.get_model())
+
+        assert np.isfinite(chi2_)
+
+        return chi2_ * (-1), None
 
-        assert np.all(np.isfinite(chi2_))
+    def get_batch_values(self, model_counts):
 
-        return np.sum(chi2_) * (-1), None
+        return self._get_kernel().batch(model_counts) * (-1)
+
+    def get_current_derivative(self):
+
+        return half_chi2_derivative(self._spectrum_plugin.current_observed_counts,
+                                    self._spectrum_plugin.current_observed_count_errors,
+                                    self._spectrum_plugin.get_model()) * (-1)
 
     def get_randomized_source_counts(self, source_model_counts):
         idx = (self._spectrum_plugin.observed_count_errors > 0)
@@ -81,17 +172,39 @@ class GaussianObservedStatistic(BinnedStatistic):
 
 
 class PoissonObservedIdealBackgroundStatistic(BinnedStatistic):
+
+    has_derivative = True
+
+    has_batch = True
+
     def get_current_value(self):
         # In this likelihood the background becomes part of the model, which means that
         # the uncertainty in the background is completely neglected
 
         model_counts = self._spectrum_plugin.get_model()
 
-        loglike, _ = poisson_log_likelihood_ideal_bkg(self._spectrum_plugin.current_observed_counts,
-                                                      self._spectrum_plugin.current_scaled_background_counts,
-                                                      model_counts)
+        loglike, _ = self._get_kernel()(model_counts)
+
+        return loglike, None
+
+    def _get_kernel_data(self):
+
+        return (self._spectrum_plugin.current_observed_counts,
+                self._spectrum_plugin.current_scaled_background_counts)
+
+    def _build_kernel(self, observed_counts, scaled_background_counts):
 
-        return np.sum(loglike), None
+        return PoissonIdealBackgroundKernel(observed_counts, scaled_background_counts)
+
+    def get_batch_values(self, model_counts):
+
+        return self._get_kernel().batch(model_counts)
+
+    def get_current_derivative(self):
+
+        expected_counts = self._spectrum_plugin.get_model() + self._spectrum_plugin.current_scaled_background_counts
+
+        return poisson_log_likelihood_derivative(self._spectrum_plugin.current_observed_counts, expected_counts)
 
     def get_randomized_source_counts(self, source_model_counts):
         # Randomize expectations for the source
@@ -122,16 +235,22 @@ class PoissonObservedModeledBackgroundStatistic(BinnedStatistic):
 
         background_model_counts = self._spectrum_plugin.get_background_model() * self._spectrum_plugin.scale_factor
 
-        loglike, _ = poisson_log_likelihood_ideal_bkg(self._spectrum_plugin.current_observed_counts,
-                                                      background_model_counts,
-                                                      model_counts)
+        loglike, _ = self._get_kernel()(model_counts, background_model_counts)
 
         bkg_log_like = self._spectrum_plugin.background_plugin.get_log_like()
 
-        total_log_like = np.sum(loglike) + bkg_log_like
+        total_log_like = loglike + bkg_log_like
 
         return total_log_like, None
 
+    def _get_kernel_data(self):
+
+        return (self._spectrum_plugin.current_observed_counts,)
+
+    def _build_kernel(self, observed_counts):
+
+        return PoissonIdealBackgroundKernel(observed_counts)
+
     def get_randomized_source_counts(self, source_model_counts):
         # first generate random source counts from the plugin
 
@@ -156,19 +275,37 @@ class PoissonObservedModeledBackgroundStatistic(BinnedStatistic):
 
 
 class PoissonObservedNoBackgroundStatistic(BinnedStatistic):
+
+    has_derivative = True
+
+    has_batch = True
+
     def get_current_value(self):
         # In this likelihood the background becomes part of the model, which means that
         # the uncertainty in the background is completely neglected
 
         model_counts = self._spectrum_plugin.get_model()
 
-        background_model_counts = np.zeros_like(model_counts)
+        loglike, _ = self._get_kernel()(model_counts)
+
+        return loglike, None
 
-        loglike, _ = poisson_log_likelihood_ideal_bkg(self._spectrum_plugin.current_observed_counts,
-                                                      background_model_counts,
-                                                      model_counts)
+    def _get_kernel_data(self):
 
-        return np.sum(loglike), None
+        return (self._spectrum_plugin.current_observed_counts,)
+
+    def _build_kernel(self, observed_counts):
+
+        return PoissonIdealBackgroundKernel(observed_counts)
+
+    def get_batch_values(self, model_counts):
+
+        return self._get_kernel().batch(model_counts)
+
+    def get_current_derivative(self):
+
+        return poisson_log_likelihood_derivative(self._spectrum_plugin.current_observed_counts,
+                                                 self._spectrum_plugin.get_model())
 
     def get_randomized_source_counts(self, source_model_counts):
         # Randomize expectations for the source
@@ -182,17 +319,45 @@ class PoissonObservedNoBackgroundStatistic(BinnedStatistic):
 
 
 class PoissonObservedPoissonBackgroundStatistic(BinnedStatistic):
+
+    has_derivative = True
+
+    has_batch = True
+
     def get_current_value(self):
         # Scale factor between source and background spectrum
 
         model_counts = self._spectrum_plugin.get_model()
 
-        loglike, bkg_model = poisson_observed_poisson_background(self._spectrum_plugin.current_observed_counts,
-                                                                 self._spectrum_plugin.current_background_counts,
-                                                                 self._spectrum_plugin.scale_factor,
-                                                                 model_counts)
+        loglike, bkg_model = self._get_kernel()(model_counts)
+
+        return loglike, bkg_model
+
+    def _get_kernel_data(self):
+
+        return (self._spectrum_plugin.current_observed_counts,
+                self._spectrum_plugin.current_background_counts,
+                self._spectrum_plugin.scale_factor)
+
+    def _build_kernel(self, observed_counts, background_counts, scale_factor):
 
-        return np.sum(loglike), bkg_model
+        return PoissonObservedPoissonBackgroundKernel(observed_counts, background_counts, scale_factor)
+
+    def get_batch_values(self, model_counts):
+
+        return self._get_kernel().batch(model_counts)
+
+    def get_current_derivative(self):
+
+        # The background is profiled out, so (envelope theorem) we just need the derivative with respect to the
+        # total expected counts evaluated at the profiled background
+
+        model_counts = self._spectrum_plugin.get_model()
+
+        _, bkg_model = self._get_kernel()(model_counts)
+
+        return poisson_log_likelihood_derivative(self._spectrum_plugin.current_observed_counts,
+                                                 model_counts + bkg_model)
 
     def get_randomized_source_counts(self, source_model_counts):
         # Since we use a profile likelihood, the background model is conditional on the source model, so let's
@@ -219,15 +384,48 @@ class PoissonObservedPoissonBackgroundStatistic(BinnedStatistic):
 
 
 class PoissonObservedGaussianBackgroundStatistic(BinnedStatistic):
+
+    has_derivative = True
+
+    has_batch = True
+
     def get_current_value(self):
         expected_model_counts = self._spectrum_plugin.get_model()
 
-        loglike, bkg_model = poisson_observed_gaussian_background(self._spectrum_plugin.current_observed_counts,
-                                                                  self._spectrum_plugin.current_background_counts,
-                                                                  self._spectrum_plugin.current_background_count_errors,
-                                                                  expected_model_counts)
+        loglike, bkg_model = self._get_kernel()(expected_model_counts)
+
+        return loglike, bkg_model
+
+    def _get_kernel_data(self):
+
+        return (self._spectrum_plugin.current_observed_counts,
+                self._spectrum_plugin.current_background_counts,
+                self._spectrum_plugin.current_background_count_errors)
+
+    def _build_kernel(self, observed_counts, background_counts, background_count_errors):
+
+        return PoissonObservedGaussianBackgroundKernel(observed_counts, background_counts, background_count_errors)
+
+    def get_batch_values(self, model_counts):
+
+        return self._get_kernel().batch(model_counts)
+
+    def get_current_derivative(self):
+
+        # The background is profiled out, so (envelope theorem) we just need the derivative with respect to the
+        # total expected counts evaluated at the profiled background
+
+        expected_model_counts = self._spectrum_plugin.get_model()
+
+        _, bkg_model = self._get_kernel()(expected_model_counts)
+
+        # Channels with no background counts have the Poisson likelihood with no background (see
+        # poisson_observed_gaussian_background), so the profiled background does not enter there
+
+        bkg_model = np.where(self._spectrum_plugin.current_background_counts > 0, bkg_model, 0.0)
 
-        return np.sum(loglike), bkg_model
+        return poisson_log_likelihood_derivative(self._spectrum_plugin.current_observed_counts,
+                                                 expected_model_counts + bkg_model)
 
     def get_randomized_source_counts(self, source_model_counts):
         # Since we use a profile likelihood, the background model is conditional on the source model, so let's
@@ -161,3 +161,385 @@ def half_chi2(y, yerr, expectation):
     # the other likelihood functions. This way we can sum it with other likelihood functions.
 
     return 1/2.0 * (y-expectation)**2 / yerr**2
+
+
+def poisson_log_likelihood_derivative(observed_counts, expected_counts):
+    """
+    Derivative of the Poisson log-likelihood o_i~\log{e_i} - e_i with respect to the expected counts e_i:
+
+    dL/de_i = o_i / e_i - 1
+
+    Thanks to the envelope theorem, this is also the derivative of the profile likelihoods
+    (poisson_observed_poisson_background and poisson_observed_gaussian_background) with respect to the
+    model counts, if e_i contains the profiled background (which is returned by those functions).
+
+    :param observed_counts:
+    :param expected_counts: the total expected counts (model + background)
+    :return: derivative vector
+    """
+
+    derivative = -np.ones(np.shape(expected_counts))
+
+    # Bins with no counts have no o_i~\log{e_i} term (see xlogy)
+
+    idx = observed_counts > 0
+
+    derivative[idx] += observed_counts[idx] / expected_counts[idx]
+
+    return derivative
+
+
+def half_chi2_derivative(y, yerr, expectation):
+
+    # Derivative of half_chi2 with respect to the expectation
+
+    return (expectation - y) / yerr**2
+
+
+# The following kernels compute the same log-likelihoods as the functions above, but they are meant to be used in
+# the innermost loop of fits and samplers, where the data are fixed and only the model changes. All the terms
+# which depend only on the data (log-factorials, masks of empty bins, ...) are computed once when the kernel is
+# created, and the model-dependent part is computed in preallocated buffers. They return the total (summed)
+# log-likelihood. NOTE: the arrays returned by the kernels (for example the profiled background) are buffers which
+# are overwritten by the next call.
+
+
+class PoissonIdealBackgroundKernel(object):
+
+    def __init__(self, observed_counts, expected_bkg_counts=None):
+        """
+        Kernel for the Poisson log-likelihood for the case where the background has no uncertainties
+        (see poisson_log_likelihood_ideal_bkg).
+
+        :param observed_counts:
+        :param expected_bkg_counts: (optional) the background, if it is known in advance. Otherwise it can
+        be provided at each call (or it is assumed to be zero)
+        """
+
+        observed_counts = np.array(observed_counts, dtype=float)
+
+        self._expected_bkg_counts = expected_bkg_counts
+
+        # Bins with no counts do not contribute to the o_i~\log{e_i} term
+
+        self._positive_idx = np.flatnonzero(observed_counts > 0)
+        self._positive_observed_counts = observed_counts[self._positive_idx]
+
+        self._constant = - np.sum(logfactorial(observed_counts))
+
+        self._predicted_counts = np.empty_like(observed_counts)
+        self._log_buffer = np.empty_like(self._positive_observed_counts)
+
+    def __call__(self, expected_model_counts, expected_bkg_counts=None):
+        """
+        :param expected_model_counts:
+        :param expected_bkg_counts: (optional) the background, overriding the one provided at construction
+        :return: (log_like, background vector)
+        """
+
+        if expected_bkg_counts is None:
+
+            expected_bkg_counts = self._expected_bkg_counts
+
+        if expected_bkg_counts is None:
+
+            predicted_counts = expected_model_counts
+
+        else:
+
+            predicted_counts = np.add(expected_model_counts, expected_bkg_counts, out=self._predicted_counts)
+
+        np.take(predicted_counts, self._positive_idx, out=self._log_buffer)
+        np.log(self._log_buffer, out=self._log_buffer)
+
+        log_like = np.dot(self._positive_observed_counts, self._log_buffer) - np.sum(predicted_counts) + \
+                   self._constant
+
+        return log_like, expected_bkg_counts
+
+    def batch(self, expected_model_counts, expected_bkg_counts=None):
+        """
+        Evaluate the log-likelihood for many models at once
+
+        :param expected_model_counts: 2d array with one model per column
+        :param expected_bkg_counts: (optional) the background, overriding the one provided at construction
+        :return: array of log-likelihood values, one per column
+        """
+
+        if expected_bkg_counts is None:
+
+            expected_bkg_counts = self._expected_bkg_counts
+
+        if expected_bkg_counts is None:
+
+            predicted_counts = expected_model_counts
+
+        else:
+
+            predicted_counts = expected_model_counts + np.asarray(expected_bkg_counts)[:, np.newaxis]
+
+        return (np.dot(self._positive_observed_counts, np.log(predicted_counts[self._positive_idx])) -
+                np.sum(predicted_counts, axis=0) + self._constant)
+
+
+class PoissonObservedPoissonBackgroundKernel(object):
+
+    def __init__(self, observed_counts, background_counts, exposure_ratio):
+        """
+        Kernel for the profile log-likelihood for the case when both the observed and the background counts are
+        Poisson distributed (see poisson_observed_poisson_background).
+
+        :param observed_counts:
+        :param background_counts:
+        :param exposure_ratio:
+        """
+
+        alpha = float(exposure_ratio)
+
+        observed_counts = np.array(observed_counts, dtype=float)
+        background_counts = np.array(background_counts, dtype=float)
+
+        self._alpha = alpha
+        self._alpha_plus_one = alpha + 1
+        self._normalization = 1 / (2.0 * alpha * (1 + alpha))
+
+        self._alpha_times_total_counts = alpha * (observed_counts + background_counts)
+        self._four_alpha_background = 4 * (alpha + alpha ** 2) * background_counts
+
+        self._observed_idx = np.flatnonzero(observed_counts > 0)
+        self._positive_observed_counts = observed_counts[self._observed_idx]
+
+        self._background_idx = np.flatnonzero(background_counts > 0)
+        self._positive_background_counts = background_counts[self._background_idx]
+
+        self._constant = - np.sum(logfactorial(background_counts)) - np.sum(logfactorial(observed_counts))
+
+        self._first_term = np.empty_like(observed_counts)
+        self._second_term = np.empty_like(observed_counts)
+        self._background_mle = np.empty_like(observed_counts)
+        self._scaled_background_mle = np.empty_like(observed_counts)
+
+        self._observed_log_buffer = np.empty_like(self._positive_observed_counts)
+        self._background_log_buffer = np.empty_like(self._positive_background_counts)
+
+    def __call__(self, expected_model_counts):
+        """
+        :param expected_model_counts:
+        :return: (log_like, profiled background counts in the source region)
+        """
+
+        M = expected_model_counts
+
+        first_term = self._first_term
+        second_term = self._second_term
+        B_mle = self._background_mle
+
+        # first_term = (alpha + 1) * M - alpha * (o + b)
+
+        np.multiply(M, self._alpha_plus_one, out=first_term)
+        first_term -= self._alpha_times_total_counts
+
+        # second_term = sqrt(4 * (alpha + alpha ** 2) * b * M + first_term ** 2)
+
+        np.multiply(first_term, first_term, out=second_term)
+        np.multiply(M, self._four_alpha_background, out=B_mle)
+        second_term += B_mle
+        np.sqrt(second_term, out=second_term)
+
+        # Nuisance parameter for the Poisson likelihood
+
+        np.subtract(second_term, first_term, out=B_mle)
+        B_mle *= self._normalization
+
+        np.multiply(B_mle, self._alpha, out=self._scaled_background_mle)
+
+        # Total expected counts (reuse the buffer)
+
+        np.add(self._scaled_background_mle, M, out=second_term)
+
+        np.take(second_term, self._observed_idx, out=self._observed_log_buffer)
+        np.log(self._observed_log_buffer, out=self._observed_log_buffer)
+
+        np.take(B_mle, self._background_idx, out=self._background_log_buffer)
+        np.log(self._background_log_buffer, out=self._background_log_buffer)
+
+        log_like = (np.dot(self._positive_observed_counts, self._observed_log_buffer) +
+                    np.dot(self._positive_background_counts, self._background_log_buffer) -
+                    self._alpha_plus_one * np.sum(B_mle) - np.sum(M) + self._constant)
+
+        return log_like, self._scaled_background_mle
+
+    def batch(self, expected_model_counts):
+        """
+        Evaluate the log-likelihood for many models at once
+
+        :param expected_model_counts: 2d array with one model per column
+        :return: array of log-likelihood values, one per column
+        """
+
+        M = expected_model_counts
+
+        first_term = M * self._alpha_plus_one - self._alpha_times_total_counts[:, np.newaxis]
+
+        second_term = np.sqrt(first_term ** 2 + M * self._four_alpha_background[:, np.newaxis])
+
+        B_mle = (second_term - first_term) * self._normalization
+
+        total_counts = B_mle * self._alpha + M
+
+        return (np.dot(self._positive_observed_counts, np.log(total_counts[self._observed_idx])) +
+                np.dot(self._positive_background_counts, np.log(B_mle[self._background_idx])) -
+                self._alpha_plus_one * np.sum(B_mle, axis=0) - np.sum(M, axis=0) + self._constant)
+
+
+class PoissonObservedGaussianBackgroundKernel(object):
+
+    def __init__(self, observed_counts, background_counts, background_error):
+        """
+        Kernel for the profile log-likelihood for the case of Poisson observed counts and a background with Gaussian
+        errors (see poisson_observed_gaussian_background).
+
+        :param observed_counts:
+        :param background_counts:
+        :param background_error:
+        """
+
+        observed_counts = np.array(observed_counts, dtype=float)
+        background_counts = np.array(background_counts, dtype=float)
+        background_error = np.array(background_error, dtype=float)
+
+        s2 = background_error ** 2
+
+        self._background_counts = background_counts
+        self._two_s2 = 2 * s2
+        self._sqrt_constant = 2 * self._two_s2 * observed_counts + background_error ** 4
+        self._background_minus_s2 = background_counts - s2
+
+        # Only bins with background > 0 have a profiled background (and a Gaussian term), the others have the
+        # Poisson likelihood with no background. NOTE: bkgErr can be 0 only when also bkgCounts = 0
+
+        idx = background_counts > 0
+
+        self._with_background = idx.astype(float)
+
+        self._gaussian_weights = np.zeros_like(s2)
+        self._gaussian_weights[idx] = 1 / (2 * s2[idx])
+
+        self._observed_idx = np.flatnonzero(observed_counts > 0)
+        self._positive_observed_counts = observed_counts[self._observed_idx]
+
+        self._constant = (- np.sum(logfactorial(observed_counts))
+                          - np.sum(idx) * 0.5 * log(2 * np.pi) - np.sum(np.log(background_error[idx])))
+
+        self._background_mle = np.empty_like(observed_counts)
+        self._effective_background = np.empty_like(observed_counts)
+        self._buffer = np.empty_like(observed_counts)
+        self._log_buffer = np.empty_like(self._positive_observed_counts)
+
+    def __call__(self, expected_model_counts):
+        """
+        :param expected_model_counts:
+        :return: (log_like, profiled background counts)
+        """
+
+        M = expected_model_counts
+
+        b = self._background_mle
+        buffer = self._buffer
+
+        # b = 0.5 * (sqrt(MB ** 2 - 2 * s2 * (MB - 2 * o) + s2 ** 2) + bkg - M - s2), with MB = bkg + M
+
+        np.add(self._background_counts, M, out=b)
+        np.subtract(b, self._two_s2, out=buffer)
+        buffer *= b
+        buffer += self._sqrt_constant
+        np.sqrt(buffer, out=b)
+        b += self._background_minus_s2
+        b -= M
+        b *= 0.5
+
+        # Background entering the likelihood (zero for bins without background)
+
+        effective_background = np.multiply(b, self._with_background, out=self._effective_background)
+
+        # Gaussian term
+
+        np.subtract(effective_background, self._background_counts, out=buffer)
+        buffer *= buffer
+
+        gaussian_term = np.dot(buffer, self._gaussian_weights)
+
+        # Poisson term
+
+        np.add(effective_background, M, out=buffer)
+
+        np.take(buffer, self._observed_idx, out=self._log_buffer)
+        np.log(self._log_buffer, out=self._log_buffer)
+
+        log_like = (np.dot(self._positive_observed_counts, self._log_buffer) - np.sum(buffer) - gaussian_term +
+                    self._constant)
+
+        return log_like, b
+
+    def batch(self, expected_model_counts):
+        """
+        Evaluate the log-likelihood for many models at once
+
+        :param expected_model_counts: 2d array with one model per column
+        :return: array of log-likelihood values, one per column
+        """
+
+        M = expected_model_counts
+
+        background_counts = self._background_counts[:, np.newaxis]
+
+        MB = background_counts + M
+
+        b = 0.5 * (np.sqrt((MB - self._two_s2[:, np.newaxis]) * MB + self._sqrt_constant[:, np.newaxis]) +
+                   self._background_minus_s2[:, np.newaxis] - M)
+
+        effective_background = b * self._with_background[:, np.newaxis]
+
+        gaussian_term = np.dot(self._gaussian_weights, (effective_background - background_counts) ** 2)
+
+        total_counts = effective_background + M
+
+        return (np.dot(self._positive_observed_counts, np.log(total_counts[self._observed_idx])) -
+                np.sum(total_counts, axis=0) - gaussian_term + self._constant)
+
+
+class HalfChi2Kernel(object):
+
+    def __init__(self, y, yerr):
+        """
+        Kernel for half of a chi2 (see half_chi2)
+
+        :param y:
+        :param yerr:
+        """
+
+        self._y = np.array(y, dtype=float)
+        self._weights = 1 / (2.0 * np.array(yerr, dtype=float) ** 2)
+
+        self._buffer = np.empty_like(self._y)
+
+    def __call__(self, expectation):
+        """
+        :param expectation:
+        :return: the total half chi2
+        """
+
+        np.subtract(self._y, expectation, out=self._buffer)
+        self._buffer *= self._buffer
+
+        return np.dot(self._buffer, self._weights)
+
+    def batch(self, expectation):
+        """
+        Evaluate the half chi2 for many models at once
+
+        :param expectation: 2d array with one model per column
+        :return: array of half chi2 values, one per column
+        """
+
+        return np.dot(self._weights, (self._y[:, np.newaxis] - expectation) ** 2)
@@ -2,10 +2,8 @@ import numpy as np
 
 from threeML.config.config import threeML_config
 from threeML.io.plotting.light_curve_plots import binned_light_curve_plot
-from threeML.io.progress_bar import progress_bar
 from threeML.utils.spectrum.binned_spectrum_set import BinnedSpectrumSet
 from threeML.utils.time_interval import TimeIntervalSet
-from threeML.utils.time_series.polynomial import polyfit
 from threeML.utils.time_series.time_series import TimeSeries
 
 
@@ -296,23 +294,13 @@ class BinnedSpectrumSeries(TimeSeries):
 
             self._optimal_polynomial_grade = self._user_poly_order
 
-        polynomials = []
-
         # now fit the light curve of each channel
         # and save the estimated polynomial
 
-        with progress_bar(self._n_channels, title="Fitting background") as p:
-            for counts in selected_counts.T:
-
-                polynomial, _ = polyfit(selected_midpoints,
-                                        counts,
-                                        self._optimal_polynomial_grade,
-                                        selected_exposure)
-
-                polynomials.append(polynomial)
-                p.increase()
+        results = self._fit_binned_channels(selected_midpoints, selected_counts, self._optimal_polynomial_grade,
+                                            selected_exposure, title="Fitting background")
 
-        self._polynomials = polynomials
+        self._polynomials = [polynomial for polynomial, _ in results]
 
     def set_active_time_intervals(self, *args):
         """
@@ -1,7 +1,6 @@
 __author__ = 'grburgess'
 
 import collections
-import copy
 import os
 
 import numpy as np
@@ -11,11 +10,10 @@ from pandas import HDFStore
 from threeML.config.config import threeML_config
 from threeML.exceptions.custom_exceptions import custom_warnings
 from threeML.io.file_utils import sanitize_filename
-from threeML.io.progress_bar import progress_bar
 from threeML.io.rich_display import display
 from threeML.utils.binner import TemporalBinner
 from threeML.utils.time_interval import TimeIntervalSet
-from threeML.utils.time_series.polynomial import polyfit, unbinned_polyfit
+from threeML.utils.time_series.polynomial import unbinned_polyfit
 from threeML.utils.time_series.time_series import TimeSeries
 from threeML.io.plotting.light_curve_plots import binned_light_curve_plot
 
@@ -39,6 +37,10 @@ def ceildiv(a, b):
 
 class EventList(TimeSeries):
 
+    # Maximum number of count cubes (one for each set of selections and binning) kept in memory
+
+    _max_cached_count_cubes = 16
+
     def __init__(self,
                  arrival_times,
                  measurement,
@@ -86,10 +88,42 @@ class EventList(TimeSeries):
 
         self._temporal_binner = None
 
+        self._count_cube_cache = collections.OrderedDict()
+
         assert self._arrival_times.shape[0] == self._measurement.shape[
             0], "Arrival time (%d) and energies (%d) have different shapes" % (self._arrival_times.shape[0],
                                                                                self._measurement.shape[0])
 
+        # The event selections use binary searches on the arrival times, so the events must be time ordered. If they
+        # are not, we sort them here (and the subclasses use the same order for their per-event arrays)
+
+        if np.all(self._arrival_times[1:] >= self._arrival_times[:-1]):
+
+            self._time_ordering = None
+
+        else:
+
+            self._time_ordering = np.argsort(self._arrival_times, kind='mergesort')
+
+            self._arrival_times = self._arrival_times[self._time_ordering]
+            self._measurement = self._measurement[self._time_ordering]
+
+    def _apply_time_ordering(self, per_event_array):
+        """
+        return the provided per-event array in the same order as the (time ordered) events
+
+        :param per_event_array: an array with one element per event, in the order provided at construction
+        :return: array
+        """
+
+        if self._time_ordering is None:
+
+            return per_event_array
+
+        else:
+
+            return per_event_array[self._time_ordering]
+
     @property
     def n_events(self):
 
@@ -127,23 +161,16 @@ class EventList(TimeSeries):
         :return:
         """
 
+        selection = self._select_events(start, stop)
+
+        events = self._arrival_times[selection]
+
         if mask is not None:
 
             # create phas to check
             phas = np.arange(self._first_channel, self._n_channels)[mask]
 
-            this_mask = np.zeros_like(self._arrival_times, dtype=np.bool)
-
-            for channel in phas:
-                this_mask = np.logical_or(this_mask, self._measurement == channel)
-
-            events = self._arrival_times[this_mask]
-
-        else:
-
-            events = copy.copy(self._arrival_times)
-
-        events = events[np.logical_and(events <= stop, events >= start)]
+            events = events[np.in1d(self._measurement[selection], phas)]
 
         tmp_bkg_getter = lambda a, b: self.get_total_poly_count(a, b, mask)
         tmp_err_getter = lambda a, b: self.get_total_poly_error(a, b, mask)
@@ -166,7 +193,7 @@ class EventList(TimeSeries):
         :return:
         """
 
-        events = self._arrival_times[np.logical_and(self._arrival_times >= start, self._arrival_times <= stop)]
+        events = self._arrival_times[self._select_events(start, stop)]
 
         self._temporal_binner = TemporalBinner.bin_by_constant(events, dt)
 
@@ -185,7 +212,7 @@ class EventList(TimeSeries):
 
     def bin_by_bayesian_blocks(self, start, stop, p0, use_background=False):
 
-        events = self._arrival_times[np.logical_and(self._arrival_times >= start, self._arrival_times <= stop)]
+        events = self._arrival_times[self._select_events(start, stop)]
 
         #self._temporal_binner = TemporalBinner(events)
 
@@ -239,8 +266,9 @@ class EventList(TimeSeries):
         cnts, bins = np.histogram(self.arrival_times, bins=bins)
         time_bins = np.array([[bins[i], bins[i + 1]] for i in range(len(bins) - 1)])
 
-        #width = np.diff(bins)
-        width = []
+        # we will use the exposure for the width
+
+        width = self.exposure_over_intervals(time_bins[:, 0], time_bins[:, 1])
 
         # now we want to get the estimated background from the polynomial fit
 
@@ -255,36 +283,20 @@ class EventList(TimeSeries):
                 # zero out the bkg
                 tmpbkg = 0.
 
-                # we will use the exposure for the width
-
-                this_width = self.exposure_over_interval(tb[0], tb[1])
-
                 # sum up the counts over this interval
 
                 for poly in self.polynomials:
 
                     tmpbkg += poly.integral(tb[0], tb[1])
 
-                # capture the exposure
-
-                width.append(this_width)
-
                 # capture the bkg *rate*
 
-                bkg.append(tmpbkg / this_width)
+                bkg.append(tmpbkg / width[j])
 
         else:
 
             bkg = None
 
-            for j, tb in enumerate(time_bins):
-
-                this_width = self.exposure_over_interval(tb[0], tb[1])
-
-                width.append(this_width)
-
-        width = np.array(width)
-
         # pass all this to the light curve plotter
 
         if self.time_intervals is not None:
@@ -320,35 +332,279 @@ class EventList(TimeSeries):
         :return:
         """
 
-        # this will be a boolean list and the sum will be the
-        # number of events
+        # the events are time ordered, so the number of events is just the
+        # distance between the first and the last index
+
+        first, last = self._get_event_range(start, stop)
 
-        return self._select_events(start, stop).sum()
+        return last - first
 
     def count_per_channel_over_interval(self, start, stop):
 
-        channels = range(self._first_channel, self._n_channels + self._first_channel)
+        # This is a count cube with only one time bin, so repeated requests for the same interval are served from
+        # the cache
 
-        counts_per_channel = np.zeros(len(channels))
+        _, counts = self._get_count_cube([self._select_events(start, stop)], (start, max(start, stop)))
 
-        selection = self._select_events(start, stop)
+        return counts[0].astype(float)
+
+    def count_per_channel_over_intervals(self, starts, stops):
+        """
+        vectorized version of count_per_channel_over_interval. The events between the boundaries of the intervals
+        are histogrammed in channel in a single pass, and the counts of each interval are obtained as differences of
+        the cumulative counts at its boundaries (so the intervals can overlap)
+
+        :param starts: start times of the intervals
+        :param stops: stop times of the intervals
+        :return: array of counts with shape (n_intervals, n_channels)
+        """
+
+        first, last = self._get_event_ranges(starts, stops)
+
+        n_intervals = first.shape[0]
+
+        if n_intervals == 0:
+
+            return np.zeros((0, self._n_channels))
+
+        # the boundaries of all the event ranges divide the events in contiguous segments
+
+        boundaries, boundary_index = np.unique(np.concatenate((first, last)), return_inverse=True)
+
+        n_segments = boundaries.shape[0] - 1
+
+        segment_index = np.repeat(np.arange(n_segments), np.diff(boundaries))
+
+        channel_index, valid = self._get_channel_index(self._measurement[boundaries[0]:boundaries[-1]])
+
+        segment_counts = np.bincount(segment_index[valid] * self._n_channels + channel_index[valid],
+                                     minlength=n_segments * self._n_channels).reshape(n_segments, self._n_channels)
+
+        # cumulative counts per channel at each boundary
+
+        cumulative_counts = np.zeros((n_segments + 1, self._n_channels))
+
+        np.cumsum(segment_counts, axis=0, out=cumulative_counts[1:])
+
+        return cumulative_counts[boundary_index[n_intervals:]] - cumulative_counts[boundary_index[:n_intervals]]
+
+    def _get_event_range(self, start, stop):
+        """
+        return the index of the first selected event and the index after the last one, so that the events with
+        start <= t <= stop are those in [first, last)
+
+        :param start: start time
+        :param stop: stop time
+        :return: (first, last)
+        """
+
+        first = np.searchsorted(self._arrival_times, start, side='left')
+        last = np.searchsorted(self._arrival_times, stop, side='right')
+
+        # If stop < start, there are no events
+
+        return first, max(first, last)
 
-        for i, channel in enumerate(channels):
-            channel_mask = self._measurement[selection] == channel
+    def _get_event_ranges(self, starts, stops):
+        """
+        vectorized version of _get_event_range
+
+        :param starts: start times
+        :param stops: stop times
+        :return: (first, last) arrays
+        """
 
-            counts_per_channel[i] += channel_mask.sum()
+        first = np.searchsorted(self._arrival_times, starts, side='left')
+        last = np.searchsorted(self._arrival_times, stops, side='right')
 
-        return counts_per_channel
+        return first, np.maximum(first, last)
 
     def _select_events(self, start, stop):
         """
-        return an index of the selected events
+        return an index of the selected events. This is a slice, so indexing an array with it returns a view
+
         :param start: start time
         :param stop: stop time
         :return:
         """
 
-        return np.logical_and(start <= self._arrival_times, self._arrival_times <= stop)
+        return slice(*self._get_event_range(start, stop))
+
+    def _select_events_in_intervals(self, starts, stops):
+        """
+        return a list of indexes (slices) of the events contained in the union of the provided intervals. The slices
+        are sorted and do not overlap, so each event is selected only once even if the intervals overlap or touch
+
+        :param starts: start times of the intervals
+        :param stops: stop times of the intervals
+        :return: list of slices
+        """
+
+        ranges = sorted(self._get_event_range(start, stop) for start, stop in zip(starts, stops))
+
+        merged_ranges = []
+
+        for first, last in ranges:
+
+            if first == last:
+
+                continue
+
+            if merged_ranges and first <= merged_ranges[-1][1]:
+
+                merged_ranges[-1][1] = max(merged_ranges[-1][1], last)
+
+            else:
+
+                merged_ranges.append([first, last])
+
+        return [slice(first, last) for first, last in merged_ranges]
+
+    @staticmethod
+    def _get_selected(array, selections):
+        """
+        return the elements of the array in the provided selections (see _select_events_in_intervals). A view is
+        returned when there is only one selection
+
+        :param array: a per-event array
+        :param selections: list of slices
+        :return: array
+        """
+
+        if len(selections) == 0:
+
+            return array[:0]
+
+        elif len(selections) == 1:
+
+            return array[selections[0]]
+
+        else:
+
+            return np.concatenate([array[selection] for selection in selections])
+
+    def _get_channel_index(self, measurement):
+        """
+        return the index of the channel of each event, and a boolean array telling which events belong to one of
+        the channels (the index of the others is meaningless)
+
+        :param measurement: the pha channels of the events
+        :return: (channel index, valid)
+        """
+
+        channel_index = np.asarray(measurement)
+
+        if channel_index.dtype.kind == 'u':
+
+            # the measurements can be stored as small unsigned integers, which would wrap around below
+
+            channel_index = channel_index.astype(int)
+
+        channel_index = channel_index - self._first_channel
+
+        valid = np.logical_and(channel_index >= 0, channel_index < self._n_channels)
+
+        if channel_index.dtype.kind == 'f':
+
+            # only measurements equal to a channel number belong to a channel
+
+            valid = np.logical_and(valid, channel_index == np.floor(channel_index))
+
+        return channel_index.astype(int), valid
+
+    def _count_per_channel(self, measurement):
+        """
+        return the number of events in each channel
+
+        :param measurement: the pha channels of the events
+        :return: array of counts with one element per channel
+        """
+
+        channel_index, valid = self._get_channel_index(measurement)
+
+        return np.bincount(channel_index[valid], minlength=self._n_channels)
+
+    def _split_per_channel(self, events, measurement):
+        """
+        split the provided events by channel in a single pass (instead of selecting each channel separately). The
+        events of each channel keep their order
+
+        :param events: the arrival times of the events
+        :param measurement: the pha channels of the events
+        :return: list with the arrival times of the events in each channel
+        """
+
+        channel_index, valid = self._get_channel_index(measurement)
+
+        channel_index = channel_index[valid]
+
+        # A stable sort keeps the time ordering within each channel
+
+        order = np.argsort(channel_index, kind='mergesort')
+
+        sorted_events = events[valid][order]
+
+        boundaries = np.concatenate(([0], np.cumsum(np.bincount(channel_index, minlength=self._n_channels))))
+
+        return [sorted_events[boundaries[i]:boundaries[i + 1]] for i in range(self._n_channels)]
+
+    def _get_count_cube(self, selections, edges):
+        """
+        histogram in time and channel, in a single pass, the events in the provided selections (see
+        _select_events_in_intervals). Like in np.histogram, the bins include their left edge, and the last one
+        includes also its right edge.
+
+        The most recent results are kept (one for each set of selections and binning, up to
+        _max_cached_count_cubes), so that refitting the background with the same selections and binning, or going
+        back to a previous binning, does not need to go through the events again.
+
+        :param selections: list of slices
+        :param edges: the edges of the time bins
+        :return: (total counts in each time bin, array of counts with shape (n_bins, n_channels))
+        """
+
+        key = (tuple((selection.start, selection.stop) for selection in selections), tuple(edges))
+
+        if key in self._count_cube_cache:
+
+            # Mark it as the most recently used
+
+            cube = self._count_cube_cache.pop(key)
+
+            self._count_cube_cache[key] = cube
+
+            return cube
+
+        events = self._get_selected(self._arrival_times, selections)
+
+        n_bins = len(edges) - 1
+
+        # the events are time ordered, so the bins are contiguous ranges of events
+
+        boundaries = np.searchsorted(events, edges, side='left')
+        boundaries[-1] = np.searchsorted(events, edges[-1], side='right')
+
+        total_counts = np.diff(boundaries)
+
+        time_index = np.repeat(np.arange(n_bins), total_counts)
+
+        measurement = self._get_selected(self._measurement, selections)[boundaries[0]:boundaries[-1]]
+
+        channel_index, valid = self._get_channel_index(measurement)
+
+        combined_index = time_index[valid] * self._n_channels + channel_index[valid]
+
+        counts = np.bincount(combined_index, minlength=n_bins * self._n_channels).reshape(n_bins, self._n_channels)
+
+        self._count_cube_cache[key] = (total_counts, counts)
+
+        if len(self._count_cube_cache) > self._max_cached_count_cubes:
+
+            # Remove the least recently used
+
+            self._count_cube_cache.popitem(last=False)
+
+        return total_counts, counts
 
     def _fit_polynomials(self):
         """
@@ -367,51 +623,27 @@ class EventList(TimeSeries):
         self._fit_method_info['fit method'] = threeML_config['event list']['binned fit method']
 
         # Select all the events that are in the background regions
-        # and make a mask
-
-        all_bkg_masks = []
-
-        for selection in self._poly_intervals:
-            all_bkg_masks.append(
-                np.logical_and(self._arrival_times >= selection.start_time, self._arrival_times <= selection.stop_time))
-        poly_mask = all_bkg_masks[0]
-
-        # If there are multiple masks:
-        if len(all_bkg_masks) > 1:
-            for mask in all_bkg_masks[1:]:
-                poly_mask = np.logical_or(poly_mask, mask)
-
-        # Select the all the events in the poly selections
-        # We only need to do this once
 
-        total_poly_events = self._arrival_times[poly_mask]
-
-        # For the channel energies we will need to down select again.
-        # We can go ahead and do this to avoid repeated computations
-
-        total_poly_energies = self._measurement[poly_mask]
+        poly_selections = self._select_events_in_intervals(self._poly_intervals.start_times,
+                                                           self._poly_intervals.stop_times)
 
         # This calculation removes the unselected portion of the light curve
         # so that we are not fitting zero counts. It will be used in the channel calculations
         # as well
 
-        bin_width = 1.    # seconds
+        bin_width = float(threeML_config['event list']['binned fit bin width'])    # seconds
         these_bins = np.arange(self._start_time, self._stop_time, bin_width)
 
-        cnts, bins = np.histogram(total_poly_events, bins=these_bins)
+        # Histogram the events in the poly selections in time and channel at once, so that
+        # we do not need to go through the events again for each channel
 
-        # Find the mean time of the bins and calculate the exposure in each bin
-        mean_time = []
-        exposure_per_bin = []
-        for i in xrange(len(bins) - 1):
-            m = np.mean((bins[i], bins[i + 1]))
-            mean_time.append(m)
+        cnts, channel_cnts = self._get_count_cube(poly_selections, these_bins)
 
-            exposure_per_bin.append(self.exposure_over_interval(bins[i], bins[i + 1]))
+        # Find the mean time of the bins and calculate the exposure in each bin
 
-        mean_time = np.array(mean_time)
+        mean_time = 0.5 * (these_bins[:-1] + these_bins[1:])
 
-        exposure_per_bin = np.array(exposure_per_bin)
+        exposure_per_bin = self.exposure_over_intervals(these_bins[:-1], these_bins[1:])
 
         # Remove bins with zero counts
         all_non_zero_mask = []
@@ -440,35 +672,15 @@ class EventList(TimeSeries):
 
             self._optimal_polynomial_grade = self._user_poly_order
 
-        channels = range(self._first_channel, self._n_channels + self._first_channel)
-
-        polynomials = []
-
-        with progress_bar(self._n_channels, title="Fitting %s background" % self._instrument) as p:
-            for channel in channels:
-                channel_mask = total_poly_energies == channel
+        # Put data to fit in an x vector and y vector, for each channel
 
-                # Mask background events and current channel
-                # poly_chan_mask = np.logical_and(poly_mask, channel_mask)
-                # Select the masked events
-
-                current_events = total_poly_events[channel_mask]
-
-                # now bin the selected channel counts
-
-                cnts, bins = np.histogram(current_events, bins=these_bins)
-
-                # Put data to fit in an x vector and y vector
-
-                polynomial, _ = polyfit(mean_time[non_zero_mask], cnts[non_zero_mask], self._optimal_polynomial_grade,
-                                        exposure_per_bin[non_zero_mask])
-
-                polynomials.append(polynomial)
-                p.increase()
+        results = self._fit_binned_channels(mean_time[non_zero_mask], channel_cnts[non_zero_mask],
+                                            self._optimal_polynomial_grade, exposure_per_bin[non_zero_mask],
+                                            title="Fitting %s background" % self._instrument)
 
         # We are now ready to return the polynomials
 
-        self._polynomials = polynomials
+        self._polynomials = [polynomial for polynomial, _ in results]
 
     def _unbinned_fit_polynomials(self):
 
@@ -479,37 +691,27 @@ class EventList(TimeSeries):
         self._fit_method_info['fit method'] = threeML_config['event list']['unbinned fit method']
 
         # Select all the events that are in the background regions
-        # and make a mask
-
-        all_bkg_masks = []
 
         total_duration = 0.
 
-        poly_exposure = 0
-
         for selection in self._poly_intervals:
             total_duration += selection.duration
 
-            poly_exposure += self.exposure_over_interval(selection.start_time, selection.stop_time)
-
-            all_bkg_masks.append(
-                np.logical_and(self._arrival_times >= selection.start_time, self._arrival_times <= selection.stop_time))
-        poly_mask = all_bkg_masks[0]
+        poly_exposure = self.exposure_over_intervals(self._poly_intervals.start_times,
+                                                     self._poly_intervals.stop_times).sum()
 
-        # If there are multiple masks:
-        if len(all_bkg_masks) > 1:
-            for mask in all_bkg_masks[1:]:
-                poly_mask = np.logical_or(poly_mask, mask)
+        poly_selections = self._select_events_in_intervals(self._poly_intervals.start_times,
+                                                           self._poly_intervals.stop_times)
 
         # Select the all the events in the poly selections
         # We only need to do this once
 
-        total_poly_events = self._arrival_times[poly_mask]
+        total_poly_events = self._get_selected(self._arrival_times, poly_selections)
 
         # For the channel energies we will need to down select again.
         # We can go ahead and do this to avoid repeated computations
 
-        total_poly_energies = self._measurement[poly_mask]
+        total_poly_energies = self._get_selected(self._measurement, poly_selections)
 
         # Now we will find the the best poly order unless the use specified one
         # The total cnts (over channels) is binned to .1 sec intervals
@@ -526,34 +728,24 @@ class EventList(TimeSeries):
 
             self._optimal_polynomial_grade = self._user_poly_order
 
-        channels = range(self._first_channel, self._n_channels + self._first_channel)
+        # Split the events by channel in a single pass
 
-        # Check whether we are parallelizing or not
+        poly_events_per_channel = self._split_per_channel(total_poly_events, total_poly_energies)
 
         t_start = self._poly_intervals.start_times
         t_stop = self._poly_intervals.stop_times
 
-        polynomials = []
+        # The channels are fit serially or in parallel depending on the configuration (see _run_fits)
 
-        with progress_bar(self._n_channels, title="Fitting %s background" % self._instrument) as p:
-            for channel in channels:
-                channel_mask = total_poly_energies == channel
+        list_of_arguments = [(current_events, self._optimal_polynomial_grade, t_start, t_stop, poly_exposure)
+                             for current_events in poly_events_per_channel]
 
-                # Mask background events and current channel
-                # poly_chan_mask = np.logical_and(poly_mask, channel_mask)
-                # Select the masked events
-
-                current_events = total_poly_events[channel_mask]
-
-                polynomial, _ = unbinned_polyfit(current_events, self._optimal_polynomial_grade, t_start, t_stop,
-                                                 poly_exposure)
-
-                polynomials.append(polynomial)
-                p.increase()
+        results = self._run_fits(unbinned_polyfit, list_of_arguments,
+                                 title="Fitting %s background" % self._instrument)
 
         # We are now ready to return the polynomials
 
-        self._polynomials = polynomials
+        self._polynomials = [polynomial for polynomial, _ in results]
 
 
 class EventListWithDeadTime(EventList):
@@ -602,15 +794,24 @@ class EventListWithDeadTime(EventList):
 
         if dead_time is not None:
 
-            self._dead_time = np.asarray(dead_time)
+            dead_time = np.asarray(dead_time)
 
-            assert self._arrival_times.shape[0] == self._dead_time.shape[
+            assert self._arrival_times.shape[0] == dead_time.shape[
                 0], "Arrival time (%d) and Dead Time (%d) have different shapes" % (self._arrival_times.shape[0],
-                                                                                    self._dead_time.shape[0])
+                                                                                    dead_time.shape[0])
+
+            dead_time = self._apply_time_ordering(dead_time)
+
+            # The cumulative dead time allows to get the dead time over any interval as the difference
+            # of two elements, so there is no need to keep the dead time of each event
+
+            self._cumulative_dead_time = np.zeros(dead_time.shape[0] + 1)
+
+            np.cumsum(dead_time, out=self._cumulative_dead_time[1:])
 
         else:
 
-            self._dead_time = None
+            self._cumulative_dead_time = None
 
     def exposure_over_interval(self, start, stop):
         """
@@ -621,11 +822,11 @@ class EventListWithDeadTime(EventList):
         :return:
         """
 
-        mask = self._select_events(start, stop)
+        if self._cumulative_dead_time is not None:
 
-        if self._dead_time is not None:
+            first, last = self._get_event_range(start, stop)
 
-            interval_deadtime = (self._dead_time[mask]).sum()
+            interval_deadtime = self._cumulative_dead_time[last] - self._cumulative_dead_time[first]
 
         else:
 
@@ -633,6 +834,30 @@ class EventListWithDeadTime(EventList):
 
         return (stop - start) - interval_deadtime
 
+    def exposure_over_intervals(self, starts, stops):
+        """
+        calculate the exposure over each of the given intervals
+
+        :param starts: start times
+        :param stops: stop times
+        :return: array of exposures
+        """
+
+        starts = np.asarray(starts, dtype=float)
+        stops = np.asarray(stops, dtype=float)
+
+        if self._cumulative_dead_time is not None:
+
+            first, last = self._get_event_ranges(starts, stops)
+
+            interval_deadtime = self._cumulative_dead_time[last] - self._cumulative_dead_time[first]
+
+        else:
+
+            interval_deadtime = 0
+
+        return (stops - starts) - interval_deadtime
+
     def set_active_time_intervals(self, *args):
         '''Set the time interval(s) to be used during the analysis.
 
@@ -645,38 +870,22 @@ class EventListWithDeadTime(EventList):
 
         self._time_selection_exists = True
 
-        interval_masks = []
-
         time_intervals = TimeIntervalSet.from_strings(*args)
 
         time_intervals.merge_intersecting_intervals(in_place=True)
 
-        for interval in time_intervals:
-            tmin = interval.start_time
-            tmax = interval.stop_time
-
-            mask = self._select_events(tmin, tmax)
-
-            interval_masks.append(mask)
-
         self._time_intervals = time_intervals
 
-        time_mask = interval_masks[0]
-        if len(interval_masks) > 1:
-            for mask in interval_masks[1:]:
-                time_mask = np.logical_or(time_mask, mask)
+        # Select the events in the intervals (each event only once, even if two intervals touch)
+        # and count them in each channel
 
-        tmp_counts = []    # Temporary list to hold the total counts per chan
+        time_selections = self._select_events_in_intervals(time_intervals.start_times, time_intervals.stop_times)
 
-        for chan in range(self._first_channel, self._n_channels + self._first_channel):
+        self._counts = np.zeros(self._n_channels, dtype=int)
 
-            channel_mask = self._measurement == chan
-            counts_mask = np.logical_and(channel_mask, time_mask)
-            total_counts = len(self._arrival_times[counts_mask])
+        for selection in time_selections:
 
-            tmp_counts.append(total_counts)
-
-        self._counts = np.array(tmp_counts)
+            self._counts += self._count_per_channel(self._measurement[selection])
 
         tmp_counts = []
         tmp_err = []    # Temporary list to hold the err counts per chan
@@ -710,9 +919,10 @@ class EventListWithDeadTime(EventList):
         for interval in self._time_intervals:
             exposure += interval.duration
 
-        if self._dead_time is not None:
+        if self._cumulative_dead_time is not None:
 
-            total_dead_time = self._dead_time[time_mask].sum()
+            total_dead_time = sum(self._cumulative_dead_time[selection.stop] - self._cumulative_dead_time[selection.start]
+                                  for selection in time_selections)
         else:
 
             total_dead_time = 0.
@@ -776,10 +986,38 @@ class EventListWithDeadTimeFraction(EventList):
                 0], "Arrival time (%d) and Dead Time (%d) have different shapes" % (self._arrival_times.shape[0],
                                                                                     self._dead_time_fraction.shape[0])
 
+            self._dead_time_fraction = self._apply_time_ordering(self._dead_time_fraction)
+
+            # The cumulative dead time fraction allows to get the mean dead time fraction over any interval
+            # with two lookups
+
+            self._cumulative_dead_time_fraction = np.concatenate(([0.], np.cumsum(self._dead_time_fraction)))
+
         else:
 
             self._dead_time_fraction = None
 
+            self._cumulative_dead_time_fraction = None
+
+    def _mean_dead_time_fractions(self, starts, stops):
+        """
+        return the mean of the dead time fraction of the events in each interval (nan if there are no events)
+
+        :param starts: start times
+        :param stops: stop times
+        :return: array of mean dead time fractions
+        """
+
+        first, last = self._get_event_ranges(starts, stops)
+
+        total_fraction = self._cumulative_dead_time_fraction[last] - self._cumulative_dead_time_fraction[first]
+
+        # Like the mean of an empty array, this is nan when there are no events
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+
+            return total_fraction / (last - first)
+
     def exposure_over_interval(self, start, stop):
         """
         calculate the exposure over the given interval
@@ -789,13 +1027,11 @@ class EventListWithDeadTimeFraction(EventList):
         :return:
         """
 
-        mask = self._select_events(start, stop)
-
         interval = stop - start
 
         if self._dead_time_fraction is not None:
 
-            interval_deadtime = (self._dead_time_fraction[mask]).mean() * interval
+            interval_deadtime = self._mean_dead_time_fractions([start], [stop])[0] * interval
 
         else:
 
@@ -803,6 +1039,30 @@ class EventListWithDeadTimeFraction(EventList):
 
         return interval - interval_deadtime
 
+    def exposure_over_intervals(self, starts, stops):
+        """
+        calculate the exposure over each of the given intervals
+
+        :param starts: start times
+        :param stops: stop times
+        :return: array of exposures
+        """
+
+        starts = np.asarray(starts, dtype=float)
+        stops = np.asarray(stops, dtype=float)
+
+        intervals = stops - starts
+
+        if self._dead_time_fraction is not None:
+
+            interval_deadtime = self._mean_dead_time_fractions(starts, stops) * intervals
+
+        else:
+
+            interval_deadtime = 0
+
+        return intervals - interval_deadtime
+
     def set_active_time_intervals(self, *args):
         '''Set the time interval(s) to be used during the analysis.
 
@@ -815,37 +1075,22 @@ class EventListWithDeadTimeFraction(EventList):
 
         self._time_selection_exists = True
 
-        interval_masks = []
-
         time_intervals = TimeIntervalSet.from_strings(*args)
 
         time_intervals.merge_intersecting_intervals(in_place=True)
 
-        for interval in time_intervals:
-            tmin = interval.start_time
-            tmax = interval.stop_time
-
-            mask = self._select_events(tmin, tmax)
-
-            interval_masks.append(mask)
-
         self._time_intervals = time_intervals
 
-        time_mask = interval_masks[0]
-        if len(interval_masks) > 1:
-            for mask in interval_masks[1:]:
-                time_mask = np.logical_or(time_mask, mask)
+        # Select the events in the intervals (each event only once, even if two intervals touch)
+        # and count them in each channel
 
-        tmp_counts = []    # Temporary list to hold the total counts per chan
+        time_selections = self._select_events_in_intervals(time_intervals.start_times, time_intervals.stop_times)
 
-        for chan in range(self._first_channel, self._n_channels + self._first_channel):
-            channel_mask = self._measurement == chan
-            counts_mask = np.logical_and(channel_mask, time_mask)
-            total_counts = len(self._arrival_times[counts_mask])
+        self._counts = np.zeros(self._n_channels, dtype=int)
 
-            tmp_counts.append(total_counts)
+        for selection in time_selections:
 
-        self._counts = np.array(tmp_counts)
+            self._counts += self._count_per_channel(self._measurement[selection])
 
         tmp_counts = []
         tmp_err = []    # Temporary list to hold the err counts per chan
@@ -877,10 +1122,14 @@ class EventListWithDeadTimeFraction(EventList):
 
         exposure = 0.
         total_dead_time = 0.
-        for interval, imask in zip(self._time_intervals, interval_masks):
+        for interval in self._time_intervals:
             exposure += interval.duration
-            if self._dead_time_fraction is not None:
-                total_dead_time += interval.duration * self._dead_time_fraction[imask].mean()
+
+        if self._dead_time_fraction is not None:
+            durations = np.array([interval.duration for interval in self._time_intervals])
+            mean_fractions = self._mean_dead_time_fractions(self._time_intervals.start_times,
+                                                            self._time_intervals.stop_times)
+            total_dead_time = np.sum(durations * mean_fractions)
 
         self._exposure = exposure - total_dead_time
 
@@ -943,86 +1192,77 @@ class EventListWithLiveTime(EventList):
         super(EventListWithLiveTime, self).__init__(arrival_times, measurement, n_channels, start_time, stop_time,
                                                     quality, first_channel, ra, dec, mission, instrument, verbose)
 
-        self._live_time = np.asarray(live_time)
-        self._live_time_starts = np.asarray(live_time_starts)
-        self._live_time_stops = np.asarray(live_time_stops)
-
-    def exposure_over_interval(self, start, stop):
-        """
+        # The live time bins are sorted by start time, and we keep the cumulative live time at their start. In this
+        # way the live time between any two times only needs binary searches (see _cumulative_live_time)
 
-        :param start: start time of interval
-        :param stop: stop time of interval
-        :return: exposure
-        """
+        ordering = np.argsort(live_time_starts, kind='mergesort')
 
-        # First see if the interval is completely contained inside a
-        # livetime interval. In this case we only compute that.
+        self._live_time = np.asarray(live_time, dtype=float)[ordering]
+        self._live_time_starts = np.asarray(live_time_starts, dtype=float)[ordering]
+        self._live_time_stops = np.asarray(live_time_stops, dtype=float)[ordering]
 
-        # Note that this is explicitly on the open boundary of the
-        # intervals because the closed boundary is covered in the
-        # next step
+        self._live_time_index = np.concatenate(([0.], np.cumsum(self._live_time)))
 
-        inside_idx = np.logical_and(self._live_time_starts < start, stop < self._live_time_stops)
-
-        # see if it contains elements
-
-        if self._live_time[inside_idx]:
-
-            # we want to take a fraction of the live time covered
-
-            dt = self._live_time_stops[inside_idx] - self._live_time_starts[inside_idx]
-
-            fraction = (stop - start) / dt
-
-            total_livetime = self._live_time[inside_idx] * fraction
-
-        else:
-
-            # First we get the live time of bins that are fully contained in the given interval
-            # We now go for the closed interval because it is possible to have overlap with other intervals
-            # when a closed interval exists... but not when there is only an open interval
+    def _cumulative_live_time(self, times):
+        """
+        return the live time accumulated from the start of the first live time bin up to each of the provided times.
+        Within each bin, the live time is assumed to be distributed uniformly
 
-            full_inclusion_idx = np.logical_and(start <= self._live_time_starts, stop >= self._live_time_stops)
+        :param times: array of times
+        :return: array of cumulative live times
+        """
 
-            full_inclusion_livetime = self._live_time[full_inclusion_idx].sum()
+        times = np.asarray(times, dtype=float)
 
-            # Now we get the fractional parts on the left and right
+        if self._live_time.shape[0] == 0:
 
-            # Get the fractional part of the left bin
+            return np.zeros_like(times)
 
-            left_remainder_idx = np.logical_and(start <= self._live_time_stops, self._live_time_starts <= start)
+        # index of the last bin starting before each time (-1 before the first bin)
 
-            dt = self._live_time_stops[left_remainder_idx] - self._live_time_starts[left_remainder_idx]
+        idx = np.searchsorted(self._live_time_starts, times, side='right') - 1
 
-            # we want the distance to the stop of this bin
+        before_first_bin = idx < 0
 
-            distance_from_next_bin = self._live_time_stops[left_remainder_idx] - start
+        idx = np.maximum(idx, 0)
 
-            fraction = distance_from_next_bin / dt
+        bin_starts = self._live_time_starts[idx]
+        bin_widths = self._live_time_stops[idx] - bin_starts
 
-            left_fractional_livetime = self._live_time[left_remainder_idx] * fraction
+        # fraction of the bin covered up to each time. This is 1 after the end of the bin (i.e., in a gap
+        # between bins)
 
-            # Get the fractional part of the right bin
+        with np.errstate(invalid='ignore', divide='ignore'):
 
-            right_remainder_idx = np.logical_and(self._live_time_starts <= stop, stop <= self._live_time_stops)
+            fraction = np.where(bin_widths > 0, (times - bin_starts) / bin_widths, 1.)
 
-            dt = self._live_time_stops[right_remainder_idx] - self._live_time_starts[right_remainder_idx]
+        fraction = np.clip(fraction, 0., 1.)
 
-            # we want the distance from the last full bin
+        cumulative_live_time = self._live_time_index[idx] + self._live_time[idx] * fraction
 
-            distance_from_next_bin = stop - self._live_time_starts[right_remainder_idx]
+        return np.where(before_first_bin, 0., cumulative_live_time)
 
-            fraction = distance_from_next_bin / dt
+    def exposure_over_interval(self, start, stop):
+        """
 
-            right_fractional_livetime = self._live_time[right_remainder_idx] * fraction
+        :param start: start time of interval
+        :param stop: stop time of interval
+        :return: exposure
+        """
 
-            # sum up all the live time
+        return self.exposure_over_intervals([start], [stop])[0]
 
-            total_livetime = full_inclusion_livetime + left_fractional_livetime + right_fractional_livetime
+    def exposure_over_intervals(self, starts, stops):
+        """
+        calculate the exposure (i.e., the live time) over each of the given intervals. The bins of live time partially
+        covered by an interval contribute proportionally to the covered fraction
 
-        # the sum at the end converts all the arrays to floats
+        :param starts: start times of the intervals
+        :param stops: stop times of the intervals
+        :return: array of exposures
+        """
 
-        return total_livetime.sum()
+        return self._cumulative_live_time(stops) - self._cumulative_live_time(starts)
 
     def set_active_time_intervals(self, *args):
         '''Set the time interval(s) to be used during the analysis.
@@ -1036,36 +1276,22 @@ class EventListWithLiveTime(EventList):
 
         self._time_selection_exists = True
 
-        interval_masks = []
-
         time_intervals = TimeIntervalSet.from_strings(*args)
 
         time_intervals.merge_intersecting_intervals(in_place=True)
 
-        for interval in time_intervals:
-            tmin = interval.start_time
-            tmax = interval.stop_time
-            mask = self._select_events(tmin, tmax)
-
-            interval_masks.append(mask)
-
         self._time_intervals = time_intervals
 
-        time_mask = interval_masks[0]
-        if len(interval_masks) > 1:
-            for mask in interval_masks[1:]:
-                time_mask = np.logical_or(time_mask, mask)
+        # Select the events in the intervals (each event only once, even if two intervals touch)
+        # and count them in each channel
 
-        tmp_counts = []    # Temporary list to hold the total counts per chan
+        time_selections = self._select_events_in_intervals(time_intervals.start_times, time_intervals.stop_times)
 
-        for chan in range(self._first_channel, self._n_channels + self._first_channel):
-            channel_mask = self._measurement == chan
-            counts_mask = np.logical_and(channel_mask, time_mask)
-            total_counts = len(self._arrival_times[counts_mask])
+        self._counts = np.zeros(self._n_channels, dtype=int)
 
-            tmp_counts.append(total_counts)
+        for selection in time_selections:
 
-        self._counts = np.array(tmp_counts)
+            self._counts += self._count_per_channel(self._measurement[selection])
 
         tmp_counts = []
         tmp_err = []    # Temporary list to hold the err counts per chan
@@ -1096,11 +1322,12 @@ class EventListWithLiveTime(EventList):
 
         # Live time correction
 
-        exposure = 0.
         total_real_time = 0.
         for interval in self._time_intervals:
             total_real_time += interval.duration
-            exposure += self.exposure_over_interval(interval.start_time, interval.stop_time)
+
+        exposure = self.exposure_over_intervals(self._time_intervals.start_times,
+                                                self._time_intervals.stop_times).sum()
 
         # In this case the exposure is the total live time
 
@@ -155,18 +155,19 @@ class Polynomial(object):
 
     def _eval_basis(self, x):
 
-        return (1. / self._i_plus_1) * np.power(x, self._i_plus_1)
+        # the basis is computed along a new last axis, so that x can be a scalar or an array
+
+        return (1. / self._i_plus_1) * np.power(np.asarray(x, dtype=float)[..., np.newaxis], self._i_plus_1)
 
     def integral_error(self, xmin, xmax):
         """
-        computes the integral error of an interval
+        computes the integral error of an interval (or of many intervals, if xmin and xmax are arrays)
         :param xmin: start of the interval
         :param xmax: stop of the interval
         :return: interval error
         """
         c = self._eval_basis(xmax) - self._eval_basis(xmin)
-        tmp = c.dot(self._cov_matrix)
-        err2 = tmp.dot(c)
+        err2 = np.einsum('...i,ij,...j->...', c, self._cov_matrix, c)
 
         return np.sqrt(err2)
 
@@ -307,7 +308,7 @@ class PolyBinnedLogLikelihood(PolyLogLikelihood):
         # whatever value has log(M_i). Thus, initialize the whole vector v = {v_i}
         # to zero, then overwrite the elements corresponding to D_i > 0
 
-        d_times_logM = np.zeros_like(self._counts)
+        d_times_logM = np.zeros(len(self._counts))
 
 
         d_times_logM[self._non_zero_mask] = self._counts[self._non_zero_mask] * logM[self._non_zero_mask]
@@ -409,9 +410,280 @@ class PolyUnbinnedLogLikelihood(PolyLogLikelihood):
 
 
 
+def _newton_poisson_fit(design, linear_term, weights, initial_guess, max_iterations=100, tolerance=1e-9):
+    """
+    Minimize, with Newton's method, the convex function
+
+    L(c) = linear_term . c - sum_i weights_i * log( (design . c)_i )
+
+    which is the form of both the binned and the unbinned Poisson likelihood of a polynomial (with design the
+    polynomial basis evaluated at the bins/events). The gradient and the Hessian are analytic:
+
+    g = linear_term - design^T (weights / M),    H = design^T diag(weights / M^2) design,    with M = design . c
+
+    Many independent problems sharing the same design matrix (for example the channels of a time series, which share
+    the time bins) are solved at once, as a stacked linear algebra problem. The step is halved until the model is
+    positive everywhere and the function decreases.
+
+    :param design: design matrix, (n_points, n_parameters)
+    :param linear_term: (n_parameters, n_problems), or (n_parameters, 1) if shared by all problems
+    :param weights: (n_points, n_problems)
+    :param initial_guess: (n_parameters, n_problems). The model must be positive everywhere for the initial guess
+    :param max_iterations: maximum number of Newton iterations
+    :param tolerance: the iterations stop when half of the squared Newton decrement (the expected decrease of the
+    function) is below this value
+    :return: (best fit parameters, Hessian at the best fit with shape (n_problems, n_parameters, n_parameters),
+    value of the function at the best fit, boolean array telling which problems converged)
+    """
+
+    coefficients = np.array(initial_guess, dtype=float)
+
+    n_problems = coefficients.shape[1]
+
+    def evaluate(these_coefficients):
+
+        model = design.dot(these_coefficients)
+
+        positive = np.all(model > 0, axis=0)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+
+            log_model = np.log(np.where(model > 0, model, 1.0))
+
+        values = np.sum(linear_term * these_coefficients, axis=0) - np.sum(weights * log_model, axis=0)
+
+        return np.where(positive, values, np.inf), model
+
+    values, model = evaluate(coefficients)
+
+    converged = np.zeros(n_problems, dtype=bool)
+
+    for _ in range(max_iterations):
+
+        ratio = weights / model
+
+        gradient = linear_term - design.T.dot(ratio)
+
+        hessian = np.einsum('ik,im,il->mkl', design, ratio / model, design)
+
+        try:
+
+            step = np.linalg.solve(hessian, gradient.T[:, :, np.newaxis])[:, :, 0].T
+
+        except np.linalg.LinAlgError:
+
+            # At least one of the Hessians is singular, use the least squares solution for all of them
+
+            step = np.array([np.linalg.lstsq(hessian[j], gradient[:, j], rcond=-1)[0]
+                             for j in range(n_problems)]).T
+
+        decrement = np.sum(gradient * step, axis=0)
+
+        converged = np.logical_or(converged, decrement / 2.0 < tolerance)
+
+        if np.all(converged):
+
+            break
+
+        # Backtracking line search (on the problems which did not converge yet)
+
+        step_size = np.where(converged, 0.0, 1.0)
+
+        for _ in range(60):
+
+            new_values, new_model = evaluate(coefficients - step_size * step)
+
+            accepted = np.logical_or(new_values <= values - 1e-4 * step_size * decrement, converged)
+
+            if np.all(accepted):
+
+                break
+
+            step_size = np.where(accepted, step_size, step_size / 2.0)
+
+        else:
+
+            # No decrease was possible for some problems: we are at the numerical precision limit for them
+
+            stuck = np.logical_not(accepted)
+
+            step_size[stuck] = 0.0
+
+            converged[stuck] = True
+
+            new_values, new_model = evaluate(coefficients - step_size * step)
+
+        coefficients = coefficients - step_size * step
+
+        values = new_values
+
+        model = new_model
+
+    # Final Hessian
+
+    ratio = weights / model
+
+    hessian = np.einsum('ik,im,il->mkl', design, ratio / model, design)
+
+    return coefficients, hessian, values, converged
+
+
+def _polynomial_from_newton_fit(coefficients, hessian, scale):
+    """
+    Build a Polynomial from the result of _newton_poisson_fit obtained with the variable x / scale, with the
+    covariance matrix given by the inverse of the Hessian
+
+    :param coefficients: best fit coefficients for the scaled variable
+    :param hessian: Hessian matrix at the best fit (for the scaled variable)
+    :param scale: the scale of the variable
+    :return: a Polynomial instance
+    """
+
+    # c_k = d_k / scale^k, so the covariance matrix transforms with the diagonal matrix of 1 / scale^k
+
+    scaling = np.power(float(scale), -np.arange(coefficients.shape[0], dtype=float))
+
+    polynomial = Polynomial(coefficients * scaling)
+
+    try:
+
+        covariance_matrix = np.linalg.inv(hessian)
+
+    except np.linalg.LinAlgError:
+
+        custom_warnings.warn("Cannot invert Hessian matrix, looks like the matrix is singluar")
+
+        n_dim = coefficients.shape[0]
+
+        polynomial._cov_matrix = np.zeros((n_dim, n_dim)) * np.nan
+
+    else:
+
+        polynomial._cov_matrix = covariance_matrix * np.outer(scaling, scaling)
+
+    return polynomial
+
+
+def _get_scale(values):
+    """
+    Return the scale used to normalize the variable of the polynomial, so that the powers of the normalized variable
+    have similar magnitudes (which keeps the Hessian well conditioned)
+    """
+
+    scale = np.max(np.abs(values)) if len(values) > 0 else 1.0
+
+    return scale if scale > 0 else 1.0
+
+
+def batch_polyfit(x, counts, grade, exposure):
+    """
+    Fit a polynomial to each column of counts with a Newton solver on the binned Poisson likelihood. All the columns
+    (for example the channels of a time series) share the bins, so they are fit at once. The results are the same as
+    calling polyfit on each column, except that the optimizer is not the one set in the configuration. Columns for
+    which the Newton iterations fail are fit with the configured optimizer instead.
+
+    :param x: the center of the bins
+    :param counts: array of counts with shape (n_bins, n_columns)
+    :param grade: grade of the polynomial
+    :param exposure: exposure of each bin
+    :return: list of (polynomial, minimum of the -log(likelihood)) tuples, one per column
+    """
+
+    x = np.asarray(x, dtype=float)
+    counts = np.asarray(counts, dtype=float)
+    exposure = np.asarray(exposure, dtype=float) * np.ones_like(x)
+
+    n_columns = counts.shape[1]
+
+    results = [None] * n_columns
+
+    n_non_zero = np.sum(counts > 0, axis=0)
+
+    # Check that we have enough non-empty bins to fit the requested grade of polynomial, otherwise lower the grade.
+    # Columns without counts get a "zero polynomial"
+
+    grades = np.minimum(grade, np.maximum(n_non_zero - 3, 0))
+
+    for i in np.where(n_non_zero == 0)[0]:
+
+        results[i] = (Polynomial([0.0]), 0.0)
+
+    # Bins with zero exposure have a null model and (must have) no counts, so they do not contribute
+
+    valid_bins = exposure > 0
+
+    scale = _get_scale(x[valid_bins])
+
+    for this_grade in np.unique(grades[n_non_zero > 0]):
+
+        columns = np.where(np.logical_and(grades == this_grade, n_non_zero > 0))[0]
+
+        these_counts = counts[valid_bins][:, columns]
+
+        design = exposure[valid_bins, np.newaxis] * np.power(x[valid_bins, np.newaxis] / scale,
+                                                              np.arange(this_grade + 1))
+
+        linear_term = design.sum(axis=0)[:, np.newaxis]
+
+        initial_guess = _get_initial_guess(x[valid_bins] / scale, these_counts, this_grade, exposure[valid_bins])
+
+        coefficients, hessian, values, converged = _newton_poisson_fit(design, linear_term, these_counts,
+                                                                       initial_guess)
+
+        for j, column in enumerate(columns):
+
+            if converged[j] and np.all(np.isfinite(coefficients[:, j])):
+
+                results[column] = (_polynomial_from_newton_fit(coefficients[:, j], hessian[j], scale), values[j])
+
+            else:
+
+                results[column] = _minimize_polyfit(x, counts[:, column], grade, exposure)
+
+    return results
+
+
+def _get_initial_guess(x, counts, grade, exposure):
+    """
+    Return an initial guess for the fit of each column of counts, for which the polynomial model is positive in all
+    bins: a least square fit, or a constant if that is not positive everywhere
+
+    :return: (grade + 1, n_columns) array
+    """
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+
+        # (note that polyfit returns the coefficient starting from the maximum grade,
+        # thus we need to reverse the order)
+
+        initial_guess = np.polyfit(x, counts / exposure[:, np.newaxis], grade).reshape(grade + 1, -1)[::-1]
+
+    model = np.power(x[:, np.newaxis], np.arange(grade + 1)).dot(initial_guess)
+
+    not_positive = np.logical_not(np.all(model > 0, axis=0))
+
+    initial_guess[:, not_positive] = 0.0
+    initial_guess[0, not_positive] = counts[:, not_positive].sum(axis=0) / exposure.sum()
+
+    return initial_guess
+
+
 def polyfit(x, y, grade, exposure):
     """ function to fit a polynomial to event data. not a member to allow parallel computation """
 
+    if threeML_config['event list']['newton solver']:
+
+        return batch_polyfit(x, np.asarray(y)[:, np.newaxis], grade, exposure)[0]
+
+    else:
+
+        return _minimize_polyfit(x, y, grade, exposure)
+
+
+def _minimize_polyfit(x, y, grade, exposure):
+    """ fit a polynomial to binned data using the optimizer set in the configuration """
+
     # Check that we have enough counts to perform the fit, otherwise
     # return a "zero polynomial"
     non_zero_mask = y > 0
@@ -485,12 +757,65 @@ def polyfit(x, y, grade, exposure):
     return final_polynomial, min_log_likelihood
 
 
+def _newton_unbinned_polyfit(events, grade, t_start, t_stop, exposure):
+    """
+    Fit a polynomial to event data with a Newton solver on the unbinned Poisson likelihood. Returns None if the
+    iterations fail
+
+    :return: (polynomial, minimum of the -log(likelihood)) or None
+    """
+
+    events = np.asarray(events, dtype=float)
+    t_start = np.atleast_1d(np.asarray(t_start, dtype=float))
+    t_stop = np.atleast_1d(np.asarray(t_stop, dtype=float))
+
+    # Check that we have enough events to fit this grade of polynomial, otherwise lower the grade
+
+    grade = int(min(grade, max(events.shape[0] - 2, 0)))
+
+    scale = _get_scale(np.concatenate((t_start, t_stop)))
+
+    powers = np.arange(grade + 1)
+
+    # The expected number of events is the integral of the polynomial over the intervals (linear in the coefficients),
+    # while the density at each event includes the exposure
+
+    linear_term = np.sum((np.power(t_stop[:, np.newaxis] / scale, powers + 1) -
+                          np.power(t_start[:, np.newaxis] / scale, powers + 1)) * scale / (powers + 1), axis=0)
+
+    design = exposure * np.power(events[:, np.newaxis] / scale, powers)
+
+    # Start from the constant rate with the right number of events
+
+    initial_guess = np.zeros((grade + 1, 1))
+    initial_guess[0, 0] = events.shape[0] / np.sum(t_stop - t_start)
+
+    coefficients, hessian, values, converged = _newton_poisson_fit(design, linear_term[:, np.newaxis],
+                                                                   np.ones((events.shape[0], 1)), initial_guess)
+
+    if converged[0] and np.all(np.isfinite(coefficients)):
+
+        return _polynomial_from_newton_fit(coefficients[:, 0], hessian[0], scale), values[0]
+
+    else:
+
+        return None
+
+
 def unbinned_polyfit(events, grade, t_start, t_stop, exposure, initial_amplitude=1):
     """
     function to fit a polynomial to event data. not a member to allow parallel computation
 
     """
 
+    if threeML_config['event list']['newton solver'] and len(events) > 0:
+
+        result = _newton_unbinned_polyfit(events, grade, t_start, t_stop, exposure)
+
+        if result is not None:
+
+            return result
+
     # first do a simple amplitude fit
     with warnings.catch_warnings():
         warnings.simplefilter("ignore")
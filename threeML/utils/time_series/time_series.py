@@ -7,11 +7,15 @@ import numpy as np
 import pandas as pd
 from pandas import HDFStore
 
+from threeML.config.config import threeML_config
 from threeML.exceptions.custom_exceptions import custom_warnings
+from threeML.io.data_cache import get_data_cache
 from threeML.io.file_utils import sanitize_filename
+from threeML.io.progress_bar import progress_bar
+from threeML.parallel.executors import get_executor
 from threeML.utils.spectrum.binned_spectrum import Quality
 from threeML.utils.time_interval import TimeIntervalSet
-from threeML.utils.time_series.polynomial import polyfit, unbinned_polyfit, Polynomial
+from threeML.utils.time_series.polynomial import polyfit, unbinned_polyfit, batch_polyfit, Polynomial
 
 
 class ReducingNumberOfThreads(Warning):
@@ -31,6 +35,23 @@ def ceildiv(a, b):
     return -(-a // b)
 
 
+class _FitWorker(object):
+    """
+    Worker for TimeSeries._run_fits: runs the fitter with the arguments of the i-th fit. It is a module-level class
+    holding only module-level functions and arrays, so it can be sent to processes started with any method
+    (including "spawn", where nothing is inherited from the parent process)
+    """
+
+    def __init__(self, fitter, list_of_arguments):
+
+        self._fitter = fitter
+        self._list_of_arguments = list_of_arguments
+
+    def __call__(self, i):
+
+        return self._fitter(*self._list_of_arguments[i])
+
+
 class TimeSeries(object):
     def __init__(self, start_time, stop_time, n_channels, native_quality=None,
                  first_channel=1, ra=None, dec=None, mission=None, instrument=None, verbose=True, edges=None):
@@ -113,6 +134,10 @@ class TimeSeries(object):
 
         self._fit_method_info = {"bin type": None, 'fit method': None}
 
+        # the file the data come from, used to keep the background polynomials in the data cache
+
+        self._data_cache_source = None
+
     def set_active_time_intervals(self, *args):
 
         raise RuntimeError("Must be implemented in subclass")
@@ -178,7 +203,8 @@ class TimeSeries(object):
     def get_total_poly_count(self, start, stop, mask=None):
         """
 
-        Get the total poly counts
+        Get the total poly counts. Start and stop can also be arrays, in which case an array with the counts in
+        each interval is returned
 
         :param start:
         :param stop:
@@ -197,7 +223,8 @@ class TimeSeries(object):
     def get_total_poly_error(self, start, stop, mask=None):
         """
 
-        Get the total poly error
+        Get the total poly error. Start and stop can also be arrays, in which case an array with the error in
+        each interval is returned
 
         :param start:
         :param stop:
@@ -213,6 +240,24 @@ class TimeSeries(object):
 
         return np.sqrt(total_counts)
 
+    def get_poly_counts_over_intervals(self, starts, stops):
+        """
+
+        Integrate the polynomial of each channel over each of the given intervals
+
+        :param starts: start times of the intervals
+        :param stops: stop times of the intervals
+        :return: (counts, errors), both arrays with shape (n_intervals, n_channels)
+        """
+
+        starts = np.asarray(starts, dtype=float)
+        stops = np.asarray(stops, dtype=float)
+
+        counts = np.array([p.integral(starts, stops) for p in self._polynomials]).reshape(self._n_channels, -1)
+        errors = np.array([p.integral_error(starts, stops) for p in self._polynomials]).reshape(self._n_channels, -1)
+
+        return counts.T, errors.T
+
     @property
     def bins(self):
 
@@ -276,6 +321,18 @@ class TimeSeries(object):
 
         raise RuntimeError("Must be implemented in sub class")
 
+    def exposure_over_intervals(self, starts, stops):
+        """
+        calculate the exposure over each of the given intervals. Subclasses can override this with a vectorized
+        computation
+
+        :param starts: start times of the intervals
+        :param stops: stop times of the intervals
+        :return: array with the exposure of each interval
+        """
+
+        return np.array([self.exposure_over_interval(start, stop) for start, stop in zip(starts, stops)], dtype=float)
+
     def counts_over_interval(self, start, stop):
         """
         return the number of counts in the selected interval
@@ -299,6 +356,20 @@ class TimeSeries(object):
 
         raise RuntimeError("Must be implemented in sub class")
 
+    def count_per_channel_over_intervals(self, starts, stops):
+        """
+        return the number of counts in each channel for each of the given intervals. Subclasses can override this
+        with a vectorized computation
+
+        :param starts: start times of the intervals
+        :param stops: stop times of the intervals
+        :return: array of counts with shape (n_intervals, n_channels)
+        """
+
+        counts = [self.count_per_channel_over_interval(start, stop) for start, stop in zip(starts, stops)]
+
+        return np.array(counts, dtype=float).reshape(len(counts), self._n_channels)
+
     def set_polynomial_fit_interval(self, *time_intervals, **options):
         """Set the time interval to fit the background.
         Multiple intervals can be input as separate arguments
@@ -382,18 +453,24 @@ class TimeSeries(object):
 
         self._poly_intervals = poly_intervals
 
-        # Fit the events with the given intervals
-        if unbinned:
+        self._unbinned = unbinned  # keep track!
 
-            self._unbinned = True  # keep track!
+        # Fit the events with the given intervals, unless the same fit has been done before and it is in the
+        # data cache
 
-            self._unbinned_fit_polynomials()
+        cache_entry = self._get_polynomials_cache_entry()
 
-        else:
+        if not self._restore_polynomials_from_cache(cache_entry):
 
-            self._unbinned = False
+            if unbinned:
 
-            self._fit_polynomials()
+                self._unbinned_fit_polynomials()
+
+            else:
+
+                self._fit_polynomials()
+
+            self._store_polynomials_in_cache(cache_entry)
 
         # we have a fit now
 
@@ -463,6 +540,79 @@ class TimeSeries(object):
 
 
 
+        return self._build_information_dict(counts, counts_err, rates, rate_err, exposure,
+                                            self._time_intervals.absolute_start_time,
+                                            self._time_intervals.absolute_stop_time)
+
+    def get_information_dicts(self, starts, stops, use_poly=False, extract=False):
+        """
+        Return the same information as get_information_dict for each of the given intervals, as if each of them
+        had been selected with set_active_time_intervals. The counts, exposures and polynomial integrals of all the
+        intervals are computed at once, and the active time selection is left untouched
+
+        :param starts: start times of the intervals
+        :param stops: stop times of the intervals
+        :param use_poly: (bool) choose to build from the polynomial fits
+        :param extract: (bool) choose to build from the counts in the polynomial selections
+        :return: a list of dictionaries
+        """
+
+        starts = np.asarray(starts, dtype=float)
+        stops = np.asarray(stops, dtype=float)
+
+        n_intervals = starts.shape[0]
+
+        if extract or use_poly:
+
+            if not self._poly_fit_exists:
+                raise RuntimeError('A polynomial fit to the channels does not exist!')
+
+        if extract:
+
+            # the counts in the polynomial selections are the same for all the intervals
+
+            counts = np.tile(self._poly_selected_counts, (n_intervals, 1))
+            counts_err = [None] * n_intervals
+            exposures = np.ones(n_intervals) * self._poly_exposure
+            rates = counts / self._poly_exposure
+            rate_err = [None] * n_intervals
+
+        else:
+
+            exposures = self.exposure_over_intervals(starts, stops)
+
+            if use_poly:
+
+                counts, counts_err = self.get_poly_counts_over_intervals(starts, stops)
+
+                # removing negative counts
+
+                idx = counts < 0.
+
+                counts[idx] = 0.
+                counts_err[idx] = 0.
+
+                rate_err = counts_err / exposures[:, np.newaxis]
+
+            else:
+
+                counts = self.count_per_channel_over_intervals(starts, stops)
+                counts_err = [None] * n_intervals
+                rate_err = [None] * n_intervals
+
+            rates = counts / exposures[:, np.newaxis]
+
+        return [self._build_information_dict(counts[i], counts_err[i], rates[i], rate_err[i], exposures[i],
+                                             starts[i], stops[i])
+                for i in range(n_intervals)]
+
+    def _build_information_dict(self, counts, counts_err, rates, rate_err, exposure, tstart, tstop):
+        """
+        Build the dictionary returned by get_information_dict and get_information_dicts
+
+        :return: a dictionary
+        """
+
         if self._native_quality is None:
 
             quality = np.zeros_like(counts, dtype=int)
@@ -475,8 +625,8 @@ class TimeSeries(object):
 
         container_dict['instrument'] = self._instrument
         container_dict['telescope'] = self._mission
-        container_dict['tstart'] = self._time_intervals.absolute_start_time
-        container_dict['telapse'] = self._time_intervals.absolute_stop_time - self._time_intervals.absolute_start_time
+        container_dict['tstart'] = tstart
+        container_dict['telapse'] = tstop - tstart
         container_dict['channel'] = np.arange(self._n_channels) + self._first_channel
         container_dict['counts'] = counts
         container_dict['counts error'] = counts_err
@@ -545,12 +695,11 @@ class TimeSeries(object):
 
         min_grade = 0
         max_grade = 4
-        log_likelihoods = []
 
-        for grade in range(min_grade, max_grade + 1):
-            polynomial, log_like = polyfit(bins, cnts, grade, exposure)
+        results = self._run_fits(polyfit, [(bins, cnts, grade, exposure)
+                                           for grade in range(min_grade, max_grade + 1)])
 
-            log_likelihoods.append(log_like)
+        log_likelihoods = [log_like for polynomial, log_like in results]
 
         # Found the best one
         delta_loglike = np.array(map(lambda x: 2 * (x[0] - x[1]), zip(log_likelihoods[:-1], log_likelihoods[1:])))
@@ -593,15 +742,14 @@ class TimeSeries(object):
 
         min_grade = 0
         max_grade = 4
-        log_likelihoods = []
 
         t_start = self._poly_intervals.start_times
         t_stop = self._poly_intervals.stop_times
 
-        for grade in range(min_grade, max_grade + 1):
-            polynomial, log_like = unbinned_polyfit(events, grade, t_start, t_stop, exposure)
+        results = self._run_fits(unbinned_polyfit, [(events, grade, t_start, t_stop, exposure)
+                                                    for grade in range(min_grade, max_grade + 1)])
 
-            log_likelihoods.append(log_like)
+        log_likelihoods = [log_like for polynomial, log_like in results]
 
         # Found the best one
         delta_loglike = np.array(map(lambda x: 2 * (x[0] - x[1]), zip(log_likelihoods[:-1], log_likelihoods[1:])))
@@ -621,6 +769,80 @@ class TimeSeries(object):
 
         return best_grade
 
+    @staticmethod
+    def _run_fits(fitter, list_of_arguments, title=None):
+        """
+        Run fitter(*arguments) for each element of list_of_arguments, returning the results in the same order.
+
+        The fits are independent, so they run serially or in a pool of threads or processes depending on the
+        'fit executor' and 'fit workers' event list configuration values (see threeML.parallel.executors). The
+        results do not depend on the execution mode. Note that the fits hold the GIL for most of their time, so
+        threads give little or no speed-up: use processes for that.
+
+        :param fitter: the fit function (for example polyfit or unbinned_polyfit). It must be a module-level function
+        :param list_of_arguments: a list of tuples of arguments for the fitter
+        :param title: if provided, show a progress bar with this title
+        :return: list of results
+        """
+
+        n_fits = len(list_of_arguments)
+
+        n_workers = int(threeML_config['event list']['fit workers'])
+
+        results = [None] * n_fits
+
+        # Each process receives the worker (with all the arguments) once, and then only the index of each fit
+
+        worker = _FitWorker(fitter, list_of_arguments)
+
+        with get_executor(threeML_config['event list']['fit executor'],
+                          n_workers=n_workers if n_workers > 0 else None) as executor:
+
+            # The results are collected as they arrive, and put in place using their index
+
+            fits = executor.imap_unordered(worker, range(n_fits))
+
+            if title is None:
+
+                for i, result in fits:
+
+                    results[i] = result
+
+            else:
+
+                with progress_bar(n_fits, title=title) as p:
+
+                    for i, result in fits:
+
+                        results[i] = result
+
+                        p.increase()
+
+        return results
+
+    def _fit_binned_channels(self, x, counts, grade, exposure, title=None):
+        """
+        Fit a polynomial to the binned light curve of each channel
+
+        :param x: the center of the time bins
+        :param counts: array of counts with shape (n_bins, n_channels)
+        :param grade: grade of the polynomials
+        :param exposure: exposure of each bin
+        :param title: title of the progress bar
+        :return: list of (polynomial, minimum of the -log(likelihood)) tuples, one per channel
+        """
+
+        if threeML_config['event list']['newton solver']:
+
+            # All channels share the time bins, so the Newton solver fits them at once
+
+            return batch_polyfit(x, counts, grade, exposure)
+
+        else:
+
+            return self._run_fits(polyfit, [(x, counts[:, channel_index], grade, exposure)
+                                            for channel_index in range(counts.shape[1])], title=title)
+
     def _fit_polynomials(self):
 
         raise NotImplementedError('this must be implemented in a subclass')
@@ -629,6 +851,124 @@ class TimeSeries(object):
 
         raise NotImplementedError('this must be implemented in a subclass')
 
+    def set_data_cache_source(self, filename, **parameters):
+        """
+        Declare the file the data have been read from, and the parameters used to read it. If the data cache is
+        active (see the 'data cache' section of the configuration), the fitted background polynomials are then kept
+        on disk, and the same fit on the same data is not repeated.
+
+        :param filename: the data file
+        :param parameters: the parameters used to read the file (time window, trigger time...)
+        :return: none
+        """
+
+        self._data_cache_source = (filename, parameters)
+
+    def _get_polynomials_cache_entry(self):
+        """
+        Returns the data cache and the identification of the entry for the polynomials fitted on the current
+        selection, or None if the data cache is not active or the data file is not known
+
+        :return: (data_cache, filename, parameters) or None
+        """
+
+        data_cache = get_data_cache()
+
+        if data_cache is None or self._data_cache_source is None:
+
+            return None
+
+        filename, parameters = self._data_cache_source
+
+        cache_parameters = dict(parameters)
+
+        fit_config = threeML_config['event list']
+
+        cache_parameters['poly_intervals'] = tuple(zip(self._poly_intervals.start_times,
+                                                       self._poly_intervals.stop_times))
+        cache_parameters['unbinned'] = self._unbinned
+        cache_parameters['poly_order'] = self._user_poly_order
+        cache_parameters['fit_config'] = (fit_config['unbinned fit method'], fit_config['binned fit method'],
+                                          fit_config['binned fit bin width'], fit_config['newton solver'])
+
+        return data_cache, filename, cache_parameters
+
+    def _restore_polynomials_from_cache(self, cache_entry):
+        """
+        Restore the polynomials from the data cache, if they are there
+
+        :param cache_entry: the output of _get_polynomials_cache_entry
+        :return: True if the polynomials have been restored, False otherwise
+        """
+
+        if cache_entry is None:
+
+            return False
+
+        data_cache, filename, cache_parameters = cache_entry
+
+        cached = data_cache.get('polynomials', filename, **cache_parameters)
+
+        if cached is None:
+
+            return False
+
+        arrays, metadata = cached
+
+        self._polynomials = []
+
+        for n_coefficients, coefficients, covariance in zip(arrays['n_coefficients'], arrays['coefficients'],
+                                                           arrays['covariance']):
+
+            self._polynomials.append(Polynomial.from_previous_fit(np.array(coefficients[:n_coefficients]),
+                                                                  np.array(covariance[:n_coefficients,
+                                                                                      :n_coefficients])))
+
+        # the fit might have adjusted the intervals (for example to the bins of binned data)
+
+        poly_selections = np.array(metadata['poly_selections'], float)
+
+        self._poly_intervals = TimeIntervalSet.from_starts_and_stops(poly_selections[:, 0], poly_selections[:, 1])
+
+        self._optimal_polynomial_grade = metadata['poly_order']
+
+        self._fit_method_info['bin type'] = metadata['bin_type']
+        self._fit_method_info['fit method'] = metadata['fit_method']
+
+        return True
+
+    def _store_polynomials_in_cache(self, cache_entry):
+
+        if cache_entry is None:
+
+            return
+
+        data_cache, filename, cache_parameters = cache_entry
+
+        # the channels without counts have a polynomial of grade 0, so the coefficients and the covariance matrices
+        # are padded to the same size
+
+        n_coefficients = np.array([len(poly.coefficients) for poly in self._polynomials], int)
+
+        size = n_coefficients.max()
+
+        coefficients = np.zeros((len(self._polynomials), size))
+        covariance = np.zeros((len(self._polynomials), size, size))
+
+        for i, poly in enumerate(self._polynomials):
+
+            coefficients[i, :n_coefficients[i]] = poly.coefficients
+            covariance[i, :n_coefficients[i], :n_coefficients[i]] = poly.covariance_matrix
+
+        arrays = {'n_coefficients': n_coefficients, 'coefficients': coefficients, 'covariance': covariance}
+
+        metadata = {'poly_order': int(self._optimal_polynomial_grade),
+                    'poly_selections': list(zip(self._poly_intervals.start_times, self._poly_intervals.stop_times)),
+                    'bin_type': self._fit_method_info['bin type'],
+                    'fit_method': self._fit_method_info['fit method']}
+
+        data_cache.put('polynomials', filename, arrays, metadata, **cache_parameters)
+
     def save_background(self, filename, overwrite=False):
         """
         save the background to an HD5F